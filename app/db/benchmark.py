@@ -0,0 +1,191 @@
+# app/db/benchmark.py
+"""
+EXPLAIN ANALYZE benchmark of the SQL shapes the pipeline sends to Postgres.
+
+    python -m app.db.benchmark --out before.json            # time the corpus
+    python -m app.db.migrate
+    python -m app.db.benchmark --out after.json
+    python -m app.db.benchmark --compare before.json after.json
+
+    python -m app.db.benchmark --migrate                    # before, migrate, after, compare
+
+Use a local / seeded database: --seed-cities N first loads a synthetic
+dataset (N cities x 4 parameters x 1990-2024) through the bulk loader.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.db.session import SessionLocal
+
+# Representative LLM-generated SQL (ILIKE on names, rule 8) plus the compiled templates
+CORPUS = [
+    ("llm_city_series", """
+SELECT s.state_name AS state, c.city_name AS city, p.parameter_name AS parameter_name, p.unit AS unit,
+       yd.year AS year, yd.value AS value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE c.city_name ILIKE 'Ayodhya' AND p.parameter_name ILIKE 'Rainfall'
+ORDER BY yd.year"""),
+    ("llm_city_year", """
+SELECT s.state_name AS state, c.city_name AS city, p.parameter_name AS parameter_name, p.unit AS unit,
+       yd.year AS year, yd.value AS value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE c.city_name ILIKE '%ayodhya%' AND yd.year = 2015"""),
+    ("llm_state_average_range", """
+SELECT s.state_name AS state, p.parameter_name AS parameter_name, p.unit AS unit, yd.year AS year,
+       AVG(yd.value) AS value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE s.state_name ILIKE 'Uttar Pradesh' AND yd.year BETWEEN 2010 AND 2020
+GROUP BY s.state_name, p.parameter_name, p.unit, yd.year
+ORDER BY yd.year"""),
+    ("llm_state_compare", """
+SELECT s.state_name AS state, p.parameter_name AS parameter_name, p.unit AS unit, yd.year AS year,
+       AVG(yd.value) AS value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE (s.state_name ILIKE 'Uttar Pradesh' OR s.state_name ILIKE 'Bench State 1')
+  AND p.parameter_name ILIKE 'Groundwater Level'
+GROUP BY s.state_name, p.parameter_name, p.unit, yd.year"""),
+    ("compiled_city_series", """
+SELECT s.state_name AS state, c.city_name AS city, p.parameter_name AS parameter_name,
+       p.unit AS unit, yd.year AS year, yd.value AS value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE yd.city_id = ANY(ARRAY(SELECT city_id FROM cities WHERE city_name = 'Ayodhya'))
+  AND yd.parameter_id = ANY(ARRAY(SELECT parameter_id FROM parameters WHERE parameter_name = 'Rainfall'))
+  AND yd.year >= 2010
+ORDER BY c.city_name, p.parameter_name, yd.year"""),
+    ("compiled_state_average", """
+SELECT s.state_name AS state, p.parameter_name AS parameter_name,
+       p.unit AS unit, yd.year AS year, AVG(yd.value) AS value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE c.state_id = ANY(ARRAY(SELECT state_id FROM states WHERE state_name = 'Uttar Pradesh'))
+  AND yd.year = 2015
+GROUP BY s.state_name, p.parameter_name, p.unit, yd.year
+ORDER BY s.state_name, p.parameter_name, yd.year"""),
+]
+
+_PARAMETERS = [("Groundwater Level", "m"), ("Water Recharged", "bcm"), ("Rainfall", "mm"), ("Exploitation", "%")]
+
+
+def seed(n_cities: int, cities_per_state: int = 50):
+    """Synthetic dataset through the bulk loader (existing values are kept)."""
+    from app.utils.ingest import ingest_records
+
+    def records():
+        for i in range(n_cities):
+            state = f"Bench State {i // cities_per_state}"
+            for year in range(1990, 2025):
+                for parameter, unit in _PARAMETERS:
+                    yield state, f"Bench City {i}", parameter, unit, year, round(random.uniform(10, 500), 2)
+
+    report = ingest_records(records(), skip_existing=True)
+    print(f"✅ Seeded {report['inserted']} rows ({report['rows_per_minute']:,} rows/min)")
+
+
+def _scans(plan: dict, found=None) -> list:
+    """Scan nodes of a JSON plan, e.g. 'Seq Scan on yearly_data'."""
+    found = [] if found is None else found
+    if "Scan" in plan.get("Node Type", "") and plan.get("Relation Name"):
+        found.append(f"{plan['Node Type']} on {plan['Relation Name']}")
+    for child in plan.get("Plans", []):
+        _scans(child, found)
+    return found
+
+
+def run_corpus(runs: int = 5, label: str = "") -> dict:
+    """EXPLAIN ANALYZE every corpus query `runs` times; median timings in ms."""
+    results = {}
+    session = SessionLocal()
+    try:
+        for name, sql in CORPUS:
+            execution, planning = [], []
+            for _ in range(runs):
+                row = session.execute(text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)).scalar()
+                report = row[0] if isinstance(row, list) else json.loads(row)[0]
+                execution.append(report["Execution Time"])
+                planning.append(report["Planning Time"])
+            session.rollback()
+            results[name] = {
+                "execution_ms": round(statistics.median(execution), 3),
+                "planning_ms": round(statistics.median(planning), 3),
+                "rows": report["Plan"].get("Actual Rows"),
+                "scans": sorted(set(_scans(report["Plan"]))),
+            }
+    finally:
+        session.close()
+    return {"label": label, "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "runs": runs, "queries": results}
+
+
+def compare(before: dict, after: dict):
+    print(f"{'query':<28}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name, b in before["queries"].items():
+        a = after["queries"].get(name)
+        if a is None:
+            continue
+        speedup = b["execution_ms"] / a["execution_ms"] if a["execution_ms"] else float("inf")
+        print(f"{name:<28}{b['execution_ms']:>12.3f}{a['execution_ms']:>12.3f}{speedup:>9.1f}x")
+        if b["scans"] != a["scans"]:
+            print(f"{'':<4}{', '.join(b['scans'])}  ->  {', '.join(a['scans'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE timings of representative pipeline SQL.")
+    parser.add_argument("--out", help="write the timings to this JSON file")
+    parser.add_argument("--runs", type=int, default=5, help="executions per query (median is reported)")
+    parser.add_argument("--seed-cities", type=int, default=0, help="first load a synthetic dataset with this many cities")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two saved runs")
+    parser.add_argument("--migrate", action="store_true", help="run, apply pending migrations, run again and compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return
+    if args.seed_cities:
+        seed(args.seed_cities)
+    if args.migrate:
+        from app.db.migrate import migrate
+
+        before = run_corpus(args.runs, "before")
+        migrate()
+        session = SessionLocal()
+        try:
+            session.execute(text("ANALYZE"))
+            session.commit()
+        finally:
+            session.close()
+        after = run_corpus(args.runs, "after")
+        compare(before, after)
+        result = {"before": before, "after": after}
+    else:
+        result = run_corpus(args.runs, args.out or "")
+        for name, timing in result["queries"].items():
+            print(f"{name:<28}{timing['execution_ms']:>10.3f} ms  {', '.join(timing['scans'])}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
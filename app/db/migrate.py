@@ -0,0 +1,127 @@
+# app/db/migrate.py
+"""
+Versioned schema migrations.
+
+    python -m app.db.migrate            # apply pending migrations
+    python -m app.db.migrate --status   # list applied / pending
+    python -m app.db.migrate --target 2 # apply up to version 2
+
+Migrations are the numbered files in app/db/migrations (NNNN_description.sql).
+Each one runs in its own transaction and is recorded in schema_migrations
+with a checksum; an advisory lock keeps concurrent runs from racing.
+"""
+import argparse
+import hashlib
+import os
+import re
+
+from app.db.session import get_engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+_LOCK_ID = 72310001  # arbitrary, shared by every migrate run
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+  version INT PRIMARY KEY,
+  name VARCHAR(200) NOT NULL,
+  checksum CHAR(64) NOT NULL,
+  applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)"""
+
+
+def load_migrations(directory: str = MIGRATIONS_DIR):
+    """[(version, name, sql, checksum)] sorted by version."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _FILE.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            sql = f.read()
+        checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        migrations.append((int(match.group(1)), match.group(2), sql, checksum))
+    migrations.sort()
+    versions = [m[0] for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def _applied(cur) -> dict:
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return {version: checksum.strip() for version, checksum in cur.fetchall()}
+
+
+def status() -> list:
+    conn = get_engine().raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(_CREATE_TABLE)
+        conn.commit()
+        applied = _applied(cur)
+    finally:
+        conn.close()
+    rows = []
+    for version, name, _, checksum in load_migrations():
+        state = "pending"
+        if version in applied:
+            state = "applied" if applied[version] == checksum else "applied (file changed since)"
+        rows.append({"version": version, "name": name, "state": state})
+    return rows
+
+
+def migrate(target: int = None) -> list:
+    """Apply pending migrations up to `target` (default: all). Returns the applied versions."""
+    done = []
+    conn = get_engine().raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (_LOCK_ID,))
+        try:
+            cur.execute(_CREATE_TABLE)
+            conn.commit()
+            applied = _applied(cur)
+            for version, name, sql, checksum in load_migrations():
+                if target is not None and version > target:
+                    break
+                if version in applied:
+                    if applied[version] != checksum:
+                        print(f"⚠️  Migration {version:04d}_{name} changed after it was applied")
+                    continue
+                try:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                        (version, name, checksum),
+                    )
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise RuntimeError(f"Migration {version:04d}_{name} failed: {e}")
+                print(f"✅ Applied {version:04d}_{name}")
+                done.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_ID,))
+            conn.commit()
+    finally:
+        conn.close()
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the SQL migrations in app/db/migrations.")
+    parser.add_argument("--status", action="store_true", help="only list applied / pending migrations")
+    parser.add_argument("--target", type=int, default=None, help="apply up to this version")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        for row in status():
+            print(f"{row['version']:04d}_{row['name']}: {row['state']}")
+        return
+    if not migrate(args.target):
+        print("Nothing to migrate.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+-- Base tables (the schema described in QueryService's prompt). Existing
+-- databases already have them, so this only matters for fresh / local ones.
+CREATE TABLE IF NOT EXISTS states (
+  state_id SERIAL PRIMARY KEY,
+  state_name VARCHAR(100)
+);
+
+CREATE TABLE IF NOT EXISTS cities (
+  city_id SERIAL PRIMARY KEY,
+  city_name VARCHAR(100),
+  state_id INT REFERENCES states(state_id)
+);
+
+CREATE TABLE IF NOT EXISTS parameters (
+  parameter_id SERIAL PRIMARY KEY,
+  parameter_name VARCHAR(100),
+  unit VARCHAR(50)
+);
+
+CREATE TABLE IF NOT EXISTS yearly_data (
+  data_id SERIAL PRIMARY KEY,
+  city_id INT REFERENCES cities(city_id),
+  parameter_id INT REFERENCES parameters(parameter_id),
+  year INT,
+  value FLOAT
+);
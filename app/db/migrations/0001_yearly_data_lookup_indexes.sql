@@ -0,0 +1,6 @@
+-- Indexes for the query shapes of the pipeline (see QueryService rules):
+-- city series / comparisons filter yearly_data by city, parameter and year,
+-- state averages reach yearly_data through cities.state_id.
+CREATE INDEX IF NOT EXISTS ix_yearly_data_city_param_year ON yearly_data (city_id, parameter_id, year);
+CREATE INDEX IF NOT EXISTS ix_yearly_data_parameter_year ON yearly_data (parameter_id, year);
+CREATE INDEX IF NOT EXISTS ix_cities_state_id ON cities (state_id);
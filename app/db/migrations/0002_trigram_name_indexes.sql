@@ -0,0 +1,14 @@
+-- Generated SQL matches names with ILIKE (rule 8); trigram GIN indexes serve
+-- both exact-but-case-insensitive and '%partial%' patterns.
+-- Servers without the pg_trgm extension skip them with a warning.
+DO $$
+BEGIN
+  CREATE EXTENSION IF NOT EXISTS pg_trgm;
+  CREATE INDEX IF NOT EXISTS ix_states_state_name_trgm ON states USING gin (state_name gin_trgm_ops);
+  CREATE INDEX IF NOT EXISTS ix_cities_city_name_trgm ON cities USING gin (city_name gin_trgm_ops);
+  CREATE INDEX IF NOT EXISTS ix_parameters_parameter_name_trgm ON parameters USING gin (parameter_name gin_trgm_ops);
+EXCEPTION
+  WHEN feature_not_supported OR undefined_file OR insufficient_privilege THEN
+    RAISE WARNING 'pg_trgm is not available (%), trigram indexes skipped', SQLERRM;
+END
+$$;
@@ -0,0 +1,14 @@
+-- One value per (city, parameter, year) so loaders can use ON CONFLICT.
+-- Existing duplicates keep the most recently inserted row.
+DELETE FROM yearly_data yd
+USING yearly_data newer
+WHERE newer.city_id = yd.city_id
+  AND newer.parameter_id = yd.parameter_id
+  AND newer.year = yd.year
+  AND newer.data_id > yd.data_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_yearly_data_city_param_year ON yearly_data (city_id, parameter_id, year);
+ALTER TABLE yearly_data ADD CONSTRAINT uq_yearly_data_city_param_year UNIQUE USING INDEX uq_yearly_data_city_param_year;
+
+-- the unique index covers the same lookups
+DROP INDEX IF EXISTS ix_yearly_data_city_param_year;
@@ -1,25 +1,157 @@
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+import asyncio
 import os
 from dotenv import load_dotenv
+from app.services import metrics_service
 
 # Load environment variables from .env
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Pool / logging settings (shared by the sync and async engines)
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
 
+_POOL_OPTIONS = dict(
+    echo=DB_ECHO,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
 
-# Create engine
-engine = create_engine(DATABASE_URL, echo=True)
+_engine = None
+_async_engine = None
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
+
+
+def get_engine():
+    """
+    Sync engine (scripts, loaders, background refreshes), created on first use
+    so importing the app never touches the database.
+    """
+    global _engine
+    if _engine is None:
+        if not DATABASE_URL:
+            raise RuntimeError("Please set DATABASE_URL in .env")
+        _engine = create_engine(DATABASE_URL, **_POOL_OPTIONS)
+    return _engine
+
+
+def SessionLocal():
+    """New ORM session on the sync engine (same call as the old sessionmaker)."""
+    return _session_factory(bind=get_engine())
+
+
+def _async_url_and_args(url: str):
+    """
+    Convert a postgresql:// URL to the asyncpg driver.
+    asyncpg does not understand libpq's `sslmode`, it takes `ssl` instead.
+    """
+    url = make_url(url)
+    connect_args = {}
+    query = dict(url.query)
+    sslmode = query.pop("sslmode", None)
+    if sslmode and sslmode != "disable":
+        connect_args["ssl"] = sslmode
+    url = url.set(drivername="postgresql+asyncpg", query=query)
+    return url, connect_args
+
+
+def get_async_engine():
+    """
+    Async engine (asyncpg) used on the request path, created on first use.
+    """
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        if not DATABASE_URL:
+            raise RuntimeError("Please set DATABASE_URL in .env")
+        url, connect_args = _async_url_and_args(DATABASE_URL)
+        _async_engine = create_async_engine(url, connect_args=connect_args, **_POOL_OPTIONS)
+    return _async_engine
+
+
+def pool_status() -> dict:
+    """Connections of the async (request path) pool; empty before first use."""
+    if _async_engine is None:
+        return {}
+    pool = _async_engine.pool
+    return {
+        "size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+    }
+
+
+def _collect_metrics():
+    status = pool_status()
+    if not status:
+        return []
+    return [
+        ("db_pool_checked_out", "gauge", "Async pool connections in use.", [({}, status["checked_out"])]),
+        ("db_pool_capacity", "gauge", "Async pool size plus max overflow.", [({}, status["size"] + status["max_overflow"])]),
+    ]
+
+
+metrics_service.registry.register_collector(_collect_metrics)
+
+
+async def dispose_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+async def dispose_engines():
+    """Close both pools (app shutdown)."""
+    global _engine
+    await dispose_async_engine()
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+async def open_pool_connections(count: int, timeout: float = None):
+    """
+    Open `count` async pool connections at once and return them to the pool,
+    so the first requests do not pay for TCP / TLS / auth.
+    """
+    engine = get_async_engine()
+
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    count = max(1, min(count, DB_POOL_SIZE))
+    await asyncio.wait_for(asyncio.gather(*(ping() for _ in range(count))), timeout)
+    return count
+
+
+async def ping_async(timeout: float = 2.0):
+    """SELECT 1 on the request-path pool; raises on failure or timeout."""
+    async def ping():
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.wait_for(ping(), timeout)
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Function to test DB connection
 def test_db_connection():
     try:
-        with engine.connect() as conn:
+        with get_engine().connect() as conn:
             conn.execute(text("SELECT 1"))  # simple test query
         print("✅ DB Connected!")
     except Exception as e:
@@ -32,4 +164,3 @@ def get_db():
         yield db
     finally:
         db.close()
-        
@@ -1,13 +1,18 @@
+import os
 from sqlalchemy import text
-from app.db.session import SessionLocal
+from app.db.session import SessionLocal, get_async_engine, DB_STATEMENT_TIMEOUT_MS
+from app.utils.result_frame import FrameBuilder, ResultFrame
 
-def run_sql_query(sql: str):
+# Rows pulled per round trip from the server-side cursor of fetch_frame_async
+RESULT_FETCH_ROWS = int(os.getenv("RESULT_FETCH_ROWS", "2000"))
+
+def run_sql_query(sql: str, params: dict = None):
     """
-    Run raw SQL and return results as dict (columns + rows).
+    Run raw SQL (optionally with bound parameters) and return results as dict (columns + rows).
     """
     session = SessionLocal()
     try:
-        result = session.execute(text(sql))
+        result = session.execute(text(sql), params or {})
         rows = [list(row) for row in result.fetchall()]
         columns = result.keys()
         return {"columns": list(columns), "rows": rows}
@@ -15,3 +20,74 @@ def run_sql_query(sql: str):
         raise Exception(f"SQL Execution Error: {e}")
     finally:
         session.close()
+
+
+def _settings(timeout_ms: int, read_only: bool):
+    timeout_ms = DB_STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    settings = "set_config('statement_timeout', :timeout_ms, true)"
+    if read_only:
+        settings += ", set_config('transaction_read_only', 'on', true)"
+    return text(f"SELECT {settings}"), {"timeout_ms": str(int(timeout_ms))}
+
+
+async def run_sql_query_async(sql: str, params: dict = None, timeout_ms: int = None, read_only: bool = True):
+    """
+    Async version of run_sql_query on the pooled asyncpg engine.
+    The statement runs in its own transaction with a local statement_timeout
+    and, by default, in read-only mode.
+    """
+    try:
+        async with get_async_engine().connect() as conn:
+            await conn.execute(*_settings(timeout_ms, read_only))
+            result = await conn.execute(text(sql), params or {})
+            rows = [list(row) for row in result.fetchall()]
+            columns = result.keys()
+            await conn.rollback()
+            return {"columns": list(columns), "rows": rows}
+    except Exception as e:
+        raise Exception(f"SQL Execution Error: {e}")
+
+
+async def fetch_frame_async(sql: str, params: dict = None, timeout_ms: int = None) -> ResultFrame:
+    """
+    Read-only query result as a ResultFrame. Rows come through a server-side
+    cursor, RESULT_FETCH_ROWS at a time, straight into column buffers.
+    """
+    try:
+        async with get_async_engine().connect() as conn:
+            await conn.execute(*_settings(timeout_ms, True))
+            result = await conn.stream(text(sql), params or {})
+            builder = FrameBuilder(list(result.keys()))
+            async for rows in result.partitions(RESULT_FETCH_ROWS):
+                builder.extend(rows)
+            await conn.rollback()
+            return builder.build()
+    except Exception as e:
+        raise Exception(f"SQL Execution Error: {e}")
+
+
+_DATA_VERSION_SQL = """
+SELECT
+  (SELECT COALESCE(MAX(data_id), 0) FROM yearly_data),
+  (SELECT COALESCE(n_tup_ins + n_tup_upd + n_tup_del, 0)
+     FROM pg_stat_user_tables WHERE relname = 'yearly_data')
+"""
+
+
+def get_data_version() -> str:
+    """
+    Cheap fingerprint of `yearly_data`: highest id + total writes seen by Postgres.
+    Changes whenever rows are inserted, updated or deleted (by any process).
+    """
+    session = SessionLocal()
+    try:
+        row = session.execute(text(_DATA_VERSION_SQL)).fetchone()
+        return f"{row[0]}:{row[1] or 0}"
+    finally:
+        session.close()
+
+
+async def get_data_version_async() -> str:
+    result = await run_sql_query_async(_DATA_VERSION_SQL)
+    row = result["rows"][0]
+    return f"{row[0]}:{row[1] or 0}"
@@ -1,8 +1,12 @@
 # app/main.py
 from fastapi import FastAPI,HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routers import groundwater
 from app.routers import nlp_router
-from app.db.session import test_db_connection
+from app.services.metrics_service import registry
+from app.services.precompute_service import precomputer
+from app.services.startup_service import startup
+from app.services.tracing_service import TracingMiddleware
 from contextlib import asynccontextmanager
 
 
@@ -12,20 +16,45 @@ from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup code
-    test_db_connection()
+    # Startup code: warm-up (pool connections, gazetteer, cube, LLM client), see WARMUP
+    await startup.start()
+    # query log + background precompute of the most asked questions, see PRECOMPUTE_TOP_N
+    precomputer.start()
     yield
-    # Shutdown code (if needed)
+    # Shutdown code
     print("Shutting down...")
+    await precomputer.stop()
+    await startup.stop()
 
 app = FastAPI(lifespan=lifespan,
               title= "Groundwater Ai bot"
 
               )
+# request IDs, per-stage timings, slow-request log
+app.add_middleware(TracingMiddleware)
+
 # include router
 app.include_router(groundwater.router)
 app.include_router(nlp_router.router)
 
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+def health_live():
+    """Liveness: the process answers (no dependency checks)."""
+    return startup.liveness()
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 503 until warm-up is done and the DB / LLM client are usable."""
+    ready, details = await startup.readiness()
+    return JSONResponse(details, status_code=200 if ready else 503)
+
 @app.get("/")
 def root():
     return {"message": "Groundwater AI Bot Backend is running 🚀"}
@@ -1,10 +1,116 @@
-from fastapi import APIRouter
+import os
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+from app.db.utils import get_data_version_async
+from app.services import analytics_service, cache_service
+from app.services.analytics_service import UnknownName
+from app.utils.fast_json import FastJSONResponse
+
+# Browsers / CDNs may reuse a response this long (seconds), then revalidate with If-None-Match
+GROUNDWATER_CACHE_MAX_AGE = int(os.getenv("GROUNDWATER_CACHE_MAX_AGE", "300"))
 
 router = APIRouter(
     prefix="/groundwater",
     tags=["Groundwater"]
 )
 
+_State = Query([], description="State name or ID (repeatable)")
+_City = Query([], description="City name or ID (repeatable)")
+_Parameter = Query([], description="Parameter name or ID (repeatable, default all)")
+
+
 @router.get("/test")
 def test_groundwater():
     return {"message": "Groundwater router working ✅"}
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in header.split(",")]
+
+
+async def _cached(request: Request, compute):
+    """
+    ETag from the data version + request; a matching If-None-Match gets 304
+    without running the query. While the version is unknown (probe failing)
+    there is nothing to tag: no ETag, and clients must not cache the body.
+    """
+    version = await cache_service.get_data_version_async(get_data_version_async)
+    if version == "unknown":
+        headers = {"Cache-Control": "no-store"}
+    else:
+        etag = analytics_service.etag(version, request.url.path, list(request.query_params.multi_items()))
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={GROUNDWATER_CACHE_MAX_AGE}",
+        }
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+    try:
+        body = await compute()
+    except UnknownName as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return FastJSONResponse({**body, "data_version": version}, headers=headers)
+
+
+@router.get("/series")
+async def series(
+    request: Request,
+    state: List[str] = _State,
+    city: List[str] = _City,
+    parameter: List[str] = _Parameter,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    max_points: Optional[int] = Query(None, ge=2, description="Downsample each series to at most this many points"),
+    page: int = Query(1, ge=1),
+    page_size: Optional[int] = Query(None, ge=1),
+):
+    """
+    Yearly values per location x parameter (state level = average of its cities).
+    No LLM: answered from the aggregate cube, the result cache or template SQL.
+    """
+    async def compute():
+        intent = await analytics_service.build_intent(state, city, parameter, year_from, year_to)
+        return await analytics_service.series(intent, max_points, page, page_size)
+    return await _cached(request, compute)
+
+
+@router.get("/compare")
+async def compare(
+    request: Request,
+    state: List[str] = _State,
+    city: List[str] = _City,
+    parameter: List[str] = _Parameter,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    max_points: Optional[int] = Query(None, ge=2, description="Max years on the shared axis"),
+):
+    """Two or more locations on one year axis ({"years", "series": [{..., "values"}]})."""
+    async def compute():
+        intent = await analytics_service.build_intent(state, city, parameter, year_from, year_to)
+        return await analytics_service.compare(intent, max_points)
+    return await _cached(request, compute)
+
+
+@router.get("/summary")
+async def summary(
+    request: Request,
+    state: List[str] = _State,
+    city: List[str] = _City,
+    parameter: List[str] = _Parameter,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    page: int = Query(1, ge=1),
+    page_size: Optional[int] = Query(None, ge=1),
+):
+    """Per series: first / last / min / max / mean, trend per year and the biggest year-over-year changes."""
+    async def compute():
+        intent = await analytics_service.build_intent(state, city, parameter, year_from, year_to)
+        return await analytics_service.summary(intent, page, page_size)
+    return await _cached(request, compute)
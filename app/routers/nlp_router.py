@@ -1,7 +1,35 @@
 # app/routers/nlp_router.py
+import json
+import logging
+from typing import List, Optional
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.pipeline_service import run_pipeline
+from app.services.pipeline_service import (
+    run_pipeline,
+    stream_pipeline,
+    run_pipeline_batch,
+    iter_pipeline_batch,
+    run_session_turn,
+    BATCH_MAX_ITEMS,
+    get_coalescing_stats,
+    get_mode_stats,
+    get_smalltalk_stats,
+    PIPELINE_MODES,
+)
+from app.services.llm_client import llm_client
+from app.services.cache_service import get_cache_stats
+from app.services.sql_compiler_service import sql_compiler
+from app.services.gazetteer_service import gazetteer
+from app.services.aggregate_service import aggregate_cube
+from app.services.sql_guard_service import sql_guard
+from app.services.startup_service import startup
+from app.services.precompute_service import precomputer
+from app.services.prompt_service import prompts
+from app.services.session_service import sessions, SESSION_TTL_SECONDS
+from app.utils import compact_util
+from app.utils.fast_json import FastJSONResponse, dumps
+from app.utils.result_frame import ORIENTS
 
 router = APIRouter(prefix="/nlp", tags=["NLP"])
 
@@ -10,18 +38,167 @@ router = APIRouter(prefix="/nlp", tags=["NLP"])
 
 class NormalizeRequest(BaseModel):
     text: str
+    mode: Optional[str] = None  # "two_call" | "plan", defaults to PIPELINE_MODE
+    result_format: str = "rows"  # "rows" | "columns" (column-major results)
 
 class NormalizeResponse(BaseModel):
     result : dict
+
+
+def _check_mode(mode: Optional[str]):
+    if mode is not None and mode not in PIPELINE_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {PIPELINE_MODES}")
+
+
+def _check_format(result_format: str):
+    if result_format not in ORIENTS:
+        raise HTTPException(status_code=422, detail=f"result_format must be one of {ORIENTS}")
+
+
 @router.post("/pipeline", response_model=NormalizeResponse)
 async def normalize(req: NormalizeRequest):
+    _check_mode(req.mode)
+    _check_format(req.result_format)
     try:
-        result = await run_pipeline(req.text)
-        return {
-           "result" : result
-        }
+        result = await run_pipeline(req.text, req.mode)
+        return FastJSONResponse({"result": result}, orient=req.result_format)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
 
-    
\ No newline at end of file
+
+def _sse_response(text: str, mode: Optional[str], result_format: str = "rows") -> StreamingResponse:
+    async def events():
+        try:
+            async for event, data in stream_pipeline(text, mode):
+                yield f"event: {event}\ndata: {dumps(data, result_format).decode('utf-8')}\n\n"
+        except Exception as e:
+            logging.error(f"[Pipeline ERROR] Stream failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/pipeline/stream")
+async def normalize_stream(req: NormalizeRequest):
+    """Server-sent events: normalized, sql, results, answer_delta..., done."""
+    _check_mode(req.mode)
+    _check_format(req.result_format)
+    return _sse_response(req.text, req.mode, req.result_format)
+
+
+@router.get("/pipeline/stream")
+async def normalize_stream_get(text: str, mode: Optional[str] = None, result_format: str = "rows"):
+    """Same as POST /nlp/pipeline/stream, usable from a browser EventSource."""
+    _check_mode(mode)
+    _check_format(result_format)
+    return _sse_response(text, mode, result_format)
+
+
+class BatchRequest(BaseModel):
+    queries: List[str]
+    mode: Optional[str] = None
+    format: str = "json"  # "json" | "ndjson"
+    concurrency: Optional[int] = None
+    result_format: str = "rows"  # "rows" | "columns"
+
+
+@router.post("/pipeline/batch")
+async def normalize_batch(req: BatchRequest):
+    """
+    Run many queries at once. Every item gets its own result or error;
+    one failing item never fails the batch.
+    """
+    _check_mode(req.mode)
+    _check_format(req.result_format)
+    if req.format not in ("json", "ndjson"):
+        raise HTTPException(status_code=422, detail="format must be 'json' or 'ndjson'")
+    if len(req.queries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} queries per batch")
+    if req.concurrency is not None and req.concurrency < 1:
+        raise HTTPException(status_code=422, detail="concurrency must be >= 1")
+
+    if req.format == "json":
+        try:
+            return FastJSONResponse(
+                await run_pipeline_batch(req.queries, req.mode, req.concurrency), orient=req.result_format
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def lines():
+        try:
+            async for item in iter_pipeline_batch(req.queries, req.mode, req.concurrency):
+                yield dumps(item, req.result_format) + b"\n"
+        except Exception as e:
+            logging.error(f"[Pipeline ERROR] Batch failed: {e}")
+            yield dumps({"error": str(e)}) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# ----- conversation sessions -----
+def _session(session_id: str):
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return session
+
+
+@router.post("/sessions")
+def create_session():
+    """Start a conversation; send its turns to /nlp/sessions/{session_id}/query."""
+    session = sessions.create()
+    return {"session_id": session.id, "ttl_seconds": SESSION_TTL_SECONDS}
+
+
+@router.post("/sessions/{session_id}/query", response_model=NormalizeResponse)
+async def session_query(session_id: str, req: NormalizeRequest):
+    """
+    Like /nlp/pipeline, but follow-ups ("and for Mirzapur?", "now show rainfall too")
+    build on the previous turn. Extra fields: session_id, turn, followup, fetch, slots.
+    """
+    _check_mode(req.mode)
+    _check_format(req.result_format)
+    session = _session(session_id)
+    try:
+        result = await run_session_turn(session, req.text, req.mode)
+        return FastJSONResponse({"result": result}, orient=req.result_format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    """Current slots, last SQL and the recent turns."""
+    return _session(session_id).describe()
+
+
+@router.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"deleted": session_id}
+
+
+@router.get("/stats")
+def pipeline_stats():
+    return {
+        "llm": llm_client.get_stats(),
+        "coalescing": get_coalescing_stats(),
+        "cache": get_cache_stats(),
+        "sql_compiler": sql_compiler.get_report(),
+        "gazetteer": gazetteer.get_stats(),
+        "aggregate_cube": aggregate_cube.get_stats(),
+        "sql_guard": sql_guard.get_report(),
+        "compaction": compact_util.get_stats(),
+        "startup": startup.get_stats(),
+        "precompute": precomputer.get_stats(),
+        "sessions": sessions.get_stats(),
+        "prompts": prompts.get_stats(),
+        "pipeline_modes": get_mode_stats(),
+        "smalltalk": get_smalltalk_stats(),
+    }
@@ -0,0 +1,346 @@
+# app/services/aggregate_service.py
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from app.db.session import get_engine
+from app.db.utils import run_sql_query_async
+from app.services.gazetteer_service import gazetteer
+
+_ENABLED = os.getenv("AGGREGATE_CUBE", "true").lower() in ("1", "true", "yes")
+_MAX_CELLS = int(os.getenv("AGGREGATE_MAX_CELLS", "5000000"))
+MATVIEW_ENABLED = os.getenv("AGGREGATE_MATVIEW", "false").lower() in ("1", "true", "yes")
+# Seconds before a failed refresh is retried, doubling per failure up to the max
+_RETRY_MIN_SECONDS = 5.0
+_RETRY_MAX_SECONDS = 300.0
+
+_ROWS_SQL = """
+SELECT yd.data_id, yd.city_id, c.state_id, yd.parameter_id, yd.year, yd.value
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+WHERE yd.data_id > :after
+ORDER BY yd.data_id"""
+_COUNT_SQL = "SELECT COUNT(*) FROM yearly_data"
+
+MATVIEW_NAME = "state_yearly_summary"
+_MATVIEW_CREATE = [
+    f"""CREATE MATERIALIZED VIEW IF NOT EXISTS {MATVIEW_NAME} AS
+SELECT c.state_id, yd.parameter_id, yd.year, AVG(yd.value) AS value, COUNT(*) AS row_count
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+GROUP BY c.state_id, yd.parameter_id, yd.year""",
+    # unique index is required for REFRESH ... CONCURRENTLY
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {MATVIEW_NAME}_key ON {MATVIEW_NAME} (state_id, parameter_id, year)",
+]
+_MATVIEW_REFRESH = f"REFRESH MATERIALIZED VIEW CONCURRENTLY {MATVIEW_NAME}"
+
+
+def _parse_version(version):
+    """'max_data_id:writes' -> (max_data_id, writes), None when not parseable."""
+    try:
+        max_id, writes = str(version).split(":")
+        return int(max_id), int(writes)
+    except (TypeError, ValueError):
+        return None
+
+
+def _grow(array, axis: int, size: int, front: int = 0):
+    """Pad `array` along `axis` to `size` (adding `front` slots before the old data)."""
+    extra = size - array.shape[axis]
+    if extra <= 0:
+        return array
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (front, extra - front)
+    return np.pad(array, pad)
+
+
+class AggregateCube:
+    """
+    NumPy copy of `yearly_data` as a dense city x parameter x year grid
+    (sum of values, non-null count and row count per cell) plus the same grid
+    rolled up per state. Answers compiled intents (city series, state
+    averages, comparisons, year ranges) with the columns / order of the
+    SQLCompiler templates, without a DB round trip.
+    New rows are appended incrementally (data_id > last seen); anything
+    else (updates, deletes) triggers a full reload.
+    Requests never wait for a load: they schedule it in the background and
+    are answered by SQL until the cube is at their data version.
+    """
+
+    def __init__(self):
+        self.enabled = _ENABLED
+        self.view_ready = False
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._wanted = None      # latest data version seen by a request
+        self._failures = 0
+        self._retry_at = 0.0
+        self._reset()
+        self._stats = {"answered": 0, "declined": 0, "full_loads": 0, "incremental_loads": 0, "last_load_ms": 0.0,
+                       "failed_loads": 0}
+
+    def _reset(self):
+        self._city_rows = {}     # city_id -> row in the city grid
+        self._state_rows = {}    # state_id -> row in the state grid
+        self._param_cols = {}    # parameter_id -> column
+        self._city_state = []    # city row -> state row
+        self._year0 = None
+        self._sums = np.zeros((0, 0, 0))
+        self._valid = np.zeros((0, 0, 0), dtype=np.int32)
+        self._count = np.zeros((0, 0, 0), dtype=np.int32)
+        self._state_sums = self._sums
+        self._state_valid = self._valid
+        self._state_count = self._count
+        self._last_data_id = 0
+        self._total = 0          # rows of yearly_data seen
+        self._writes = None      # pg_stat write counter accounted for
+        self._version = None
+
+    # ----- loading -----
+    def schedule(self, version: str):
+        """
+        Request path: start bringing the cube / view up to `version` in the background
+        and return at once. Until it is there, answer() declines and the view is not
+        used (view_ready is False), so the query runs on yearly_data.
+        """
+        if version == self._version or not (self.enabled or MATVIEW_ENABLED):
+            return
+        self._wanted = version
+        self.view_ready = False  # the view is at an older version
+        if self._task is not None and not self._task.done():
+            return  # the running refresh picks up the latest version when done
+        if time.time() < self._retry_at:
+            return  # backing off after a failed load
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # fresh context: the load does not inherit the trace / deadline of the request
+        self._task = loop.create_task(self._catch_up(), context=contextvars.Context())
+
+    async def _catch_up(self):
+        while self._wanted is not None and self._wanted != self._version:
+            if not await self.ensure_fresh(self._wanted):
+                break
+
+    async def ensure_fresh(self, version: str) -> bool:
+        """
+        Bring the cube (and the materialized view, if enabled) up to `version` (warm-up
+        and the background task). False when the load failed; retried after a backoff.
+        """
+        if version == self._version or not (self.enabled or MATVIEW_ENABLED):
+            return True
+        async with self._lock:
+            if version == self._version:
+                return True
+            self._version = None  # answer() declines while the grid changes
+            self.view_ready = False
+            started = time.perf_counter()
+            if MATVIEW_ENABLED:
+                try:
+                    await asyncio.to_thread(self._refresh_view)
+                except Exception as e:
+                    logging.error(f"[Aggregate ERROR] Materialized view refresh failed: {e}")
+                    self.view_ready = False
+            if self.enabled:
+                try:
+                    await self._load(version)
+                except Exception as e:
+                    self._reset()
+                    self._failed(e)
+                    return False
+            self._version = version
+            self._failures = 0
+            self._retry_at = 0.0
+            self._stats["last_load_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            return True
+
+    def _failed(self, error: Exception):
+        self._failures += 1
+        self._stats["failed_loads"] += 1
+        delay = min(_RETRY_MAX_SECONDS, _RETRY_MIN_SECONDS * 2 ** (self._failures - 1))
+        self._retry_at = time.time() + delay
+        logging.error(f"[Aggregate ERROR] Cube refresh failed, SQL answers, retry in {delay:.0f}s: {error}")
+
+    def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def _load(self, version: str):
+        parsed = _parse_version(version)
+        incremental = self._writes is not None and parsed is not None
+        rows = (await run_sql_query_async(_ROWS_SQL, {"after": self._last_data_id if incremental else 0}))["rows"]
+        if incremental:
+            # Pure inserts: nothing disappeared and the write counter did not move
+            # by more than the new rows (pg_stat counters may lag, never lead)
+            total = (await run_sql_query_async(_COUNT_SQL))["rows"][0][0]
+            if total != self._total + len(rows) or parsed[1] - self._writes > len(rows):
+                incremental = False
+                rows = (await run_sql_query_async(_ROWS_SQL, {"after": 0}))["rows"]
+        if incremental:
+            self._writes += len(rows)
+        else:
+            self._reset()
+            self._writes = parsed[1] if parsed else None
+        self._total += len(rows)
+        # list / NumPy work over the whole table: keep it off the event loop
+        await asyncio.to_thread(self._apply, rows)
+        self._stats["incremental_loads" if incremental else "full_loads"] += 1
+        logging.info(
+            f"[Aggregate] {'Appended' if incremental else 'Loaded'} {len(rows)} rows, "
+            f"grid {self._sums.shape} ({len(self._state_rows)} states)"
+        )
+
+    def _apply(self, rows):
+        # rows without city / parameter / year cannot be placed in the grid
+        rows = [r for r in rows if None not in r[:5]]
+        if not rows:
+            return
+        data = np.array([r[:5] for r in rows], dtype=np.int64)
+        values = np.array([np.nan if r[5] is None else float(r[5]) for r in rows])
+
+        for city_id, state_id in dict(zip(data[:, 1].tolist(), data[:, 2].tolist())).items():
+            if city_id not in self._city_rows:
+                self._city_rows[city_id] = len(self._city_rows)
+                self._city_state.append(self._state_rows.setdefault(state_id, len(self._state_rows)))
+        for parameter_id in dict.fromkeys(data[:, 3].tolist()):
+            self._param_cols.setdefault(parameter_id, len(self._param_cols))
+
+        low, high = int(data[:, 4].min()), int(data[:, 4].max())
+        front = 0 if self._year0 is None else max(0, self._year0 - low)
+        year0 = low if self._year0 is None else min(self._year0, low)
+        n_years = max(high - year0 + 1, self._sums.shape[2] + front)
+        shape = (len(self._city_rows), len(self._param_cols), n_years)
+        if shape[0] * shape[1] * shape[2] > _MAX_CELLS:
+            self.enabled = False
+            raise RuntimeError(f"grid {shape} exceeds AGGREGATE_MAX_CELLS, cube disabled")
+
+        grids = []
+        for grid in (self._sums, self._valid, self._count):
+            grid = _grow(grid, 0, shape[0])
+            grid = _grow(grid, 1, shape[1])
+            grids.append(_grow(grid, 2, shape[2], front))
+        self._sums, self._valid, self._count = grids
+        self._year0 = year0
+
+        cells = (
+            np.array([self._city_rows[c] for c in data[:, 1].tolist()]),
+            np.array([self._param_cols[p] for p in data[:, 3].tolist()]),
+            data[:, 4] - year0,
+        )
+        present = ~np.isnan(values)
+        np.add.at(self._sums, cells, np.where(present, values, 0.0))
+        np.add.at(self._valid, cells, present.astype(np.int32))
+        np.add.at(self._count, cells, 1)
+        self._last_data_id = max(self._last_data_id, int(data[:, 0].max()))
+
+        # state rollups: sum the city grids of each state
+        states = np.array(self._city_state)
+        n_states = len(self._state_rows)
+        self._state_sums = np.zeros((n_states,) + shape[1:])
+        self._state_valid = np.zeros((n_states,) + shape[1:], dtype=np.int32)
+        self._state_count = np.zeros((n_states,) + shape[1:], dtype=np.int32)
+        np.add.at(self._state_sums, states, self._sums)
+        np.add.at(self._state_valid, states, self._valid)
+        np.add.at(self._state_count, states, self._count)
+
+    def _refresh_view(self):
+        with get_engine().begin() as conn:
+            for statement in _MATVIEW_CREATE:
+                conn.execute(text(statement))
+        # CONCURRENTLY cannot run inside a transaction block
+        with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(_MATVIEW_REFRESH))
+        self.view_ready = True
+
+    # ----- answering -----
+    def _year_columns(self, intent: dict):
+        years = np.arange(self._year0, self._year0 + self._sums.shape[2])
+        mask = np.ones(len(years), dtype=bool)
+        if intent["years"]:
+            mask &= np.isin(years, intent["years"])
+        if intent["year_from"] is not None:
+            mask &= years >= intent["year_from"]
+        if intent["year_to"] is not None:
+            mask &= years <= intent["year_to"]
+        return np.nonzero(mask)[0]
+
+    def answer(self, intent: dict, version: str):
+        """
+        Result dict ({"columns", "rows"}) for a compiled intent, or None when the
+        cube is disabled / not at `version` or the DB has to answer
+        (duplicate city rows, names not in the gazetteer yet).
+        """
+        if not self.enabled or version != self._version or self._year0 is None:
+            return None
+        result = self._answer(intent)
+        self._stats["declined" if result is None else "answered"] += 1
+        return result
+
+    def _answer(self, intent: dict):
+        city_level = intent["level"] == "city"
+        ids = intent["city_ids"] if city_level else intent["state_ids"]
+        index = self._city_rows if city_level else self._state_rows
+        names = gazetteer.cities if city_level else gazetteer.states
+        if any(i not in names for i in ids):
+            return None
+
+        parameter_ids = intent["parameter_ids"] or list(self._param_cols)
+        parameters = sorted(
+            (gazetteer.parameters[p] + (self._param_cols[p],) for p in parameter_ids
+             if p in self._param_cols and p in gazetteer.parameters),
+        )
+        if len(parameters) < len([p for p in parameter_ids if p in self._param_cols]):
+            return None
+        param_cols = np.array([col for _, _, col in parameters], dtype=np.int64)
+        year_cols = self._year_columns(intent)
+        columns = (["state", "city"] if city_level else ["state"]) + ["parameter_name", "unit", "year", "value"]
+        if not len(param_cols) or not len(year_cols):
+            return {"columns": columns, "rows": []}
+
+        rows = []
+        locations = sorted((names[i][0] if city_level else names[i], i) for i in ids if i in index)
+        for name, location_id in locations:
+            grid = np.ix_([index[location_id]], param_cols, year_cols)
+            if city_level:
+                count = self._count[grid][0]
+                if (count > 1).any():
+                    return None  # duplicate (city, parameter, year) rows: let SQL list them
+                sums, valid = self._sums[grid][0], self._valid[grid][0]
+                state = gazetteer.states.get(gazetteer.cities[location_id][1])
+                prefix = (state, name)
+            else:
+                count = self._state_count[grid][0]
+                sums, valid = self._state_sums[grid][0], self._state_valid[grid][0]
+                prefix = (name,)
+            values = np.divide(sums, valid, out=np.zeros_like(sums), where=valid > 0)
+            for p, y in zip(*np.nonzero(count)):
+                parameter_name, unit, _ = parameters[p]
+                value = float(values[p, y]) if valid[p, y] else None
+                rows.append(list(prefix) + [parameter_name, unit, int(self._year0 + year_cols[y]), value])
+        return {"columns": columns, "rows": rows}
+
+    @property
+    def loaded(self) -> bool:
+        return self._version is not None
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "materialized_view": self.view_ready,
+            "version": self._version,
+            "loading": self._task is not None and not self._task.done(),
+            "retry_in_seconds": round(max(0.0, self._retry_at - time.time()), 1),
+            "grid": list(self._sums.shape),
+            "states": len(self._state_rows),
+            "memory_mb": round((self._sums.nbytes + self._valid.nbytes + self._count.nbytes) / 2**20, 2),
+            **self._stats,
+        }
+
+
+aggregate_cube = AggregateCube()
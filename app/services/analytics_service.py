@@ -0,0 +1,203 @@
+# app/services/analytics_service.py
+"""
+Structured lookups for the /groundwater REST endpoints: names are resolved by
+the gazetteer and answered through the same compiled intents as the NL
+pipeline (aggregate cube, result cache, template SQL), never the LLM.
+"""
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from app.services.gazetteer_service import gazetteer
+from app.services.pipeline_service import fetch_intent
+from app.utils.compact_util import summarize_series
+
+# Default / max points per series returned by /groundwater/series (LTTB downsampling)
+GROUNDWATER_MAX_POINTS = int(os.getenv("GROUNDWATER_MAX_POINTS", "1000"))
+# Default / max series per page
+GROUNDWATER_PAGE_SIZE = int(os.getenv("GROUNDWATER_PAGE_SIZE", "50"))
+GROUNDWATER_MAX_PAGE_SIZE = int(os.getenv("GROUNDWATER_MAX_PAGE_SIZE", "500"))
+
+_KINDS = {"state": "states", "city": "cities", "parameter": "parameters"}
+
+
+class UnknownName(LookupError):
+    pass
+
+
+def _ids(kind: str, names: list, state_ids: list = None) -> list:
+    """
+    IDs for names (or numeric IDs) of `kind`. Canonical names match case-insensitively,
+    aliases and misspellings go through the gazetteer. A city name shared by several
+    states is narrowed to `state_ids`, else rejected as ambiguous.
+    """
+    table = getattr(gazetteer, _KINDS[kind])
+    ids = []
+    for name in names:
+        name = name.strip()
+        if name.isdigit() and int(name) in table:
+            candidates = [int(name)]
+        else:
+            candidates = [i for i in table if (gazetteer.name(kind, i) or "").casefold() == name.casefold()]
+            if not candidates:
+                candidates = list(dict.fromkeys(m["id"] for m in gazetteer.mentions(name) if m["kind"] == kind))
+        if kind == "city" and state_ids and len(candidates) > 1:
+            candidates = [c for c in candidates if gazetteer.cities[c][1] in state_ids]
+        if not candidates:
+            raise UnknownName(f"Unknown {kind} '{name}'")
+        if len(candidates) > 1:
+            options = ", ".join(sorted(f"{gazetteer.name(kind, c)} ({c})" for c in candidates))
+            raise ValueError(f"Ambiguous {kind} '{name}': {options}; pass the ID or a state")
+        if candidates[0] not in ids:
+            ids.append(candidates[0])
+    return ids
+
+
+async def build_intent(states: list, cities: list, parameters: list, year_from: int = None,
+                       year_to: int = None) -> dict:
+    """Intent in the shape SQLCompiler.extract_intent produces. Raises UnknownName / ValueError."""
+    await gazetteer.ensure_loaded()
+    if not gazetteer.loaded:
+        raise RuntimeError("Location index is not loaded")
+    if not states and not cities:
+        raise ValueError("Pass at least one state or city")
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise ValueError("year_from must not be after year_to")
+    state_ids = _ids("state", states)
+    city_ids = _ids("city", cities, state_ids)
+    if state_ids and city_ids and any(gazetteer.cities[c][1] not in state_ids for c in city_ids):
+        raise ValueError("Cities must belong to the given states (or pass cities only)")
+    parameter_ids = sorted(_ids("parameter", parameters))
+    return {
+        "level": "city" if city_ids else "state",
+        "states": [gazetteer.states[s] for s in state_ids],
+        "cities": [gazetteer.cities[c][0] for c in city_ids],
+        "parameters": [gazetteer.parameters[p][0] for p in parameter_ids],
+        "state_ids": state_ids,
+        "city_ids": city_ids,
+        "parameter_ids": parameter_ids,
+        "year_from": year_from,
+        "year_to": year_to,
+        "years": [],
+    }
+
+
+def _series(frame) -> list:
+    """Split a result into series (rows sharing all columns but year / value), in result order."""
+    keys = [c for c in frame.columns if c not in ("year", "value")]
+    years = np.asarray(frame.column("year"), dtype=np.float64)
+    values = np.asarray(frame.column("value"), dtype=np.float64)
+    groups = {}
+    for i, key in enumerate(zip(*(frame.column(k) for k in keys))):
+        groups.setdefault(key, []).append(i)
+    series = []
+    for key, index in groups.items():
+        index = np.array(index)
+        order = index[np.argsort(years[index], kind="stable")]
+        series.append((dict(zip(keys, key)), years[order], values[order]))
+    return series
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indexes of `threshold` points that keep the
+    visual shape of the line (first and last point always kept).
+    """
+    n = len(x)
+    if threshold >= n or n <= 2:
+        return np.arange(n)
+    if threshold <= 2:
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=int)
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(int)
+    picked = [0]
+    for b in range(threshold - 2):
+        start, end = edges[b], edges[b + 1]
+        next_end = edges[b + 2] if b + 2 < len(edges) else n
+        if next_end <= end:
+            next_end = min(end + 1, n)
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        a = picked[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        picked.append(start + int(np.argmax(area)))
+    picked.append(n - 1)
+    return np.array(picked)
+
+
+def _points(years: np.ndarray, values: np.ndarray, max_points: int):
+    valid = ~np.isnan(values)
+    x, y = years[valid], values[valid]
+    keep = lttb(x, y, max_points)
+    return [[int(x[i]), round(float(y[i]), 4)] for i in keep], int(valid.sum())
+
+
+def _page(items: list, page: int, page_size: int) -> tuple:
+    page_size = max(1, min(page_size or GROUNDWATER_PAGE_SIZE, GROUNDWATER_MAX_PAGE_SIZE))
+    pages = max(1, math.ceil(len(items) / page_size))
+    if page < 1 or page > pages:
+        raise ValueError(f"page must be between 1 and {pages}")
+    meta = {"page": page, "page_size": page_size, "pages": pages, "total_series": len(items)}
+    return items[(page - 1) * page_size:page * page_size], meta
+
+
+def _query(intent: dict) -> dict:
+    return {
+        key: intent[key] for key in ("level", "states", "cities", "parameters", "year_from", "year_to")
+    }
+
+
+async def series(intent: dict, max_points: int = None, page: int = 1, page_size: int = None) -> dict:
+    """Year series per location x parameter, LTTB-downsampled to `max_points`."""
+    max_points = max(2, min(max_points or GROUNDWATER_MAX_POINTS, GROUNDWATER_MAX_POINTS))
+    frame = await fetch_intent(intent)
+    items, meta = _page(_series(frame), page, page_size)
+    out = []
+    for key, years, values in items:
+        points, total = _points(years, values, max_points)
+        out.append({**key, "points": points, "total_points": total, "downsampled": len(points) < total})
+    return {"query": _query(intent), **meta, "series": out}
+
+
+async def compare(intent: dict, max_points: int = None) -> dict:
+    """
+    Series aligned on one year axis ({"years", "series": [{..., "values"}]}) for charts
+    comparing locations; evenly spaced years are kept when there are more than `max_points`.
+    """
+    max_points = max(2, min(max_points or GROUNDWATER_MAX_POINTS, GROUNDWATER_MAX_POINTS))
+    if len(intent["state_ids"]) + len(intent["city_ids"]) < 2:
+        raise ValueError("Pass at least two states or cities to compare")
+    frame = await fetch_intent(intent)
+    groups = _series(frame)
+    axis = np.unique(np.concatenate([years for _, years, _ in groups])) if groups else np.array([])
+    if len(axis) > max_points:
+        axis = axis[np.unique(np.linspace(0, len(axis) - 1, max_points).round().astype(int))]
+    out = []
+    for key, years, values in groups:
+        aligned = np.full(len(axis), np.nan)
+        position = np.searchsorted(axis, years)
+        hit = (position < len(axis)) & (axis[np.minimum(position, len(axis) - 1)] == years)
+        aligned[position[hit]] = values[hit]
+        out.append({**key, "values": [None if np.isnan(v) else round(float(v), 4) for v in aligned]})
+    return {"query": _query(intent), "years": [int(y) for y in axis], "series": out}
+
+
+async def summary(intent: dict, page: int = 1, page_size: int = None) -> dict:
+    """first / last / min / max / mean / trend per year / biggest changes per series."""
+    frame = await fetch_intent(intent)
+    groups = _series(frame)
+    stats = summarize_series(frame.columns, frame.rows) if len(frame) else []
+    items, meta = _page(list(zip(groups, stats)), page, page_size)
+    out = []
+    for (key, _, _), stat in items:
+        stat = {k: v for k, v in stat.items() if k not in ("series", "points")}
+        stat["changes"] = stat.get("changes", [])[:3]
+        out.append({**key, **stat})
+    return {"query": _query(intent), **meta, "series": out}
+
+
+def etag(data_version: str, path: str, params: list) -> str:
+    """Strong validator: same data version + same request = same body."""
+    digest = hashlib.sha256(json.dumps([data_version, path, sorted(params)]).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
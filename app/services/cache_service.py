@@ -0,0 +1,351 @@
+# app/services/cache_service.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.services import metrics_service
+
+_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()  # memory | disk
+_CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+_MAX_BYTES = int(float(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024)
+_DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "30"))
+
+
+def make_key(*parts) -> str:
+    """Stable short key for any JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ----- STORES -----
+class MemoryStore:
+    """
+    In-process LRU store with per-entry TTL.
+    Bounded both by number of entries and by total size of the serialized values.
+    """
+
+    blocking = False  # cheap: used directly from the event loop
+
+    def __init__(self, max_entries: int = _MAX_ENTRIES, max_bytes: int = _MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expires_at, payload)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, payload = item
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return payload
+
+    def set(self, key: str, payload: str, ttl: float):
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.time() + ttl, payload)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                self._remove(key)
+
+    def _remove(self, key: str):
+        _, payload = self._data.pop(key)
+        self._bytes -= len(payload)
+
+    def size(self) -> dict:
+        return {"entries": len(self._data), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class DiskStore:
+    """
+    SQLite-backed store: survives restarts and is shared by every uvicorn worker
+    pointing at the same CACHE_DIR. Eviction is LRU on last access time.
+    Calls block on the disk (and on other workers' locks): async code goes
+    through CacheTier.get_async / set_async, which run them in a worker thread.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = _MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, payload TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT payload, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        self._conn().execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, payload: str, ttl: float):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, payload, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, payload, now + ttl, now),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def delete_prefix(self, prefix: str):
+        self._conn().execute("DELETE FROM cache WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff"))
+
+    def size(self) -> dict:
+        count = self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {"entries": count, "path": self.path, "evictions": self.evictions}
+
+
+def _build_store():
+    if _BACKEND == "disk":
+        try:
+            return DiskStore(os.path.join(_CACHE_DIR, "pipeline_cache.sqlite3"))
+        except Exception as e:
+            logging.error(f"[Cache ERROR] Disk store unavailable, using memory: {e}")
+    return MemoryStore()
+
+
+# ----- TIERS -----
+class CacheTier:
+    """
+    Named view over a store with its own TTL and hit/miss counters.
+    Values must be JSON-serializable; they are stored serialized so callers
+    never share (and mutate) the cached object.
+    """
+
+    def __init__(self, name: str, store, ttl: float):
+        self.name = name
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _full_key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def get(self, key: str):
+        try:
+            payload = self.store.get(self._full_key(key))
+        except Exception as e:
+            logging.error(f"[Cache ERROR] {self.name} get failed: {e}")
+            payload = None
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(payload)
+
+    def set(self, key: str, value):
+        try:
+            self.store.set(self._full_key(key), json.dumps(value, default=str, ensure_ascii=False), self.ttl)
+        except Exception as e:
+            logging.error(f"[Cache ERROR] {self.name} set failed: {e}")
+
+    async def get_async(self, key: str):
+        """get() for async callers; a blocking store is read in a worker thread."""
+        if not self.store.blocking:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def set_async(self, key: str, value):
+        if not self.store.blocking:
+            return self.set(key, value)
+        await asyncio.to_thread(self.set, key, value)
+
+    def clear(self):
+        prefix = f"{self.name}:"
+        if self.store.blocking:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                # from the event loop (a data change noticed by a request): purge in the
+                # background; keys carry the data version, so nothing stale is read meanwhile
+                loop.run_in_executor(None, self._purge, prefix)
+                return
+        self._purge(prefix)
+
+    def _purge(self, prefix: str):
+        try:
+            self.store.delete_prefix(prefix)
+        except Exception as e:
+            logging.error(f"[Cache ERROR] {self.name} clear failed: {e}")
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "ttl_seconds": self.ttl,
+        }
+
+
+_store = _build_store()
+
+# raw text -> normalize output
+normalize_cache = CacheTier("normalize", _store, float(os.getenv("CACHE_TTL_NORMALIZE", "86400")))
+# normalized English -> SQL
+sql_cache = CacheTier("sql", _store, float(os.getenv("CACHE_TTL_SQL", "86400")))
+# (data version, SQL) -> sanitized result
+result_cache = CacheTier("result", _store, float(os.getenv("CACHE_TTL_RESULT", "600")))
+# (query, result, style, language) -> final answer
+answer_cache = CacheTier("answer", _store, float(os.getenv("CACHE_TTL_ANSWER", "3600")))
+# SQL text -> guard verdict (validation + cost check)
+guard_cache = CacheTier("guard", _store, float(os.getenv("CACHE_TTL_GUARD", "3600")))
+
+_TIERS = (normalize_cache, sql_cache, result_cache, answer_cache, guard_cache)
+
+
+# ----- DATA VERSION (invalidation of result entries) -----
+_data_version = {"value": None, "checked_at": 0.0}
+_change_listeners = []
+
+
+def on_data_change(fn):
+    """`fn(old_version, new_version)` is called after result entries were dropped for new data."""
+    _change_listeners.append(fn)
+
+
+def _version_is_stale() -> bool:
+    return _data_version["value"] is None or time.time() - _data_version["checked_at"] > _DATA_VERSION_TTL
+
+
+def _record_version(version: str):
+    previous = _data_version["value"]
+    # "unknown" (no probe has succeeded yet) is not a version: the first real one is no change
+    changed = previous not in (None, "unknown", version)
+    if changed:
+        logging.info(f"[Cache] yearly_data changed ({previous} -> {version}), dropping results")
+        invalidate_results()
+    _data_version["value"] = version
+    _data_version["checked_at"] = time.time()
+    if changed:
+        for listener in _change_listeners:
+            listener(previous, version)
+
+
+def _probe_failed():
+    """Keep the last known version (re-probed after DATA_VERSION_TTL), "unknown" if there is none."""
+    _data_version["value"] = _data_version["value"] or "unknown"
+    _data_version["checked_at"] = time.time()
+
+
+def get_data_version(probe) -> str:
+    """
+    Current version of `yearly_data`, re-probed at most every DATA_VERSION_TTL seconds.
+    `probe` is a callable returning a version string from the DB; result keys
+    include it, so any change to the table makes old result entries unreachable.
+    """
+    if _version_is_stale():
+        try:
+            version = probe()
+        except Exception as e:
+            logging.error(f"[Cache ERROR] Data version probe failed: {e}")
+            _probe_failed()
+        else:
+            _record_version(version)
+    return _data_version["value"]
+
+
+async def get_data_version_async(probe) -> str:
+    """Same as get_data_version, for a coroutine `probe`."""
+    if _version_is_stale():
+        try:
+            version = await probe()
+        except Exception as e:
+            logging.error(f"[Cache ERROR] Data version probe failed: {e}")
+            _probe_failed()
+        else:
+            _record_version(version)
+    return _data_version["value"]
+
+
+def invalidate_results():
+    """Drop every entry derived from `yearly_data` contents."""
+    result_cache.clear()
+    answer_cache.clear()
+    _data_version["checked_at"] = 0.0  # force a re-probe on next lookup
+
+
+def get_cache_stats() -> dict:
+    stats = {tier.name: tier.get_stats() for tier in _TIERS}
+    stats["store"] = {"backend": type(_store).__name__, **_store.size()}
+    stats["data_version"] = _data_version["value"]
+    return stats
+
+
+def _collect_metrics():
+    return [
+        ("cache_requests_total", "counter", "Cache lookups by tier and result.", [
+            (labels, value)
+            for tier in _TIERS
+            for labels, value in (({"tier": tier.name, "result": "hit"}, tier.hits),
+                                  ({"tier": tier.name, "result": "miss"}, tier.misses))
+        ]),
+    ]
+
+
+metrics_service.registry.register_collector(_collect_metrics)
@@ -0,0 +1,44 @@
+# app/services/coalesce_service.py
+import asyncio
+import logging
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key.
+    The first caller starts the computation, every caller arriving while it is
+    still running awaits the same task and receives the same result (or error).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def _forget(self, key, task):
+        # Only drop the entry if it still points at this task
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved even if every waiter went away
+
+    async def do(self, key, fn):
+        """
+        Run `fn()` (a coroutine factory) once per in-flight `key`.
+        """
+        self._stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats["executions"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        else:
+            self._stats["coalesced"] += 1
+            logging.info(f"[SingleFlight {self.name}] Joined in-flight computation")
+
+        # shield: a cancelled (disconnected) caller must not cancel the shared work
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._inflight)}
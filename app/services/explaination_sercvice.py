@@ -1,15 +1,31 @@
-# app/services/gemini_service.py
-from app.utils import config_util
+# app/services/explaination_sercvice.py
+from app.services.llm_client import llm_client
+from app.services.prompt_service import prompts
+from app.utils.compact_util import compact_result
 import logging
-import json
 
 _MODEL = "gemini-flash-latest"
 
+FALLBACK_EXPLANATION = "Sorry, couldn't generate explanation."
 
 
+
+# Instructions first, the query and data after them (static prefix, see prompt_service)
 _EXPLANATION_PROMPT = """You are a helpful data assistant.
-User Query: {query}
-Data: {data}
+Analyze the data given after the task for the user query given with it.
+
+Task:
+1. Analyze the data according to the user query.
+2. Extract relevant numbers and insights.
+3. Generate a short, clear textual explanation suitable for frontend display.
+4. Write in professional, concise, human-readable language.
+5. Data that you use for explanation should be in readable form; do NOT use table format.
+6. Format the explanation in bullet points, each starting with '- '.
+"""
+
+# Same task, but written directly in the user's style / language (no separate restyle call)
+_LOCALIZED_EXPLANATION_PROMPT = """You are a helpful multilingual data assistant.
+Analyze the data given after the task for the user query given with it.
 
 Task:
 1. Analyze the data according to the user query.
@@ -18,46 +34,89 @@ Task:
 4. Write in professional, concise, human-readable language.
 5. Data that you use for explanation should be in readable form; do NOT use table format.
 6. Format the explanation in bullet points, each starting with '- '.
+7. Write the whole answer directly in the user's style:
+   - hindi → natural Hindi in Devanagari.
+   - hinglish → mix of Romanized Hindi + simple English (chat style).
+   - other-language-name → natural translation to that language.
+8. Use numeric same as given in the data.
+
+Return RAW TEXT only, no JSON, no preface.
 """
 
+prompts.register("explain", _EXPLANATION_PROMPT)
+prompts.register("explain_localized", _LOCALIZED_EXPLANATION_PROMPT)
 
+_ENGLISH_STYLES = ("english", "formal", "en", "")
 
-def _generate(model: str, prompt: str, user_input: str) -> str:
+
+
+async def _generate(model: str, prompt: str, user_input: str) -> str:
     """
-    Safe wrapper to generate content from Gemini model.
+    Safe non-blocking wrapper to generate content from Gemini model
+    (explain stage: deadline share, hedging, circuit breaker).
     Raises RuntimeError with clear message on failure.
     """
+    return await llm_client.generate(prompt, user_input, stage="explain", fallback="")
+
+
+# ----- TEXTUAL EXPLANATION GENERATOR -----
+async def generate_textual_explanation(user_query: str, data: dict) -> str:
+    """
+    Generate professional textual explanation for given query and tabular data.
+    """
     try:
-        model = config_util.get_gemini_model()
-        resp = model.generate_content([prompt, user_input])
+        table_str = compact_result(data)
+        request = f"User Query: {user_query}\nData: {table_str}\n"
+        explanation = await _generate(_MODEL, prompts.prefix("explain"), request)
+        return explanation or FALLBACK_EXPLANATION
     except Exception as e:
-        logging.error(f"[Gemini ERROR] Failed to generate content: {e}")
-        raise RuntimeError(f"Failed to generate content: {e}")
+        logging.error(f"[DEBUG] generate_textual_explanation fallback: {e}\nRaw: {user_query}")
+        return FALLBACK_EXPLANATION
 
-    # Check for blocked responses
-    if hasattr(resp, "prompt_feedback") and resp.prompt_feedback and getattr(resp.prompt_feedback, "block_reason", None):
-        reason = resp.prompt_feedback.block_reason
-        logging.warning(f"[Gemini BLOCKED] {reason}")
-        raise RuntimeError(f"Gemini blocked: {reason}")
 
-    # Check if candidates exist
-    if not getattr(resp, "candidates", None):
-        logging.warning("[Gemini WARNING] No candidates returned.")
-        raise RuntimeError("No candidates from Gemini.")
+def is_english(style: str, lang_code: str) -> bool:
+    style = (style or "").strip().lower()
+    if style in _ENGLISH_STYLES:
+        return True
+    return style == "unknown" and (lang_code or "").lower().startswith("en")
 
-    return getattr(resp, "text", "").strip() or user_input
 
+def _localized_prompt(user_query: str, data: dict, style: str, lang_code: str):
+    """(static prefix, per-request part)."""
+    request = f"User Query: {user_query}\nData: {compact_result(data)}\n"
+    if is_english(style, lang_code):
+        return prompts.prefix("explain"), request
+    request += f"original_style: {style}\noriginal_language_code: {lang_code}\n"
+    return prompts.prefix("explain_localized"), request
 
-# ----- TEXTUAL EXPLANATION GENERATOR -----
-def generate_textual_explanation(user_query: str, data: dict) -> str:
+
+async def generate_localized_explanation(user_query: str, data: dict, style: str, lang_code: str) -> str:
     """
-    Generate professional textual explanation for given query and tabular data.
+    Explanation written directly in the user's style and language in one call.
+    English users get the plain English explanation (no restyling at all).
     """
+    if is_english(style, lang_code):
+        return await generate_textual_explanation(user_query, data)
     try:
-        table_str = json.dumps(data)
-        prompt = _EXPLANATION_PROMPT.format(query=user_query, data=table_str)
-        explanation = _generate(_MODEL, prompt, user_query)
-        return explanation
+        prompt, request = _localized_prompt(user_query, data, style, lang_code)
+        return await _generate(_MODEL, prompt, request) or FALLBACK_EXPLANATION
     except Exception as e:
-        logging.error(f"[DEBUG] generate_textual_explanation fallback: {e}\nRaw: {user_query}")
-        return "Sorry, couldn't generate explanation."
+        logging.error(f"[DEBUG] generate_localized_explanation fallback: {e}\nRaw: {user_query}")
+        return FALLBACK_EXPLANATION
+
+
+async def stream_localized_explanation(user_query: str, data: dict, style: str, lang_code: str):
+    """
+    Streaming version of generate_localized_explanation: yields text chunks.
+    Yields the fallback text if the model fails before producing anything.
+    """
+    emitted = False
+    try:
+        prompt, request = _localized_prompt(user_query, data, style, lang_code)
+        async for chunk in llm_client.stream(prompt, request, stage="explain"):
+            emitted = True
+            yield chunk
+    except Exception as e:
+        logging.error(f"[DEBUG] stream_localized_explanation fallback: {e}\nRaw: {user_query}")
+        if not emitted:
+            yield FALLBACK_EXPLANATION
@@ -0,0 +1,242 @@
+# app/services/fake_llm.py
+"""
+Deterministic stand-in for the Gemini model (LLM_PROVIDER=fake).
+
+Answers every pipeline prompt offline: normalize / plan JSON, SQL built from
+the gazetteer's matches, bullet explanations and restyled answers. Latency and
+failures are drawn from configurable distributions so load tests can model the
+real API without network access.
+
+    FAKE_LLM_LATENCY=lognormal:250,0.5      # default for every prompt kind
+    FAKE_LLM_LATENCY_EXPLAIN=uniform:400,900  # per kind: NORMALIZE, PLAN, SQL, EXPLAIN, STYLE
+    FAKE_LLM_FAILURE_RATE=0.01
+    FAKE_LLM_SEED=7
+
+Distributions (milliseconds): fixed:M, uniform:A,B, normal:MEAN,SD,
+lognormal:MEDIAN,SIGMA, exp:MEAN.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+
+from app.utils.compact_util import estimate_tokens
+
+FAKE_LLM_LATENCY = os.getenv("FAKE_LLM_LATENCY", "lognormal:250,0.5")
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED", "0"))
+
+_KINDS = ("normalize", "plan", "sql", "explain", "style")
+_DEVANAGARI = re.compile(r"[ऀ-ॿ]")
+_HINGLISH = re.compile(r"\b(kya|hai|ka|ki|ke|mein|me|batao|bataiye|kitna|kitni|kaisa|tha|aur)\b", re.I)
+_GREETING = re.compile(r"^\s*(hi|hello|hey|namaste|namaskar|thanks|thank you|who are you|how can you help)\b", re.I)
+_YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+
+
+def parse_distribution(spec: str):
+    """'lognormal:250,0.5' -> function(rng) returning seconds."""
+    name, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    name = name.strip().lower()
+    if name == "fixed":
+        return lambda rng: values[0] / 1000
+    if name == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    if name == "exp":
+        return lambda rng: rng.expovariate(1 / values[0]) / 1000
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, response_tokens: int, cached_tokens: int = 0):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.cached_content_token_count = cached_tokens
+
+
+class FakeResponse:
+    """Shaped like the parts of a Gemini response that llm_client reads."""
+
+    def __init__(self, text: str, usage: _Usage = None):
+        self.text = text
+        self.candidates = [text]
+        self.prompt_feedback = None
+        self.usage_metadata = usage
+
+
+class _FakeStream:
+    def __init__(self, chunks: list, delays: list):
+        self._chunks = chunks
+        self._delays = delays
+
+    def __aiter__(self):
+        async def iterate():
+            for chunk, delay in zip(self._chunks, self._delays):
+                await asyncio.sleep(delay)
+                yield chunk
+        return iterate()
+
+
+def _kind(prompt: str) -> str:
+    if "query planner" in prompt:
+        return "plan"
+    if "query normalizer" in prompt:
+        return "normalize"
+    if "PostgreSQL query generator" in prompt:
+        return "sql"
+    if "multilingual stylist" in prompt:
+        return "style"
+    return "explain"
+
+
+def _style(text: str):
+    if _DEVANAGARI.search(text):
+        return "hindi", "hi"
+    if _HINGLISH.search(text):
+        return "hinglish", "hi"
+    return "english", "en"
+
+
+def _after(prompt: str, label: str) -> str:
+    index = prompt.rfind(label)
+    return prompt[index + len(label):].strip().splitlines()[0].strip() if index >= 0 else ""
+
+
+def fake_sql(query: str) -> str:
+    """SQL in the shape the real prompt asks for (ILIKE on the gazetteer's matches)."""
+    from app.services.gazetteer_service import gazetteer
+
+    resolved = gazetteer.resolve(query) if gazetteer.loaded else {"states": [], "cities": [], "parameters": []}
+
+    def names(kind, ids):
+        return [gazetteer.name(kind, i).replace("'", "''") for i in ids]
+
+    cities = names("city", resolved["cities"])
+    states = names("state", resolved["states"])
+    parameters = names("parameter", resolved["parameters"])
+    where = []
+    if cities:
+        where.append("(" + " OR ".join(f"c.city_name ILIKE '{c}'" for c in cities) + ")")
+    elif states:
+        where.append("(" + " OR ".join(f"s.state_name ILIKE '{s}'" for s in states) + ")")
+    if parameters:
+        where.append("(" + " OR ".join(f"p.parameter_name ILIKE '{p}'" for p in parameters) + ")")
+    years = sorted({int(y) for y in _YEAR.findall(query)})
+    if len(years) == 1:
+        where.append(f"yd.year = {years[0]}")
+    elif years:
+        where.append(f"yd.year BETWEEN {years[0]} AND {years[-1]}")
+    joins = (
+        "FROM yearly_data yd JOIN cities c ON yd.city_id = c.city_id "
+        "JOIN states s ON c.state_id = s.state_id JOIN parameters p ON yd.parameter_id = p.parameter_id"
+    )
+    condition = f" WHERE {' AND '.join(where)}" if where else ""
+    if cities:
+        return (
+            "SELECT s.state_name AS state, c.city_name AS city, p.parameter_name AS parameter_name, "
+            f"p.unit AS unit, yd.year AS year, yd.value AS value {joins}{condition} ORDER BY c.city_name, yd.year"
+        )
+    return (
+        "SELECT s.state_name AS state, p.parameter_name AS parameter_name, p.unit AS unit, "
+        f"yd.year AS year, AVG(yd.value) AS value {joins}{condition} "
+        "GROUP BY s.state_name, p.parameter_name, p.unit, yd.year ORDER BY s.state_name, yd.year"
+    )
+
+
+def _normalize_payload(user_text: str) -> dict:
+    style, code = _style(user_text)
+    return {
+        "normalized_english": " ".join(user_text.split()),
+        "original_language_code": code,
+        "style": style,
+        "type": "personal" if _GREETING.match(user_text) else "bussiness",
+    }
+
+
+def _answer(kind: str, prompt: str, user_input: str) -> str:
+    if kind == "normalize":
+        return json.dumps(_normalize_payload(user_input), ensure_ascii=False)
+    if kind == "plan":
+        payload = _normalize_payload(user_input)
+        payload["sql"] = "" if payload["type"] == "personal" else fake_sql(user_input)
+        return json.dumps(payload, ensure_ascii=False)
+    # the per-request part (query, data) follows the static prefix as user input
+    text = f"{prompt}\n{user_input}"
+    if kind == "sql":
+        return fake_sql(_after(text, "User query:"))
+    if kind == "style":
+        return user_input.split("answer_english:", 1)[-1].strip()
+    query = _after(text, "User Query:")
+    data = _after(text, "Data:")
+    return (
+        f"- Answer to \"{query}\" from {len(data)} characters of data.\n"
+        f"- Values are shown as returned by the database."
+    )
+
+
+class FakeModel:
+    """
+    Drop-in for genai.GenerativeModel: generate_content[_async], streaming too.
+    With `cached_prefix` it stands in for a model built from cached content: the
+    prefix is prepended to every call and reported as cached tokens.
+    """
+
+    def __init__(self, latency: str = FAKE_LLM_LATENCY, failure_rate: float = FAKE_LLM_FAILURE_RATE,
+                 seed: int = FAKE_LLM_SEED, cached_prefix: str = None):
+        self.failure_rate = failure_rate
+        self.cached_prefix = cached_prefix
+        self._rng = random.Random(seed)
+        default = parse_distribution(latency)
+        self._latency = {}
+        for kind in _KINDS:
+            spec = os.getenv(f"FAKE_LLM_LATENCY_{kind.upper()}")
+            self._latency[kind] = parse_distribution(spec) if spec else default
+        self.calls = {kind: 0 for kind in _KINDS}
+
+    def _prepare(self, contents):
+        if self.cached_prefix is not None:
+            contents = [self.cached_prefix] + (contents if isinstance(contents, list) else [contents])
+        if isinstance(contents, list):
+            prompt, user_input = contents[0], "".join(str(c) for c in contents[1:])
+        else:
+            prompt, user_input = contents, ""
+        kind = _kind(prompt)
+        self.calls[kind] += 1
+        delay = self._latency[kind](self._rng)
+        failed = self._rng.random() < self.failure_rate
+        text = _answer(kind, prompt, user_input)
+        cached = estimate_tokens(self.cached_prefix) if self.cached_prefix is not None else 0
+        usage = _Usage(estimate_tokens(prompt + user_input), estimate_tokens(text), cached)
+        return text, usage, delay, failed
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        text, usage, delay, failed = self._prepare(contents)
+        if not stream:
+            await asyncio.sleep(delay)
+            if failed:
+                raise RuntimeError("fake LLM failure")
+            return FakeResponse(text, usage)
+        # time to first chunk ~40% of the call, the rest spread over the chunks
+        await asyncio.sleep(delay * 0.4)
+        if failed:
+            raise RuntimeError("fake LLM failure")
+        words = text.split(" ")
+        chunks = [" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "") for i in range(0, len(words), 4)]
+        step = delay * 0.6 / max(1, len(chunks))
+        responses = [FakeResponse(chunk) for chunk in chunks]
+        responses[-1].usage_metadata = usage
+        return _FakeStream(responses, [step] * len(responses))
+
+    def generate_content(self, contents, **kwargs):
+        text, usage, delay, failed = self._prepare(contents)
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError("fake LLM failure")
+        return FakeResponse(text, usage)
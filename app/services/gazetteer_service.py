@@ -0,0 +1,389 @@
+# app/services/gazetteer_service.py
+import difflib
+import logging
+import os
+import re
+import time
+import unicodedata
+
+from sqlalchemy import text
+
+from app.db.session import SessionLocal
+from app.db.utils import run_sql_query_async, get_data_version_async
+from app.services import cache_service
+
+_TTL = float(os.getenv("GAZETTEER_TTL", "600"))
+_FUZZY_CUTOFF = float(os.getenv("GAZETTEER_FUZZY_CUTOFF", "0.84"))
+
+_STATES_SQL = "SELECT state_id, state_name FROM states"
+_CITIES_SQL = "SELECT city_id, city_name, state_id FROM cities"
+_PARAMETERS_SQL = "SELECT parameter_id, parameter_name, unit FROM parameters"
+
+# Canonical parameter names (as stored in `parameters`) -> phrases users use for them
+PARAMETER_ALIASES = {
+    "Groundwater Level": [
+        "groundwater level", "ground water level", "water level", "water table", "gw level", "depth to water",
+        "bhujal star", "jal star", "भूजल स्तर", "जल स्तर",
+    ],
+    "Water Recharged": [
+        "water recharged", "recharge", "recharged", "gw recharge", "groundwater recharge",
+        "punarbharan", "पुनर्भरण", "जल पुनर्भरण",
+    ],
+    "Rainfall": ["rainfall", "rain", "precipitation", "barish", "baarish", "varsha", "वर्षा", "बारिश"],
+    "Exploitation": [
+        "exploitation", "extraction", "overexploitation", "over-exploitation", "dohan", "दोहन",
+    ],
+}
+
+# Alternative names / abbreviations of states and cities -> canonical name.
+# Two-letter abbreviations are also English words ("up to 2015"), so they are only
+# listed dotted: "U.P." matches, and so does "UP" (tokenize() dots upper-case ones)
+STATE_ALIASES = {
+    "u.p.": "Uttar Pradesh", "m.p.": "Madhya Pradesh", "a.p.": "Andhra Pradesh", "h.p.": "Himachal Pradesh",
+    "u.k.": "Uttarakhand", "uttaranchal": "Uttarakhand", "t.n.": "Tamil Nadu", "w.b.": "West Bengal",
+    "j&k": "Jammu and Kashmir", "orissa": "Odisha", "pondicherry": "Puducherry", "nct": "Delhi", "ncr": "Delhi",
+}
+CITY_ALIASES = {
+    "faizabad": "Ayodhya", "allahabad": "Prayagraj", "prayag": "Prayagraj", "banaras": "Varanasi",
+    "benares": "Varanasi", "kashi": "Varanasi", "cawnpore": "Kanpur", "bombay": "Mumbai",
+    "madras": "Chennai", "calcutta": "Kolkata", "bangalore": "Bengaluru", "gurgaon": "Gurugram",
+    "poona": "Pune", "trivandrum": "Thiruvananthapuram", "mysore": "Mysuru",
+}
+
+# ---- Devanagari -> Latin transliteration (ISO-ish, with Hindi schwa deletion) ----
+_CONSONANTS = {
+    "क": "k", "ख": "kh", "ग": "g", "घ": "gh", "ङ": "n", "च": "ch", "छ": "chh", "ज": "j", "झ": "jh",
+    "ञ": "n", "ट": "t", "ठ": "th", "ड": "d", "ढ": "dh", "ण": "n", "त": "t", "थ": "th", "द": "d",
+    "ध": "dh", "न": "n", "प": "p", "फ": "ph", "ब": "b", "भ": "bh", "म": "m", "य": "y", "र": "r",
+    "ल": "l", "व": "v", "श": "sh", "ष": "sh", "स": "s", "ह": "h", "ळ": "l",
+}
+_NUKTA_CONSONANTS = {"क": "q", "ख": "kh", "ग": "g", "ज": "z", "फ": "f", "ड": "r", "ढ": "rh"}
+_VOWELS = {
+    "अ": "a", "आ": "a", "इ": "i", "ई": "i", "उ": "u", "ऊ": "u", "ऋ": "ri", "ए": "e", "ऐ": "ai",
+    "ओ": "o", "औ": "au", "ऑ": "o",
+}
+_MATRAS = {
+    "ा": "a", "ि": "i", "ी": "i", "ु": "u", "ू": "u", "ृ": "ri", "े": "e", "ै": "ai", "ो": "o",
+    "ौ": "au", "ॉ": "o",
+}
+_VIRAMA, _NUKTA = "्", "़"
+_NASALS = {"ं": "n", "ँ": "n", "ः": "h"}
+_DEVANAGARI_DIGITS = {chr(0x0966 + i): str(i) for i in range(10)}
+
+_TOKEN = re.compile(r"[a-z0-9&.]+|[ऀ-ॿ]+")
+_ABBREVIATION = re.compile(r"\b(UP|MP|AP|HP|UK|TN|WB)\b")
+_DEVANAGARI = re.compile(r"[ऀ-ॿ]")
+
+
+def transliterate(word: str) -> str:
+    """
+    Romanize a Devanagari word the way names are usually spelled in English
+    ("अयोध्या" -> "ayodhya", "उत्तर प्रदेश" -> "uttar pradesh").
+    """
+    # syllables: [onset consonants, vowel, inherent]; inherent vowels may be dropped later
+    syllables = []
+    onset = []
+    chars = list(word)
+    i = 0
+    while i < len(chars):
+        ch = chars[i]
+        if ch in _CONSONANTS:
+            nukta = i + 1 < len(chars) and chars[i + 1] == _NUKTA
+            onset.append(_NUKTA_CONSONANTS.get(ch, _CONSONANTS[ch]) if nukta else _CONSONANTS[ch])
+            i += 2 if nukta else 1
+            if i < len(chars) and chars[i] == _VIRAMA:
+                i += 1
+                continue
+            if i < len(chars) and chars[i] in _MATRAS:
+                syllables.append([onset, _MATRAS[chars[i]], False])
+                i += 1
+            else:
+                syllables.append([onset, "a", True])
+            onset = []
+            continue
+        if ch in _VOWELS:
+            syllables.append([onset, _VOWELS[ch], False])
+            onset = []
+        elif ch in _NASALS and syllables:
+            syllables[-1][1] += _NASALS[ch]
+        elif ch in _DEVANAGARI_DIGITS:
+            syllables.append([onset, _DEVANAGARI_DIGITS[ch], False])
+            onset = []
+        i += 1
+    if onset:
+        syllables.append([onset, "", False])
+
+    # Schwa deletion: final inherent "a" after a single consonant, and a medial
+    # one between two vowel-bearing syllables ("सोनभद्र" -> "sonbhadra")
+    if syllables and syllables[-1][2] and len(syllables[-1][0]) == 1 and len(syllables) > 1:
+        syllables[-1][1] = ""
+    for n in range(1, len(syllables) - 1):
+        prev, cur, nxt = syllables[n - 1], syllables[n], syllables[n + 1]
+        if cur[2] and cur[1] == "a" and len(cur[0]) == 1 and prev[1] and nxt[1]:
+            cur[1] = ""
+    return "".join("".join(onset) + vowel for onset, vowel, _ in syllables)
+
+
+def fold(text_: str) -> str:
+    """Lower-case, strip accents and romanize Devanagari words."""
+    text_ = unicodedata.normalize("NFC", text_ or "").lower()
+    if _DEVANAGARI.search(text_):
+        text_ = " ".join(transliterate(t) if _DEVANAGARI.match(t) else t for t in _TOKEN.findall(text_))
+    text_ = "".join(c for c in unicodedata.normalize("NFKD", text_) if not unicodedata.combining(c))
+    return text_
+
+
+def tokenize(text_: str):
+    """
+    Folded tokens. An upper-case state abbreviation becomes its dotted form ("UP" -> "u.p"),
+    unless the whole text is upper-case (then "UP TO 2015" is just shouting).
+
+    >>> tokenize("Rainfall in Bihar up to 2015 and in UP")
+    ['rainfall', 'in', 'bihar', 'up', 'to', '2015', 'and', 'in', 'u.p']
+    """
+    text_ = text_ or ""
+    if not text_.isupper():
+        text_ = _ABBREVIATION.sub(lambda m: f"{m[1][0]}.{m[1][1]}.", text_)
+    return [t.strip(".") or t for t in _TOKEN.findall(fold(text_))]
+
+
+def _child(node: dict, token: str):
+    """Trie step; a simple plural also matches its singular ("levels" -> "level")."""
+    child = node.get(token)
+    if child is None and len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        child = node.get(token[:-1])
+    return child
+
+
+def _trigrams(word: str):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """
+    In-memory index of the `states`, `cities` and `parameters` tables.
+    - token trie over canonical names, aliases and romanized Hindi names
+      (longest match wins, so "uttar pradesh" beats "up")
+    - trigram index for misspelled single words ("ayodya" -> "ayodhya")
+    Mentions resolve to integer IDs; reloaded when the data version changes.
+    """
+
+    def __init__(self):
+        self.states = {}       # state_id -> state_name
+        self.cities = {}       # city_id -> (city_name, state_id)
+        self.parameters = {}   # parameter_id -> (parameter_name, unit)
+        self._trie = {}
+        self._trigram_index = {}   # trigram -> set of single-word surface forms
+        self._surfaces = {}        # single-word surface form -> entries
+        self._version = None
+        self._loaded_at = 0.0
+        self._stats = {"lookups": 0, "exact": 0, "fuzzy": 0, "lookup_seconds_total": 0.0}
+
+    # ----- loading -----
+    def refresh(self):
+        """Reload dimensions from the DB (blocking)."""
+        session = SessionLocal()
+        try:
+            states = session.execute(text(_STATES_SQL)).fetchall()
+            cities = session.execute(text(_CITIES_SQL)).fetchall()
+            parameters = session.execute(text(_PARAMETERS_SQL)).fetchall()
+        finally:
+            session.close()
+        self.load(states, cities, parameters)
+
+    async def refresh_async(self, version=None):
+        states = (await run_sql_query_async(_STATES_SQL))["rows"]
+        cities = (await run_sql_query_async(_CITIES_SQL))["rows"]
+        parameters = (await run_sql_query_async(_PARAMETERS_SQL))["rows"]
+        self.load(states, cities, parameters, version)
+
+    async def ensure_loaded(self):
+        """Reload when the data version moved (ingest) or the TTL expired."""
+        try:
+            version = await cache_service.get_data_version_async(get_data_version_async)
+            if version != self._version or time.time() - self._loaded_at > _TTL:
+                await self.refresh_async(version)
+        except Exception as e:
+            logging.error(f"[Gazetteer ERROR] Could not load dimensions: {e}")
+
+    def load(self, states, cities, parameters, version=None):
+        self.states = {int(sid): name for sid, name in states if name}
+        self.cities = {int(cid): (name, int(sid)) for cid, name, sid in cities if name}
+        self.parameters = {int(pid): (name, unit) for pid, name, unit in parameters if name}
+
+        trie, surfaces = {}, {}
+        state_ids = {name.strip().lower(): sid for sid, name in self.states.items()}
+        city_ids = {}
+        for cid, (name, _) in self.cities.items():
+            city_ids.setdefault(name.strip().lower(), []).append(cid)
+        param_ids = {name.strip().lower(): pid for pid, (name, _) in self.parameters.items()}
+
+        def add(surface, entry):
+            tokens = tokenize(surface)
+            if not tokens:
+                return
+            node = trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            entries = node.setdefault("$", [])
+            if entry not in entries:
+                entries.append(entry)
+            if len(tokens) == 1:
+                surfaces.setdefault(tokens[0], [])
+                if entry not in surfaces[tokens[0]]:
+                    surfaces[tokens[0]].append(entry)
+
+        for name, sid in state_ids.items():
+            add(name, ("state", sid))
+        for name, cids in city_ids.items():
+            for cid in cids:
+                add(name, ("city", cid))
+        for alias, canonical in STATE_ALIASES.items():
+            if canonical.lower() in state_ids:
+                add(alias, ("state", state_ids[canonical.lower()]))
+        for alias, canonical in CITY_ALIASES.items():
+            for cid in city_ids.get(canonical.lower(), []):
+                add(alias, ("city", cid))
+        for canonical, aliases in PARAMETER_ALIASES.items():
+            pid = param_ids.get(canonical.lower())
+            if pid is None:
+                continue
+            for alias in [canonical] + aliases:
+                add(alias, ("parameter", pid))
+        for name, pid in param_ids.items():
+            add(name, ("parameter", pid))
+
+        trigram_index = {}
+        for surface in surfaces:
+            if len(surface) >= 4:
+                for gram in _trigrams(surface):
+                    trigram_index.setdefault(gram, set()).add(surface)
+
+        self._trie, self._surfaces, self._trigram_index = trie, surfaces, trigram_index
+        self._version = version
+        self._loaded_at = time.time()
+        logging.info(
+            f"[Gazetteer] Loaded {len(self.states)} states, {len(self.cities)} cities, "
+            f"{len(self.parameters)} parameters ({len(surfaces)} single-word forms)"
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._trie)
+
+    # ----- lookup -----
+    def _fuzzy(self, token: str):
+        """Closest single-word surface form for a misspelled token, or None."""
+        if len(token) < 5 or token.isdigit():
+            return None
+        grams = _trigrams(token)
+        counts = {}
+        for gram in grams:
+            for surface in self._trigram_index.get(gram, ()):
+                counts[surface] = counts.get(surface, 0) + 1
+        best, best_score = None, _FUZZY_CUTOFF
+        for surface, shared in counts.items():
+            if shared * 2 < len(grams):
+                continue
+            score = difflib.SequenceMatcher(None, token, surface).ratio()
+            if score > best_score:
+                best, best_score = surface, score
+        return best
+
+    def mentions(self, query: str):
+        """
+        Scan `query` for known names. Returns a list of
+        {"kind", "id", "name", "text", "fuzzy"}; ambiguous spans carry all candidates.
+        """
+        started = time.perf_counter()
+        tokens = tokenize(query)
+        found = []
+        i = 0
+        while i < len(tokens):
+            node, end, entries = self._trie, i, None
+            for j in range(i, len(tokens)):
+                node = _child(node, tokens[j])
+                if node is None:
+                    break
+                if "$" in node:
+                    end, entries = j + 1, node["$"]
+            fuzzy = False
+            if entries is None:
+                surface = self._fuzzy(tokens[i])
+                if surface is not None:
+                    end, entries, fuzzy = i + 1, self._surfaces[surface], True
+            if entries is None:
+                i += 1
+                continue
+            for kind, id_ in entries:
+                found.append({
+                    "kind": kind,
+                    "id": id_,
+                    "name": self.name(kind, id_),
+                    "text": " ".join(tokens[i:end]),
+                    "fuzzy": fuzzy,
+                    "ambiguous": len(entries) > 1,
+                })
+            self._stats["fuzzy" if fuzzy else "exact"] += 1
+            i = end
+        self._stats["lookups"] += 1
+        self._stats["lookup_seconds_total"] += time.perf_counter() - started
+        return found
+
+    def resolve(self, query: str) -> dict:
+        """
+        Distinct IDs mentioned in `query`, in order of appearance:
+        {"states": [...], "cities": [...], "parameters": [...], "ambiguous": bool}
+        Pass the query as typed: upper-case abbreviations ("UP") only match there.
+
+        >>> g = Gazetteer()
+        >>> g.load([(1, "Bihar"), (2, "Uttar Pradesh")], [(1, "Patna", 1)],
+        ...        [(1, "Rainfall", "mm"), (2, "Groundwater Level", "m")])
+        >>> [g.resolve(q)["states"] for q in ("rainfall in Bihar up to 2015", "please bring up rainfall for Bihar",
+        ...                                    "rainfall in Bihar and UP", "rainfall in U.P. till 2015")]
+        [[1], [1], [1, 2], [2]]
+        >>> g.resolve("Show rainfall of Patna up to 2015")["states"]
+        []
+        >>> [g.resolve(q)["parameters"] for q in ("groundwater levels in Patna", "water levels and rainfalls")]
+        [[2], [2, 1]]
+        """
+        resolved = {"states": [], "cities": [], "parameters": [], "ambiguous": False}
+        for mention in self.mentions(query):
+            bucket = resolved[{"state": "states", "city": "cities", "parameter": "parameters"}[mention["kind"]]]
+            if mention["id"] not in bucket:
+                bucket.append(mention["id"])
+            resolved["ambiguous"] = resolved["ambiguous"] or mention["ambiguous"]
+        return resolved
+
+    def name(self, kind: str, id_: int) -> str:
+        if kind == "state":
+            return self.states.get(id_)
+        if kind == "city":
+            return self.cities[id_][0] if id_ in self.cities else None
+        return self.parameters[id_][0] if id_ in self.parameters else None
+
+    def hints(self, query: str) -> str:
+        """
+        Entity lines for the SQL prompt ("city 'Ayodhya' -> city_id = 3"), "" when nothing matched.
+        """
+        lines = []
+        for mention in self.mentions(query):
+            column = f"{mention['kind']}_id"
+            lines.append(f"- \"{mention['text']}\" = {mention['kind']} '{mention['name']}' ({column} = {mention['id']})")
+        return "\n".join(dict.fromkeys(lines))
+
+    def get_stats(self) -> dict:
+        lookups = self._stats["lookups"]
+        return {
+            "states": len(self.states),
+            "cities": len(self.cities),
+            "parameters": len(self.parameters),
+            "lookups": lookups,
+            "exact_matches": self._stats["exact"],
+            "fuzzy_matches": self._stats["fuzzy"],
+            "avg_lookup_us": round(self._stats["lookup_seconds_total"] / lookups * 1e6, 1) if lookups else 0.0,
+        }
+
+
+gazetteer = Gazetteer()
@@ -1,6 +1,9 @@
 # app/services/gemini_service.py
 from typing import Tuple
-from app.utils import config_util, extract_json_util
+from app.utils import extract_json_util
+from app.services.llm_client import llm_client
+from app.services.prompt_service import prompts
+from app.services.querryGenerator_service import clean_sql, schema_rules
 import logging
 
 _MODEL = "gemini-flash-latest"
@@ -45,36 +48,54 @@ Return the final answer adapted to the user's style:
 Return RAW TEXT only, no JSON, no preface.
 """ 
 
+# Fused "plan" mode: normalization + classification + SQL in a single call
+_PLAN_PROMPT = """You are a multilingual query planner for a chat-bot that analyses the groundwater level, rainfall, groundwater exploitation, gw-recharge, etc.
+TASK: In ONE step, detect the user's language and style, convert the query (English, Hindi, Hinglish, or other) into clean English, identify whether it is personal ("hi, hello, chatting with bot, how you can help, etc.") or bussiness (a question about the data), and for bussiness queries write the PostgreSQL query.
+
+RULES:
+1. Always return STRICT JSON ONLY. Nothing else.
+2. JSON schema:
+{
+  "normalized_english": "<one-line clean English>",
+  "original_language_code": "<BCP47/ISO639-1 if known else 'unknown'>",
+  "style": "detect the user's query's language (english, hindi, hinglish or other-language-name)",
+  "type": "personal or bussiness",
+  "sql": "<PostgreSQL query for bussiness queries, empty string for personal queries>"
+}
+3. Never explain, never add extra keys.
+4. Values must NOT contain newlines, write the SQL on a single line.
+5. If query is vague, still guess best English.
+6. use numeric same as given by user.
+7. "sql" is generated from normalized_english and must follow the schema and rules below.
+
+"""
+
+# Static prefixes: the per-request part (query / payload) is sent after them
+prompts.register("normalize", _NORMALIZE_PROMPT)
+prompts.register("style", _FORMAT_BACK_PROMPT)
+prompts.register("plan", template=lambda schema, parameters: (
+    _PLAN_PROMPT + schema_rules(schema, parameters) + "\nUser query:"))
+
 # ----- HELPER -----
 def _generate(model: str, prompt: str, user_input: str) -> str:
     """
-    Safe wrapper to generate content from Gemini model.
+    Safe blocking wrapper to generate content from Gemini model.
     Raises RuntimeError with clear message on failure.
     """
-    try:
-        model = config_util.get_gemini_model()
-        resp = model.generate_content([prompt, user_input])
-    except Exception as e:
-        logging.error(f"[Gemini ERROR] Failed to generate content: {e}")
-        raise RuntimeError(f"Failed to generate content: {e}")
+    return llm_client.generate_sync(prompt, user_input, stage="normalize")
 
-    # Check for blocked responses
-    if hasattr(resp, "prompt_feedback") and resp.prompt_feedback and getattr(resp.prompt_feedback, "block_reason", None):
-        reason = resp.prompt_feedback.block_reason
-        logging.warning(f"[Gemini BLOCKED] {reason}")
-        raise RuntimeError(f"Gemini blocked: {reason}")
-
-    # Check if candidates exist
-    if not getattr(resp, "candidates", None):
-        logging.warning("[Gemini WARNING] No candidates returned.")
-        raise RuntimeError("No candidates from Gemini.")
-
-    return getattr(resp, "text", "").strip() or user_input
+async def _agenerate(model: str, prompt: str, user_input: str, stage: str) -> str:
+    """
+    Non-blocking wrapper, goes through the shared bounded LLM client
+    (deadline share, hedging and circuit breaker of `stage`).
+    Raises RuntimeError with clear message on failure.
+    """
+    return await llm_client.generate(prompt, user_input, stage=stage)
 
 # ----- MAIN FUNCTIONS -----
 def normalize_query_with_gemini(user_query: str) -> Tuple[str, str, str]:
     try:
-        raw = _generate(_MODEL, _NORMALIZE_PROMPT, user_query)
+        raw = _generate(_MODEL, prompts.prefix("normalize"), user_query)
         data = extract_json_util.extract_json(raw)
         ne = data.get("normalized_english", user_query).strip()
         code = data.get("original_language_code", "unknown").strip()
@@ -89,28 +110,56 @@ async def normalize_query_with_gemini_pipeline(user_query: str) -> dict:
     Async-friendly pipeline version.
     """
     try:
-        # Currently _generate is sync, so just call normally.
-        raw = _generate(_MODEL, _NORMALIZE_PROMPT, user_query)
+        raw = await _agenerate(_MODEL, prompts.prefix("normalize"), user_query, "normalize")
         data = extract_json_util.extract_json(raw)
         return {
             "normalized_english": data.get("normalized_english", user_query).strip(),
             "original_language_code": data.get("original_language_code", "unknown").strip(),
-            "style": data.get("style", "english").strip().lower()
+            "style": data.get("style", "english").strip().lower(),
+            "type": str(data.get("type", "bussiness")).strip().lower(),
         }
     except Exception as e:
         logging.error(f"[DEBUG] normalize_query_with_gemini_pipeline fallback: {e}\nRaw: {user_query}")
         return {
             "normalized_english": user_query,
             "original_language_code": "unknown",
-            "style": "english"
+            "style": "english",
+            "type": "bussiness",
+        }
+
+async def plan_query_with_gemini(user_query: str) -> dict:
+    """
+    Fused pipeline version: normalize + classify + generate SQL in one call.
+    On failure returns the raw query with empty SQL, so the pipeline falls back
+    to the separate SQL generation call.
+    """
+    try:
+        await prompts.ensure_schema()
+        raw = await _agenerate(_MODEL, prompts.prefix("plan"), user_query, "plan")
+        data = extract_json_util.extract_json(raw, required=("normalized_english", "sql"))
+        return {
+            "normalized_english": str(data.get("normalized_english") or user_query).strip(),
+            "original_language_code": str(data.get("original_language_code") or "unknown").strip(),
+            "style": str(data.get("style") or "english").strip().lower(),
+            "type": str(data.get("type") or "bussiness").strip().lower(),
+            "sql": clean_sql(str(data.get("sql") or "")),
+        }
+    except Exception as e:
+        logging.error(f"[DEBUG] plan_query_with_gemini fallback: {e}\nRaw: {user_query}")
+        return {
+            "normalized_english": user_query,
+            "original_language_code": "unknown",
+            "style": "english",
+            "type": "bussiness",
+            "sql": "",
         }
 
-def format_back_with_gemini(answer_english: str, style: str, lang_code: str) -> str:
+async def format_back_with_gemini(answer_english: str, style: str, lang_code: str) -> str:
     payload = f"""original_style: {style}
 original_language_code: {lang_code}
 answer_english: {answer_english}"""
     try:
-        return _generate(_MODEL, _FORMAT_BACK_PROMPT, payload)
+        return await _agenerate(_MODEL, prompts.prefix("style"), payload, "style")
     except Exception as e:
         logging.error(f"[DEBUG] format_back_with_gemini fallback: {e}")
         return answer_english  # fallback to plain English
@@ -0,0 +1,554 @@
+# app/services/llm_client.py
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+from app.services import metrics_service, tracing_service
+from app.services.resilience_service import CircuitBreaker, DeadlineExceeded, LatencyTracker, stage_timeout
+from app.utils.compact_util import estimate_tokens
+
+_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+# "gemini" (Google API) or "fake" (offline stand-in, see app/services/fake_llm.py)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+# A call still running after this percentile of its stage's recent latencies
+# gets a second (hedged) request, first answer wins; 0 disables hedging
+_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Consecutive failures that open the circuit, and how long it stays open
+_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+# auto: register long static prompt prefixes (prompt_service) with the provider's
+# context cache when it has one; off: always send the full prompt
+_CONTEXT_CACHE = os.getenv("LLM_CONTEXT_CACHE", "auto").lower()
+_CONTEXT_CACHE_TTL = float(os.getenv("LLM_CONTEXT_CACHE_TTL", "3600"))
+# A cache this close to expiry is registered again instead of used
+_CACHE_REFRESH_MARGIN = min(60.0, _CONTEXT_CACHE_TTL / 10)
+
+
+def _gemini_model():
+    from app.utils import config_util
+
+    return config_util.get_gemini_model()
+
+
+def _fake_model():
+    from app.services.fake_llm import FakeModel
+
+    return FakeModel()
+
+
+_PROVIDERS = {"gemini": _gemini_model, "fake": _fake_model}
+
+
+def _gemini_cached_model(prefix: str, ttl: float, name: str):
+    from app.utils import config_util
+
+    return config_util.get_cached_gemini_model(prefix, ttl, name)
+
+
+def _fake_cached_model(prefix: str, ttl: float, name: str):
+    from app.services.fake_llm import FakeModel
+
+    return FakeModel(cached_prefix=prefix), None
+
+
+# Providers with context caching: fn(prefix, ttl, name) -> (model answering with the prefix cached, handle)
+_CACHE_PROVIDERS = {"gemini": _gemini_cached_model, "fake": _fake_cached_model}
+
+
+def create_model(provider: str = LLM_PROVIDER):
+    """Model object for `provider`; only the chosen provider's SDK is imported."""
+    if provider not in _PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER '{provider}', expected one of {tuple(_PROVIDERS)}")
+    return _PROVIDERS[provider]()
+
+
+class LLMTimeout(RuntimeError):
+    pass
+
+
+class LLMUnavailable(RuntimeError):
+    """Circuit open: the provider is failing, callers use their fallbacks."""
+
+
+def _prompt_text(contents) -> str:
+    return "".join(contents) if isinstance(contents, list) else contents
+
+
+def _token_counts(resp, prompt: str, text: str):
+    """(prompt, cached, response) tokens from the response's usage metadata, else estimated."""
+    usage = getattr(resp, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt)
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or (estimate_tokens(text) if text else 0)
+    return prompt_tokens, cached_tokens, response_tokens
+
+
+def _extract_text(resp, fallback: str = "") -> str:
+    """
+    Validate a Gemini response and return its text.
+    Raises RuntimeError with clear message on blocked / empty responses.
+    """
+    # Check for blocked responses
+    if hasattr(resp, "prompt_feedback") and resp.prompt_feedback and getattr(resp.prompt_feedback, "block_reason", None):
+        reason = resp.prompt_feedback.block_reason
+        logging.warning(f"[Gemini BLOCKED] {reason}")
+        raise RuntimeError(f"Gemini blocked: {reason}")
+
+    # Check if candidates exist
+    if not getattr(resp, "candidates", None):
+        logging.warning("[Gemini WARNING] No candidates returned.")
+        raise RuntimeError("No candidates from Gemini.")
+
+    return getattr(resp, "text", "").strip() or fallback
+
+
+class LLMClient:
+    """
+    Async client shared by every LLM stage of the pipeline.
+    - At most `max_in_flight` calls run concurrently, the rest wait in a queue.
+    - Every call is bounded by a timeout (seconds), shortened to the stage's
+      share of the request deadline (resilience_service).
+    - Straggling calls are hedged, a circuit breaker rejects calls while
+      the provider is failing.
+    - Queueing / latency counters are kept for the stats endpoint.
+    """
+
+    def __init__(self, max_in_flight: int = _MAX_IN_FLIGHT, timeout: float = _TIMEOUT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._model = None
+        self._in_flight = 0
+        self._queued = 0
+        self.breaker = CircuitBreaker("llm", _BREAKER_FAILURES, _BREAKER_COOLDOWN)
+        self.latency = LatencyTracker()
+        self.ttft = LatencyTracker()  # time to first streamed chunk, per stage
+        self._context_caches = {}     # prompt prefix -> {"stage", "model", "handle", "expires"}
+        self._cache_refreshing = set()
+        self._usage = {}              # stage -> token counters
+        self._stats = {
+            "calls": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "circuit_rejected": 0,
+            "deadline_exceeded": 0,
+            "queue_timeouts": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "latency_seconds_total": 0.0,
+        }
+
+    def _get_model(self):
+        if self._model is None:
+            self._model = create_model()
+        return self._model
+
+    # ----- context caching -----
+    async def cache_prefix(self, stage: str, prefix: str) -> bool:
+        """
+        Register `prefix` with the provider's context cache; calls starting with it
+        then send only the rest. False when the provider has no context caching or
+        refused (e.g. prefix below its minimum size); the full prompt is sent then.
+        """
+        if _CONTEXT_CACHE == "off" or LLM_PROVIDER not in _CACHE_PROVIDERS:
+            return False
+        entry = self._context_caches.get(prefix)
+        if entry is not None and entry["expires"] - time.time() > _CACHE_REFRESH_MARGIN:
+            return True
+        try:
+            model, handle = await asyncio.to_thread(
+                _CACHE_PROVIDERS[LLM_PROVIDER], prefix, _CONTEXT_CACHE_TTL, f"ingres-{stage}")
+        except Exception as e:
+            logging.warning(f"[LLM] Context cache for '{stage}' not created, sending full prompts: {e}")
+            return False
+        for old_prefix, old in list(self._context_caches.items()):
+            if old["stage"] == stage:  # prefix changed (schema reflected again)
+                del self._context_caches[old_prefix]
+                self._delete_cache(old["handle"])
+        self._context_caches[prefix] = {
+            "stage": stage, "model": model, "handle": handle, "expires": time.time() + _CONTEXT_CACHE_TTL,
+        }
+        logging.info(f"[LLM] Context cache for '{stage}' created ({estimate_tokens(prefix)} tokens)")
+        return True
+
+    def _delete_cache(self, handle):
+        if handle is not None:
+            try:
+                handle.delete()
+            except Exception as e:
+                logging.warning(f"[LLM] Could not delete context cache: {e}")
+
+    async def drop_context_caches(self):
+        """Shutdown: delete the provider-side caches (they are billed while they live)."""
+        entries, self._context_caches = list(self._context_caches.values()), {}
+        for entry in entries:
+            await asyncio.to_thread(self._delete_cache, entry["handle"])
+
+    def _route(self, contents):
+        """(model, contents): the cached-context model and the rest when `contents` starts with a cached prefix."""
+        if isinstance(contents, list) and contents[0] in self._context_caches:
+            prefix = contents[0]
+            entry = self._context_caches[prefix]
+            if time.time() < entry["expires"] - _CACHE_REFRESH_MARGIN:
+                rest = contents[1:]
+                return entry["model"], rest[0] if len(rest) == 1 else rest
+            # expiring: send the full prompt and register the prefix again in the background
+            if prefix not in self._cache_refreshing:
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    loop = None
+                if loop is not None:
+                    self._cache_refreshing.add(prefix)
+                    loop.create_task(self._refresh_cache(entry["stage"], prefix), context=contextvars.Context())
+        return self._get_model(), contents
+
+    async def _refresh_cache(self, stage: str, prefix: str):
+        try:
+            self._context_caches.pop(prefix, None)
+            await self.cache_prefix(stage, prefix)
+        finally:
+            self._cache_refreshing.discard(prefix)
+
+    async def _invoke(self, contents):
+        model, contents = self._route(contents)
+        if hasattr(model, "generate_content_async"):
+            return await model.generate_content_async(contents)
+        # SDK without async support: keep the event loop free by using a worker thread
+        return await asyncio.to_thread(model.generate_content, contents)
+
+    async def _acquire(self, timeout: float):
+        """
+        Wait at most `timeout` for a free slot, recording how long the call was queued.
+        Returns (start time, what is left of `timeout` for the call).
+        """
+        queued_at = time.perf_counter()
+        self._queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        finally:
+            self._queued -= 1
+
+        wait = time.perf_counter() - queued_at
+        self._stats["queue_wait_seconds_total"] += wait
+        self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], wait)
+        self._stats["calls"] += 1
+        self._in_flight += 1
+        return time.perf_counter(), max(0.0, timeout - wait)
+
+    async def _slot(self, timeout: float, stage: str):
+        """
+        _acquire for an admitted call. When no call happens (queue timeout, cancelled
+        while queued) the breaker gets its half-open probe back, so it cannot stay stuck.
+        """
+        try:
+            return await self._acquire(timeout)
+        except asyncio.TimeoutError:
+            self.breaker.release()
+            self._stats["queue_timeouts"] += 1
+            logging.error(f"[Gemini TIMEOUT] No free LLM slot within {timeout:.1f}s ({stage})")
+            raise LLMTimeout(f"No free LLM slot within {timeout:.1f}s")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+
+    def _release(self, started: float):
+        self._stats["latency_seconds_total"] += time.perf_counter() - started
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def _admit(self, kind: str, stage: str, timeout: float = None) -> float:
+        """
+        Timeout for a call of `stage`, or raise before queueing when the circuit
+        is open (LLMUnavailable) or the request deadline is spent (LLMTimeout).
+        """
+        try:
+            timeout = stage_timeout(stage, self.timeout if timeout is None else timeout)
+        except DeadlineExceeded as e:
+            self._stats["deadline_exceeded"] += 1
+            self._reject(kind, "deadline")
+            raise LLMTimeout(str(e))
+        if not self.breaker.allow():
+            self._stats["circuit_rejected"] += 1
+            self._reject(kind, "circuit_open")
+            raise LLMUnavailable("LLM circuit open, provider failing")
+        return timeout
+
+    def _reject(self, kind: str, status: str):
+        tracing_service.record_llm(kind, status, 0.0, 0, 0, 0, 0)
+        tracing_service.event(f"llm_{status}")
+
+    def _timed_out(self, stage: str, timeout: float):
+        """
+        Only count timeouts against the provider when the call had the full timeout
+        or at least the stage's usual (p95) latency; shorter ones are the deadline's doing.
+        """
+        usual = self.latency.percentile(stage, 95, _HEDGE_MIN_SAMPLES)
+        if timeout >= self.timeout or (usual is not None and timeout >= usual):
+            self.breaker.failure()
+        else:
+            self.breaker.release()
+
+    async def _call(self, contents, timeout: float = None, stage: str = "generate"):
+        timeout = self.timeout if timeout is None else timeout
+        started, timeout = await self._slot(timeout, stage)
+        try:
+            resp = await asyncio.wait_for(self._invoke(contents), timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            self._timed_out(stage, timeout)
+            logging.error(f"[Gemini TIMEOUT] No response after {timeout:.1f}s ({stage})")
+            raise LLMTimeout(f"Gemini call timed out after {timeout:.1f}s")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self._stats["errors"] += 1
+            self.breaker.failure()
+            logging.error(f"[Gemini ERROR] Failed to generate content: {e}")
+            raise RuntimeError(f"Failed to generate content: {e}")
+        finally:
+            self._release(started)
+        self.latency.observe(stage, time.perf_counter() - started)
+        self.breaker.success()
+        return resp
+
+    def _hedge_delay(self, stage: str, timeout: float):
+        if _HEDGE_PERCENTILE <= 0 or self.breaker.state != "closed":
+            return None
+        delay = self.latency.percentile(stage, _HEDGE_PERCENTILE, _HEDGE_MIN_SAMPLES)
+        return delay if delay is not None and delay < timeout else None
+
+    async def _call_hedged(self, contents, timeout: float, stage: str):
+        """
+        _call, plus a second identical request if the first is still running after
+        the stage's hedge percentile and a slot is free; the first answer wins and
+        the other call is cancelled.
+        """
+        delay = self._hedge_delay(stage, timeout)
+        if delay is None:
+            return await self._call(contents, timeout, stage)
+        first = asyncio.ensure_future(self._call(contents, timeout, stage))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done or self._semaphore.locked():
+                return await first
+
+            self._stats["hedges"] += 1
+            tracing_service.event("llm_hedged")
+            second = asyncio.ensure_future(self._call(contents, timeout - delay, stage))
+            tasks.append(second)
+            pending, error = {first, second}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                outcomes = [(task, task.exception()) for task in done]
+                for task, exc in outcomes:
+                    if exc is None:
+                        if task is second:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = exc
+            raise error
+        finally:
+            # loser, or both calls when the caller was cancelled: free their slots and
+            # let them settle their breaker outcome before returning
+            leftover = [task for task in tasks if not task.done()]
+            for task in leftover:
+                task.cancel()
+            if leftover:
+                await asyncio.gather(*leftover, return_exceptions=True)
+
+    async def generate(self, prompt: str, user_input: str = None, timeout: float = None,
+                       stage: str = "generate", fallback: str = None) -> str:
+        """
+        Generate text for `prompt` (+ optional user input) without blocking the event loop.
+        Falls back to `fallback` (default: `user_input`) when the model returns empty text.
+        `stage` (normalize / plan / sql / explain / style) selects the deadline share
+        and the latency history used for hedging.
+        """
+        contents = [prompt, user_input] if user_input is not None else prompt
+        timeout = self._admit("generate", stage, timeout)
+        started = time.perf_counter()
+        resp, text, status = None, "", "error"
+        try:
+            resp = await self._call_hedged(contents, timeout, stage)
+            text = _extract_text(resp, (user_input or "") if fallback is None else fallback)
+            status = "ok"
+            return text
+        except LLMTimeout:
+            status = "timeout"
+            raise
+        finally:
+            self._record("generate", status, started, contents, resp, text, stage)
+
+    def _record(self, kind: str, status: str, started: float, contents, resp, text: str, stage: str):
+        prompt = _prompt_text(contents)
+        prompt_tokens, cached_tokens, response_tokens = _token_counts(resp, prompt, text)
+        tracing_service.record_llm(
+            kind, status, time.perf_counter() - started, len(prompt), len(text), prompt_tokens, response_tokens,
+            stage=stage, cached_tokens=cached_tokens,
+        )
+        usage = self._usage.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "response_tokens": 0})
+        usage["calls"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["cached_tokens"] += cached_tokens
+        usage["response_tokens"] += response_tokens
+
+    async def stream(self, prompt: str, user_input: str = None, timeout: float = None, stage: str = "explain"):
+        """
+        Yield text chunks as the model produces them (not hedged).
+        `timeout` bounds the wait for the first and for each following chunk.
+        """
+        contents = [prompt, user_input] if user_input is not None else prompt
+        timeout = self._admit("stream", stage, timeout)
+        queued_at = time.perf_counter()
+        try:
+            started, first_timeout = await self._slot(timeout, stage)
+        except LLMTimeout:
+            self._record("stream", "timeout", queued_at, contents, None, "", stage)
+            raise
+        resp, parts, status = None, [], "error"
+        try:
+            model, request = self._route(contents)
+            if not hasattr(model, "generate_content_async"):
+                resp = await asyncio.wait_for(asyncio.to_thread(model.generate_content, request), first_timeout)
+                parts.append(_extract_text(resp))
+                status = "ok"
+                self.breaker.success()
+                yield parts[0]
+                return
+
+            resp = await asyncio.wait_for(model.generate_content_async(request, stream=True), first_timeout)
+            chunks = resp.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                if getattr(chunk, "usage_metadata", None):
+                    resp = chunk  # the last chunk carries the totals
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # chunk without text parts (e.g. final chunk carrying only metadata)
+                    text = ""
+                if text:
+                    if not parts:
+                        self.ttft.observe(stage, time.perf_counter() - started)
+                    parts.append(text)
+                    yield text
+            status = "ok"
+            self.breaker.success()
+        except asyncio.TimeoutError:
+            status = "timeout"
+            self._stats["timeouts"] += 1
+            self._timed_out(stage, timeout)
+            logging.error(f"[Gemini TIMEOUT] Stream stalled for {timeout:.1f}s")
+            raise LLMTimeout(f"Gemini stream timed out after {timeout:.1f}s")
+        except (asyncio.CancelledError, GeneratorExit):
+            # client went away mid-stream
+            status = "cancelled"
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self._stats["errors"] += 1
+            self.breaker.failure()
+            logging.error(f"[Gemini ERROR] Failed to stream content: {e}")
+            raise RuntimeError(f"Failed to stream content: {e}")
+        finally:
+            self._release(started)
+            self._record("stream", status, queued_at, contents, resp, "".join(parts), stage)
+
+    def generate_sync(self, prompt: str, user_input: str = None, stage: str = "sync") -> str:
+        """
+        Blocking variant for callers outside the event loop (scripts, sync helpers).
+        """
+        contents = [prompt, user_input] if user_input is not None else prompt
+        if not self.breaker.allow():
+            self._stats["circuit_rejected"] += 1
+            self._reject("sync", "circuit_open")
+            raise LLMUnavailable("LLM circuit open, provider failing")
+        started = time.perf_counter()
+        try:
+            model, request = self._route(contents)
+            resp = model.generate_content(request)
+        except Exception as e:
+            self.breaker.failure()
+            logging.error(f"[Gemini ERROR] Failed to generate content: {e}")
+            self._record("sync", "error", started, contents, None, "", stage)
+            raise RuntimeError(f"Failed to generate content: {e}")
+        self.breaker.success()
+        text = _extract_text(resp, user_input or "")
+        self._record("sync", "ok", started, contents, resp, text, stage)
+        return text
+
+    @property
+    def model_ready(self) -> bool:
+        return self._model is not None
+
+    async def warm_up(self, ping: bool = False):
+        """
+        Build the model client off the event loop (SDK import and configuration);
+        `ping` also makes one tiny call so the HTTP connection is open.
+        """
+        await asyncio.to_thread(self._get_model)
+        if ping:
+            await self.generate("Reply with OK.", timeout=min(self.timeout, 10))
+
+    def get_stats(self) -> dict:
+        calls = self._stats["calls"]
+        return {
+            "max_in_flight": self.max_in_flight,
+            "timeout_seconds": self.timeout,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "calls": calls,
+            "errors": self._stats["errors"],
+            "timeouts": self._stats["timeouts"],
+            "hedges": self._stats["hedges"],
+            "hedge_wins": self._stats["hedge_wins"],
+            "circuit_rejected": self._stats["circuit_rejected"],
+            "deadline_exceeded": self._stats["deadline_exceeded"],
+            "breaker": self.breaker.get_stats(),
+            "latency_by_stage": self.latency.get_stats(),
+            "ttft_by_stage": self.ttft.get_stats(),
+            "tokens_by_stage": {
+                stage: {
+                    **usage,
+                    "avg_prompt_tokens": round(usage["prompt_tokens"] / usage["calls"], 1),
+                    "cached_share": round(usage["cached_tokens"] / usage["prompt_tokens"], 3)
+                    if usage["prompt_tokens"] else 0.0,
+                }
+                for stage, usage in self._usage.items()
+            },
+            "context_caches": {
+                entry["stage"]: {"expires_in_seconds": round(entry["expires"] - time.time())}
+                for entry in self._context_caches.values()
+            },
+            "avg_queue_wait_ms": round(self._stats["queue_wait_seconds_total"] / calls * 1000, 2) if calls else 0.0,
+            "max_queue_wait_ms": round(self._stats["queue_wait_seconds_max"] * 1000, 2),
+            "avg_latency_ms": round(self._stats["latency_seconds_total"] / calls * 1000, 2) if calls else 0.0,
+        }
+
+
+# Shared instance used by gemini_service, explaination_sercvice and querryGenerator_service
+llm_client = LLMClient()
+
+
+def _collect_metrics():
+    return [
+        ("llm_in_flight", "gauge", "LLM calls currently running.", [({}, llm_client._in_flight)]),
+        ("llm_queued", "gauge", "LLM calls waiting for a free slot.", [({}, llm_client._queued)]),
+        ("llm_circuit_open", "gauge", "1 while the LLM circuit breaker rejects calls.",
+         [({}, int(llm_client.breaker.state == "open"))]),
+    ]
+
+
+metrics_service.registry.register_collector(_collect_metrics)
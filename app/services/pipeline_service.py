@@ -1,99 +1,803 @@
 # app/pipeline/run_pipeline.py
+import asyncio
 import logging
 import json
+import os
+import time
 from fastapi.encoders import jsonable_encoder
 from app.services.gemini_service import (
     normalize_query_with_gemini_pipeline,
+    plan_query_with_gemini,
     format_back_with_gemini
 )
-from app.services.querryGenerator_service import QueryService
-from app.db.utils import run_sql_query
-from app.services.explaination_sercvice import generate_textual_explanation
-from app.utils.senitize import sanitize_result
+from app.services.querryGenerator_service import query_service
+from app.db.utils import fetch_frame_async, get_data_version_async
+from app.services.explaination_sercvice import (
+    generate_textual_explanation,
+    generate_localized_explanation,
+    stream_localized_explanation,
+    FALLBACK_EXPLANATION,
+)
+from app.utils.result_frame import ResultFrame
+from app.services.coalesce_service import SingleFlight
+from app.services import cache_service
+from app.services.sql_compiler_service import sql_compiler
+from app.services.gazetteer_service import gazetteer
+from app.services.aggregate_service import MATVIEW_NAME, aggregate_cube
+from app.services.sql_guard_service import sql_guard
+from app.services import smalltalk_service
+from app.services import session_service
+from app.services.session_service import sessions
+from app.services import tracing_service
+from app.services.resilience_service import DeadlineExceeded, MIN_STAGE_SECONDS, start_deadline, stage_timeout
+from app.db.session import DB_STATEMENT_TIMEOUT_MS
+from app.services.tracing_service import traced
+
+# "two_call": normalize, then generate SQL (default)
+# "plan":     one fused call does normalize + classify + SQL
+PIPELINE_MODES = ("two_call", "plan")
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "two_call")
+
+# "fused":    one call writes the explanation in the user's style (English skips restyling)
+# "two_call": English explanation, then format_back_with_gemini
+EXPLAIN_MODE = os.getenv("EXPLAIN_MODE", "fused")
+
+# Batch pipeline limits
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+
+# Identical concurrent requests share one computation:
+# first on the raw text, then (after normalization) on the normalized English.
+_raw_flight = SingleFlight("raw_text")
+_normalized_flight = SingleFlight("normalized_query")
+
+
+def _deadline_stages(mode: str, explain_mode: str = None) -> list:
+    """Stages that share the request deadline (PIPELINE_DEADLINE_SECONDS), in order."""
+    stages = ["plan"] if mode == "plan" else ["normalize", "sql"]
+    stages += ["db", "explain"]
+    if (explain_mode or EXPLAIN_MODE) == "two_call":
+        stages.append("style")
+    return stages
+
+
+def _coalesce_key(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def get_coalescing_stats() -> dict:
+    return {
+        "raw_text": _raw_flight.get_stats(),
+        "normalized_query": _normalized_flight.get_stats(),
+    }
+
+
+# Per-mode latency so the two modes can be compared directly
+_mode_stats = {mode: {"requests": 0, "total_ms": 0.0} for mode in PIPELINE_MODES}
+
+
+def _record_mode(mode: str, elapsed_ms: float):
+    stats = _mode_stats[mode]
+    stats["requests"] += 1
+    stats["total_ms"] += elapsed_ms
+    logging.info(f"[Pipeline MODE] mode={mode} latency_ms={elapsed_ms:.1f}")
+
+
+def get_mode_stats() -> dict:
+    return {
+        mode: {
+            "requests": stats["requests"],
+            "avg_ms": round(stats["total_ms"] / stats["requests"], 1) if stats["requests"] else 0.0,
+        }
+        for mode, stats in _mode_stats.items()
+    }
 
 
-async def run_pipeline(user_query: str):
+# Small-talk / personal queries answered without SQL
+_smalltalk_stats = {"local": 0, "llm_type": 0}
+
+
+def get_smalltalk_stats() -> dict:
+    return dict(_smalltalk_stats)
+
+
+def _smalltalk_response(reply: dict) -> dict:
+    return {"results": None, "final_answer": reply["final_answer"], "type": "personal"}
+
+
+def _local_smalltalk(user_query: str):
+    """Zero-LLM fast path: canned localized reply for greetings / capability questions."""
+    reply = smalltalk_service.answer(user_query)
+    if reply is None:
+        return None
+    _smalltalk_stats["local"] += 1
+    tracing_service.event("smalltalk_local")
+    logging.info(f"[Pipeline SMALLTALK] Local {reply['intent']} reply ({reply['style']})")
+    return _smalltalk_response(reply)
+
+
+def _llm_smalltalk(normalized_result: dict):
+    """Fallback signal: normalization said the query is personal."""
+    if not smalltalk_service.is_personal(normalized_result):
+        return None
+    _smalltalk_stats["llm_type"] += 1
+    tracing_service.event("smalltalk_llm")
+    return _smalltalk_response(smalltalk_service.personal_answer(normalized_result))
+
+
+async def run_pipeline(user_query: str, mode: str = None):
     """
     Pipeline:
     1. Normalize user query (any language → clean English)
     2. Generate SQL
     3. Execute SQL on DB
     4. Generate explanation
-    5. Format back to user style
-    6. Return both raw results + final answer (JSON-safe)
+    5. Format back to user style (fused into step 4 when EXPLAIN_MODE=fused)
+    6. Return both raw results (a ResultFrame) + final answer
+
+    `mode` selects the two-call path or the fused "plan" call for steps 1-2
+    (defaults to PIPELINE_MODE).
+    Concurrent calls with the same text are coalesced into one execution.
     """
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode '{mode}', expected one of {PIPELINE_MODES}")
+    tracing_service.annotate(query=user_query, mode=mode)
+    local = _local_smalltalk(user_query)
+    if local is not None:
+        return {**local, "mode": mode}
+    start_deadline(_deadline_stages(mode))
+    key = (_coalesce_key(user_query), mode)
+    return await _raw_flight.do(key, lambda: _run_pipeline(user_query, mode))
 
-    # Step 1: Normalize user query
-    try:
+
+def _normalize_key(user_query: str, mode: str) -> str:
+    return cache_service.make_key(_coalesce_key(user_query), mode)
+
+
+async def _normalize_cached(user_query: str, mode: str) -> dict:
+    key = _normalize_key(user_query, mode)
+    cached = await cache_service.normalize_cache.get_async(key)
+    if cached is not None:
+        return cached
+    if mode == "plan":
+        normalized_result = await plan_query_with_gemini(user_query)
+    else:
         normalized_result = await normalize_query_with_gemini_pipeline(user_query)
+    # Don't remember the fallback (raw text echoed back after an LLM failure)
+    if normalized_result.get("original_language_code") != "unknown":
+        await cache_service.normalize_cache.set_async(key, normalized_result)
+    return normalized_result
+
+
+async def _run_pipeline(user_query: str, mode: str):
+    started = time.perf_counter()
+    response = await _run_stages(user_query, mode)
+    _record_mode(mode, (time.perf_counter() - started) * 1000)
+    return {**response, "mode": mode}
+
+
+def _no_data(message: str, results=None) -> dict:
+    return jsonable_encoder({
+        "message": message,
+        "results": results,
+        "final_answer": None,
+    })
+
+
+@traced("normalize")
+async def _normalize_stage(user_query: str, mode: str):
+    """Step 1: returns (normalized_query, normalized_result)."""
+    try:
+        normalized_result = await _normalize_cached(user_query, mode)
         normalized_query = normalized_result.get("normalized_english", "").strip()
         if not normalized_query:
             logging.warning("[Pipeline WARNING] Normalized query is empty. Using original query.")
+            tracing_service.event("normalize_empty")
             normalized_query = user_query
     except Exception as e:
         logging.error(f"[Pipeline ERROR] Normalization failed: {e}")
+        tracing_service.event("normalize_failed")
         normalized_query = user_query
         normalized_result = {"style": "formal", "original_language_code": "en"}
+    tracing_service.annotate(
+        normalized=normalized_query,
+        lang=normalized_result.get("original_language_code"),
+        style=normalized_result.get("style"),
+        query_type=normalized_result.get("type"),
+    )
+    return normalized_query, normalized_result
 
-    # Step 2: Generate SQL
+
+@traced("sql")
+async def _sql_stage(normalized_query: str, normalized_result: dict):
+    """
+    Step 2: returns (sql, params, intent); sql is "" when no query could be produced
+    and intent is only set for locally compiled queries.
+    Local template compiler first, then SQL from the plan call, then Gemini;
+    LLM SQL goes through the guardrail (rejected SQL -> "").
+    """
     try:
-        sql = QueryService().generate_sql(normalized_query)
-        logging.info(f"[Pipeline SQL] Generated: {sql}")
+        await sql_compiler.ensure_loaded()
+        compiled = sql_compiler.compile(normalized_query)
+        if compiled is not None:
+            logging.info(f"[Pipeline SQL] Compiled locally: {compiled['params']}")
+            tracing_service.event("sql_compiled")
+            tracing_service.annotate(sql=compiled["sql"], sql_params=compiled["params"])
+            return compiled["sql"], compiled["params"], compiled["intent"]
+        sql = normalized_result.get("sql")
+        if sql:
+            logging.info(f"[Pipeline SQL] From plan call: {sql}")
+            tracing_service.event("sql_from_plan")
+        else:
+            # Resolved entity IDs let the generated SQL filter on keys instead of ILIKE
+            hints = gazetteer.hints(normalized_query)
+            sql_key = cache_service.make_key(_coalesce_key(normalized_query), hints)
+            sql = await cache_service.sql_cache.get_async(sql_key)
+            if sql is None:
+                sql = await query_service.generate_sql(normalized_query, hints)
+                logging.info(f"[Pipeline SQL] Generated: {sql}")
+                tracing_service.event("sql_generated")
+                if sql:
+                    await cache_service.sql_cache.set_async(sql_key, sql)
+            else:
+                tracing_service.event("sql_cached")
+        tracing_service.annotate(sql=sql)
         if not sql:
-            return jsonable_encoder({
-                "message": "Sorry, data not found",
-                "results": None,
-                "final_answer": None,
-            })
+            tracing_service.event("no_sql")
+            return "", {}, None
+
+        # LLM-written SQL only runs if it passes the guardrail (read-only, known tables, cost)
+        verdict = await sql_guard.check(sql)
+        if not verdict["ok"]:
+            tracing_service.event("sql_blocked")
+            return "", {}, None
+        return verdict["sql"], {}, None
     except Exception as e:
         logging.error(f"[Pipeline ERROR] SQL generation failed: {e}")
-        return jsonable_encoder({
-            "message": "Sorry, data not found",
-            "results": None,
-            "final_answer": None,
-        })
+        tracing_service.event("sql_failed")
+        return "", {}, None
+
+
+@traced("db")
+async def _db_stage(sql: str, params: dict, intent: dict = None) -> ResultFrame:
+    """
+    Step 3: cached result of the query as a ResultFrame. Raises on DB errors.
+    Compiled intents are answered from the in-memory aggregate cube when possible.
+    """
+    data_version = await cache_service.get_data_version_async(get_data_version_async)
+    # never waits for a load: until the cube / view is at data_version, SQL answers
+    aggregate_cube.schedule(data_version)
+    if intent is not None and MATVIEW_NAME in sql and not aggregate_cube.view_ready:
+        compiled = sql_compiler.render(intent)  # rendered while the view was current
+        sql, params = compiled["sql"], compiled["params"]
+    started = time.perf_counter()
+    if intent is not None:
+        result = aggregate_cube.answer(intent, data_version)
+        if result is not None:
+            result = ResultFrame.from_rows(result["columns"], result["rows"])
+            tracing_service.record_result("cube", len(result), time.perf_counter() - started)
+            return result
+    result_key = cache_service.make_key(data_version, sql, params)
+    cached = await cache_service.result_cache.get_async(result_key)
+    if cached is not None:
+        result = ResultFrame.from_dict(cached)
+        tracing_service.record_result("cache", len(result), time.perf_counter() - started)
+        return result
+    try:
+        timeout = stage_timeout("db", DB_STATEMENT_TIMEOUT_MS / 1000)
+    except DeadlineExceeded:
+        # deadline spent: the query still gets a short try, the answer falls back to data only
+        timeout = MIN_STAGE_SECONDS
+    result = await fetch_frame_async(sql, params, int(timeout * 1000))
+    tracing_service.record_result("db", len(result), time.perf_counter() - started)
+    await cache_service.result_cache.set_async(result_key, result.to_dict("columns"))
+    return result
+
+
+async def fetch_intent(intent: dict) -> ResultFrame:
+    """
+    Result of a structured intent (REST analytics): same cube / result cache /
+    template SQL path as compiled NL queries, no LLM involved.
+    """
+    compiled = sql_compiler.render(intent)
+    return await _db_stage(compiled["sql"], compiled["params"], intent)
+
+
+def _answer_key(normalized_query: str, result: ResultFrame, style: str, lang_code: str) -> str:
+    return cache_service.make_key(_coalesce_key(normalized_query), result.digest(), style, lang_code)
+
+
+@traced("explain")
+async def _explain_stage(normalized_query: str, normalized_result: dict, result: ResultFrame) -> str:
+    """Steps 4-5: final answer in the user's style (answer cache first)."""
+    style = normalized_result.get("style", "formal")
+    lang_code = normalized_result.get("original_language_code", "en")
+    answer_key = _answer_key(normalized_query, result, style, lang_code)
+    final_answer = await cache_service.answer_cache.get_async(answer_key)
+    if final_answer is not None:
+        tracing_service.event("answer_cached")
+        return final_answer
+
+    if EXPLAIN_MODE == "fused":
+        # Step 4+5: Explanation written directly in the user's style
+        final_answer = await generate_localized_explanation(normalized_query, result, style, lang_code)
+        if final_answer != FALLBACK_EXPLANATION:
+            await cache_service.answer_cache.set_async(answer_key, final_answer)
+        else:
+            tracing_service.event("explain_fallback")
+        return final_answer
+    return await _explain_then_format(normalized_query, result, style, lang_code, answer_key)
+
+
+async def _run_stages(user_query: str, mode: str):
+    # Step 1: Normalize user query (in "plan" mode this also returns the SQL)
+    normalized_query, normalized_result = await _normalize_stage(user_query, mode)
+    personal = _llm_smalltalk(normalized_result)
+    if personal is not None:
+        return personal
+    return await _answer_shared(normalized_query, normalized_result)
+
+
+async def _answer_shared(normalized_query: str, normalized_result: dict):
+    # Different wordings that normalize to the same English question share steps 2-5
+    key = (
+        _coalesce_key(normalized_query),
+        normalized_result.get("style", "formal"),
+        normalized_result.get("original_language_code", "en"),
+    )
+    return await _normalized_flight.do(key, lambda: _answer_normalized(normalized_query, normalized_result))
+
+
+async def precompute_answer(user_texts: list, normalized_result: dict) -> dict:
+    """
+    Warm the caches for a logged question (precompute job): the normalize cache for
+    its raw `user_texts` ([mode, text] pairs, two_call mode only, the plan call also
+    carries SQL), then SQL, result and answer like a live request, sharing in-flight
+    work with live requests.
+    """
+    for mode, text in user_texts:
+        if mode == "two_call":
+            await cache_service.normalize_cache.set_async(_normalize_key(text, mode), normalized_result)
+    return await _answer_shared(normalized_result["normalized_english"], normalized_result)
+
+
+async def _answer_normalized(normalized_query: str, normalized_result: dict):
+    """
+    Steps 2-5 of the pipeline for an already normalized query.
+    """
+    # Step 2: Generate SQL
+    sql, params, intent = await _sql_stage(normalized_query, normalized_result)
+    if not sql:
+        return _no_data("Sorry, data not found")
 
     # Step 3: Execute SQL
     try:
-        result = run_sql_query(sql)
-        result = sanitize_result(result)
-        if not result or (isinstance(result, dict) and not result.get("rows")):
-            logging.info("[Pipeline INFO] Query returned no rows.")
-            return jsonable_encoder({
-                "message": "Sorry, data not found",
-                "results": [],
-                "final_answer": None,
-            })
+        result = await _db_stage(sql, params, intent)
     except Exception as e:
         logging.error(f"[Pipeline ERROR] Database query failed: {e}")
-        return jsonable_encoder({
-            "message": "Sorry, database query failed",
-            "results": None,
-            "final_answer": None,
-        })
+        tracing_service.event("db_failed")
+        return _no_data("Sorry, database query failed")
+    if not result:
+        logging.info("[Pipeline INFO] Query returned no rows.")
+        tracing_service.event("no_rows")
+        return _no_data("Sorry, data not found", [])
+
+    final_answer = await _explain_stage(normalized_query, normalized_result, result)
 
+    # ✅ Final response; the router serializes the ResultFrame (fast_json)
+    return {
+        "results": result,           # raw DB query output
+        "final_answer": final_answer # AI generated explanation/answer
+    }
+
+
+async def stream_pipeline(user_query: str, mode: str = None):
+    """
+    Streaming variant of run_pipeline.
+    Yields (event, data) pairs as soon as each stage completes:
+      normalized → sql → results → answer_delta (explanation chunks) → done
+    Early exits (no SQL, DB error, no rows) go straight to "done" with a message.
+    The explanation is always written in the user's style in one streamed call.
+    """
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode '{mode}', expected one of {PIPELINE_MODES}")
+    started = time.perf_counter()
+    tracing_service.annotate(query=user_query, mode=mode)
+    local = _local_smalltalk(user_query)
+    if local is not None:
+        yield "done", {**local, "mode": mode}
+        return
+    start_deadline(_deadline_stages(mode, "fused"))
+
+    normalized_query, normalized_result = await _normalize_stage(user_query, mode)
+    style = normalized_result.get("style", "formal")
+    lang_code = normalized_result.get("original_language_code", "en")
+    yield "normalized", {
+        "normalized_english": normalized_query,
+        "style": style,
+        "original_language_code": lang_code,
+    }
+    personal = _llm_smalltalk(normalized_result)
+    if personal is not None:
+        yield "done", {**personal, "mode": mode}
+        return
+
+    sql, params, intent = await _sql_stage(normalized_query, normalized_result)
+    if not sql:
+        yield "done", {**_no_data("Sorry, data not found"), "mode": mode}
+        return
+    yield "sql", jsonable_encoder({"sql": sql, "params": params})
+
+    try:
+        result = await _db_stage(sql, params, intent)
+    except Exception as e:
+        logging.error(f"[Pipeline ERROR] Database query failed: {e}")
+        tracing_service.event("db_failed")
+        yield "done", {**_no_data("Sorry, database query failed"), "mode": mode}
+        return
+    if not result:
+        tracing_service.event("no_rows")
+        yield "done", {**_no_data("Sorry, data not found", []), "mode": mode}
+        return
+    yield "results", result
+
+    answer_key = _answer_key(normalized_query, result, style, lang_code)
+    final_answer = await cache_service.answer_cache.get_async(answer_key)
+    if final_answer is not None:
+        tracing_service.event("answer_cached")
+        yield "answer_delta", {"text": final_answer}
+    else:
+        chunks = []
+        with tracing_service.span("explain"):
+            async for chunk in stream_localized_explanation(normalized_query, result, style, lang_code):
+                chunks.append(chunk)
+                yield "answer_delta", {"text": chunk}
+        final_answer = "".join(chunks)
+        if final_answer != FALLBACK_EXPLANATION:
+            await cache_service.answer_cache.set_async(answer_key, final_answer)
+        else:
+            tracing_service.event("explain_fallback")
+
+    _record_mode(mode, (time.perf_counter() - started) * 1000)
+    yield "done", {"final_answer": final_answer, "mode": mode}
+
+
+# ----- CONVERSATION SESSIONS -----
+async def run_session_turn(session, user_query: str, mode: str = None) -> dict:
+    """
+    One turn of a conversation (/nlp/sessions/{id}/query), same response as
+    run_pipeline plus the session fields. Turns of one session run in order.
+    - follow-ups that only change slots ("and for Mirzapur?", "now show rainfall too")
+      are patched locally: no normalization / SQL call
+    - other follow-ups are normalized with the previous question as context
+    - compiled queries reuse the previous result and fetch only the missing rows
+    """
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode '{mode}', expected one of {PIPELINE_MODES}")
+    tracing_service.annotate(query=user_query, mode=mode, session=session.id)
+    async with session.lock:
+        started = time.perf_counter()
+        response = await _session_turn(session, user_query, mode)
+        _record_mode(mode, (time.perf_counter() - started) * 1000)
+        return {**response, "mode": mode, "session_id": session.id, "turn": session.turns}
+
+
+async def _session_turn(session, user_query: str, mode: str) -> dict:
+    local = _local_smalltalk(user_query)
+    if local is not None:
+        sessions.record_turn(session, user_query)
+        return local
+    start_deadline(_deadline_stages(mode))
+
+    await sql_compiler.ensure_loaded()
+    intent, how = None, None
+    if session.intent is not None:
+        intent, how = session_service.patch_intent(session.intent, user_query)
+    if intent is not None:
+        # Slot-only follow-up: the conversation's language / style, a question built from the slots
+        logging.info(f"[Pipeline SESSION] Follow-up patched locally ({how}): {session_service.slots(intent)}")
+        tracing_service.event("session_followup_local")
+        followup = "local"
+        normalized_query = session_service.describe(intent)
+        normalized_result = {**session.normalized_result, "normalized_english": normalized_query}
+        tracing_service.annotate(
+            normalized=normalized_query,
+            lang=normalized_result.get("original_language_code"),
+            style=normalized_result.get("style"),
+            query_type=normalized_result.get("type"),
+        )
+        compiled = sql_compiler.render(intent)
+        sql, params = compiled["sql"], compiled["params"]
+    else:
+        text, followup = user_query, None
+        if session.question and session_service.looks_followup(user_query):
+            tracing_service.event("session_followup_context")
+            text, followup = session_service.with_context(session.question, user_query), "context"
+        normalized_query, normalized_result = await _normalize_stage(text, mode)
+        personal = _llm_smalltalk(normalized_result)
+        if personal is not None:
+            sessions.record_turn(session, user_query)
+            return personal
+        sql, params, intent = await _sql_stage(normalized_query, normalized_result)
+        if not sql:
+            sessions.record_turn(session, user_query, followup, question=normalized_query)
+            return {**_no_data("Sorry, data not found"), "followup": followup}
+
+    try:
+        result, fetch, data_version = await _session_fetch(session, sql, params, intent)
+    except Exception as e:
+        logging.error(f"[Pipeline ERROR] Database query failed: {e}")
+        tracing_service.event("db_failed")
+        sessions.record_turn(session, user_query, followup, question=normalized_query)
+        return {**_no_data("Sorry, database query failed"), "followup": followup}
+    sessions.record_turn(
+        session, user_query, followup, fetch, normalized_query, normalized_result,
+        intent, sql, params, result, data_version,
+    )
+    extra = {"followup": followup, "fetch": fetch, "slots": session_service.slots(intent)}
+    if not result:
+        tracing_service.event("no_rows")
+        return {**_no_data("Sorry, data not found", []), **extra}
+
+    final_answer = await _explain_stage(normalized_query, normalized_result, result)
+    return {"results": result, "final_answer": final_answer, **extra}
+
+
+async def _session_fetch(session, sql: str, params: dict, intent: dict):
+    """
+    Step 3 of a session turn: (result, "reuse" | "delta" | "full", data_version).
+    A compiled query that narrows or extends the previous turn's one is answered
+    from the previous rows plus, for "delta", only the rows they lack.
+    """
+    data_version = await cache_service.get_data_version_async(get_data_version_async)
+    kind, delta = "full", None
+    if intent is not None and session.frame is not None and session.data_version == data_version:
+        kind, delta = session_service.plan_fetch(session.intent, intent)
+    if kind == "full":
+        return await _db_stage(sql, params, intent), kind, data_version
+
+    started = time.perf_counter()
+    result = session_service.select_rows(session.frame, intent)
+    if kind == "delta":
+        logging.info(f"[Pipeline SESSION] Fetching delta: {session_service.slots(delta)}")
+        compiled = sql_compiler.render(delta)
+        fetched = await _db_stage(compiled["sql"], compiled["params"], delta)
+        result = session_service.merge(result, fetched, intent["level"])
+    tracing_service.event(f"session_{kind}")
+    tracing_service.record_result("session", len(result), time.perf_counter() - started)
+    # same key _db_stage uses, so the full query is a cache hit for everyone
+    await cache_service.result_cache.set_async(cache_service.make_key(data_version, sql, params), result.to_dict("columns"))
+    return result, kind, data_version
+
+
+async def _explain_then_format(normalized_query: str, result: ResultFrame, style: str, lang_code: str, answer_key: str) -> str:
+    """
+    Original two-call steps 4-5 (EXPLAIN_MODE=two_call).
+    """
     # Step 4: Explanation
     try:
-        textual_explanation = generate_textual_explanation(normalized_query, result)
+        textual_explanation = await generate_textual_explanation(normalized_query, result)
     except Exception as e:
         logging.error(f"[Pipeline ERROR] Explanation generation failed: {e}")
         textual_explanation = "Sorry, explanation could not be generated"
 
     # Step 5: Format back to user style
     try:
-        final_answer = format_back_with_gemini(
-            textual_explanation,
-            normalized_result.get("style", "formal"),
-            normalized_result.get("original_language_code", "en"),
-        )
+        final_answer = await format_back_with_gemini(textual_explanation, style, lang_code)
+        if textual_explanation != FALLBACK_EXPLANATION:
+            await cache_service.answer_cache.set_async(answer_key, final_answer)
+        else:
+            tracing_service.event("explain_fallback")
     except Exception as e:
         logging.error(f"[Pipeline ERROR] Formatting failed: {e}")
         final_answer = "Sorry, explanation could not be generated"
+    return final_answer
 
-    # ✅ Final response as JSON-safe dict
-    response = {
-        "results": result,           # raw DB query output
-        "final_answer": final_answer # AI generated explanation/answer
-    }
 
-    return jsonable_encoder(response)   # ensures it's JSON serializable
+# ----- BATCH PIPELINE -----
+async def _bounded_map(fn, items, limit: int) -> list:
+    """Run `fn(item)` for every item with at most `limit` running at once."""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+def _merge_key(intent: dict):
+    """Compiled intents that differ only in their cities / states can share one query."""
+    return (
+        intent["level"],
+        tuple(intent["parameter_ids"]),
+        intent["year_from"],
+        intent["year_to"],
+        tuple(intent["years"]),
+    )
+
+
+async def _batch_db_stage(plans: dict, limit: int, stats: dict) -> dict:
+    """
+    Step 3 for a whole batch. `plans` maps normalized key -> (sql, params, intent).
+    Identical statements run once; compiled queries of the same shape are merged
+    into one query over the union of their locations and split afterwards.
+    Returns normalized key -> ResultFrame (or Exception).
+    """
+    results = {}
+    merge_groups = {}
+    statements = {}
+    for nkey, (sql, params, intent) in plans.items():
+        if intent is not None:
+            merge_groups.setdefault(_merge_key(intent), []).append((nkey, intent))
+        else:
+            statements.setdefault(cache_service.make_key(sql, params), (sql, params, [], None))[2].append(nkey)
+
+    merged = []
+    for group in merge_groups.values():
+        if len(group) == 1:
+            nkey, intent = group[0]
+            sql, params, _ = plans[nkey]
+            statements.setdefault(cache_service.make_key(sql, params), (sql, params, [], intent))[2].append(nkey)
+            continue
+        level = group[0][1]["level"]
+        field = "cities" if level == "city" else "states"
+        id_field = "city_ids" if level == "city" else "state_ids"
+        union, union_ids = [], []
+        for _, intent in group:
+            union.extend(name for name in intent[field] if name not in union)
+            union_ids.extend(id_ for id_ in intent[id_field] if id_ not in union_ids)
+        merged_intent = {**group[0][1], field: union, id_field: union_ids}
+        compiled = sql_compiler.render(merged_intent)
+        merged.append((compiled["sql"], compiled["params"], group, "city" if level == "city" else "state", field, merged_intent))
+
+    async def run_statement(entry):
+        sql, params, nkeys, intent = entry
+        result = await _db_stage(sql, params, intent)
+        for nkey in nkeys:
+            results[nkey] = result
+
+    async def run_merged(entry):
+        sql, params, group, column, field, merged_intent = entry
+        result = await _db_stage(sql, params, merged_intent)
+        for nkey, intent in group:
+            results[nkey] = result.where_in(column, intent[field])
+
+    entries = list(statements.values())
+    outcomes = await _bounded_map(run_statement, entries, limit)
+    for (_, _, nkeys, _), outcome in zip(entries, outcomes):
+        if isinstance(outcome, Exception):
+            for nkey in nkeys:
+                results[nkey] = outcome
+    outcomes = await _bounded_map(run_merged, merged, limit)
+    for (_, _, group, _, _, _), outcome in zip(merged, outcomes):
+        if isinstance(outcome, Exception):
+            for nkey, _ in group:
+                results[nkey] = outcome
+
+    stats["unique_sql"] = len({cache_service.make_key(sql, params) for sql, params, _ in plans.values()})
+    stats["db_round_trips"] = len(statements) + len(merged)
+    return results
+
+
+async def iter_pipeline_batch(queries: list, mode: str = None, concurrency: int = None, stats: dict = None):
+    """
+    Batch version of run_pipeline. Every stage runs across the whole batch with
+    bounded concurrency and deduplication:
+      raw text → normalize once, normalized English → SQL once,
+      identical / mergeable SQL → one DB round trip, same answer → explained once.
+    Yields {"index", "text", "result"} (same shape as run_pipeline) or
+    {"index", "text", "error"} per item, in completion order.
+    `stats` (optional dict) is filled with dedup counters.
+    """
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode '{mode}', expected one of {PIPELINE_MODES}")
+    if len(queries) > BATCH_MAX_ITEMS:
+        raise ValueError(f"Batch too large: {len(queries)} items (max {BATCH_MAX_ITEMS})")
+    limit = concurrency or BATCH_CONCURRENCY
+    stats = {} if stats is None else stats
+    stats["items"] = len(queries)
+
+    # Small talk never enters the pipeline
+    pending = []
+    for index, query in enumerate(queries):
+        local = _local_smalltalk(query)
+        if local is not None:
+            yield {"index": index, "text": query, "result": {**local, "mode": mode}}
+        else:
+            pending.append((index, query))
+
+    # Step 1: normalize each distinct raw text once
+    raw_keys = {index: _coalesce_key(query) for index, query in pending}
+    raw_first = {}
+    for index, query in pending:
+        raw_first.setdefault(raw_keys[index], query)
+    stats["unique_queries"] = len(raw_first)
+    outcomes = await _bounded_map(lambda q: _normalize_stage(q, mode), list(raw_first.values()), limit)
+    normalized = dict(zip(raw_first, outcomes))
+
+    # Step 2: SQL once per distinct normalized query
+    norm_first = {}
+    for rkey, outcome in normalized.items():
+        if not isinstance(outcome, Exception) and not smalltalk_service.is_personal(outcome[1]):
+            norm_first.setdefault(_coalesce_key(outcome[0]), outcome)
+    stats["unique_normalized"] = len(norm_first)
+    outcomes = await _bounded_map(lambda o: _sql_stage(*o), list(norm_first.values()), limit)
+    plans = {}
+    responses = {}  # (normalized key, style, language) -> response / Exception
+    for nkey, outcome in zip(norm_first, outcomes):
+        if isinstance(outcome, Exception):
+            responses[nkey] = outcome
+        elif not outcome[0]:
+            responses[nkey] = _no_data("Sorry, data not found")
+        else:
+            plans[nkey] = outcome
+
+    # Step 3: DB reads, deduplicated and merged
+    db_results = await _batch_db_stage(plans, limit, stats)
+
+    # Steps 4-5: one explanation per (query, style, language), streamed out per item
+    item_groups = {}
+    for index, query in pending:
+        outcome = normalized[raw_keys[index]]
+        if isinstance(outcome, Exception):
+            yield {"index": index, "text": query, "error": str(outcome)}
+            continue
+        normalized_query, normalized_result = outcome
+        nkey = _coalesce_key(normalized_query)
+        akey = (nkey, normalized_result.get("style", "formal"), normalized_result.get("original_language_code", "en"))
+        item_groups.setdefault(akey, (normalized_query, normalized_result, []))[2].append((index, query))
+
+    async def answer(akey):
+        normalized_query, normalized_result, _ = item_groups[akey]
+        personal = _llm_smalltalk(normalized_result)
+        if personal is not None:
+            return personal
+        nkey = akey[0]
+        if nkey in responses:
+            outcome = responses[nkey]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        result = db_results.get(nkey)
+        if isinstance(result, Exception):
+            logging.error(f"[Pipeline ERROR] Database query failed: {result}")
+            tracing_service.event("db_failed")
+            return _no_data("Sorry, database query failed")
+        if not result:
+            tracing_service.event("no_rows")
+            return _no_data("Sorry, data not found", [])
+        final_answer = await _explain_stage(normalized_query, normalized_result, result)
+        return {"results": result, "final_answer": final_answer}
+
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def answer_group(akey):
+        async with semaphore:
+            try:
+                return akey, {**(await answer(akey)), "mode": mode}, None
+            except Exception as e:
+                return akey, None, e
+
+    stats["unique_answers"] = len(item_groups)
+    for finished in asyncio.as_completed([answer_group(akey) for akey in item_groups]):
+        akey, response, error = await finished
+        for index, query in item_groups[akey][2]:
+            if error is not None:
+                yield {"index": index, "text": query, "error": str(error)}
+            else:
+                yield {"index": index, "text": query, "result": response}
+
+
+async def run_pipeline_batch(queries: list, mode: str = None, concurrency: int = None) -> dict:
+    """
+    Collecting wrapper around iter_pipeline_batch: {"items": [...in input order], "stats": {...}}.
+    """
+    stats = {}
+    items = [item async for item in iter_pipeline_batch(queries, mode, concurrency, stats)]
+    items.sort(key=lambda item: item["index"])
+    return {"items": items, "stats": stats}
@@ -0,0 +1,139 @@
+# app/services/precompute_service.py
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+from app.services import cache_service, query_log_service
+from app.services.explaination_sercvice import FALLBACK_EXPLANATION
+
+# Top normalized questions per language to precompute; 0 disables the job
+PRECOMPUTE_TOP_N = int(os.getenv("PRECOMPUTE_TOP_N", "50"))
+# Only requests logged in the last N days count
+PRECOMPUTE_WINDOW_DAYS = float(os.getenv("PRECOMPUTE_WINDOW_DAYS", "7"))
+# Questions answered at once (each may take LLM slots from live traffic)
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "4"))
+# Also rerun every N seconds (0 = only at startup and after yearly_data changed)
+PRECOMPUTE_INTERVAL = float(os.getenv("PRECOMPUTE_INTERVAL", "0"))
+
+
+class Precomputer:
+    """
+    Mines the query log for the most asked questions per language and runs
+    steps 2-5 of the pipeline for them, so SQL, results and localized answers
+    are in the caches before users ask. Reruns when yearly_data changes (the
+    answers were just invalidated) and, optionally, on an interval.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._rerun = False
+        self._timer = None
+        self._stats = {"runs": 0, "last_trigger": None, "last_run_at": None, "last_run_ms": 0.0,
+                       "questions": 0, "answered": 0, "failed": 0}
+
+    def select(self, top_n: int = PRECOMPUTE_TOP_N, log_path: str = None) -> list:
+        """Questions to precompute, most asked first within each language."""
+        since = time.time() - PRECOMPUTE_WINDOW_DAYS * 86400
+        records = query_log_service.read_records(log_path or query_log_service.QUERY_LOG_PATH, since)
+        by_lang = query_log_service.top_queries(records, top_n)
+        return [entry for entries in by_lang.values() for entry in entries]
+
+    async def run(self, trigger: str = "manual", top_n: int = PRECOMPUTE_TOP_N, log_path: str = None) -> dict:
+        from app.services.pipeline_service import precompute_answer
+
+        started = time.perf_counter()
+        questions = await asyncio.to_thread(self.select, top_n, log_path)
+        semaphore = asyncio.Semaphore(max(1, PRECOMPUTE_CONCURRENCY))
+        outcome = {"questions": len(questions), "answered": 0, "failed": 0}
+
+        async def answer(entry):
+            normalized_result = {
+                "normalized_english": entry["normalized"],
+                "original_language_code": entry["lang"],
+                "style": entry["style"],
+                "type": entry["type"] or "bussiness",
+            }
+            async with semaphore:
+                try:
+                    response = await precompute_answer(entry["texts"], normalized_result)
+                except Exception as e:
+                    logging.error(f"[Precompute ERROR] '{entry['normalized']}': {e}")
+                    response = {}
+            answered = response.get("final_answer") not in (None, FALLBACK_EXPLANATION)
+            outcome["answered" if answered else "failed"] += 1
+
+        await asyncio.gather(*(answer(entry) for entry in questions))
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        self._stats.update(outcome, last_trigger=trigger, last_run_at=round(time.time()), last_run_ms=elapsed)
+        self._stats["runs"] += 1
+        logging.info(
+            f"[Precompute] {trigger}: {outcome['answered']}/{outcome['questions']} questions "
+            f"precomputed in {elapsed}ms"
+        )
+        return outcome
+
+    def schedule(self, trigger: str):
+        """
+        Start a background run (needs a running event loop). A trigger during a run
+        queues exactly one more run. The task gets a fresh context, so it does not
+        inherit the trace / deadline of the request that noticed the change.
+        """
+        if PRECOMPUTE_TOP_N <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # sync caller (scripts); they can run the job themselves
+        if self._task is not None and not self._task.done():
+            self._rerun = True
+            return
+        self._task = loop.create_task(self._loop(trigger), context=contextvars.Context())
+
+    async def _loop(self, trigger: str):
+        while True:
+            self._rerun = False
+            try:
+                await self.run(trigger)
+            except Exception as e:
+                logging.error(f"[Precompute ERROR] Run failed: {e}")
+            if not self._rerun:
+                break
+            trigger = "data_change"
+
+    def _on_data_change(self, previous: str, version: str):
+        if version != "unknown":
+            self.schedule("data_change")
+
+    async def _every(self, seconds: float):
+        while True:
+            await asyncio.sleep(seconds)
+            self.schedule("interval")
+
+    def start(self):
+        """App startup: hook data changes, first run, optional interval."""
+        query_log_service.enable()
+        if PRECOMPUTE_TOP_N <= 0:
+            return
+        cache_service.on_data_change(self._on_data_change)
+        self.schedule("startup")
+        if PRECOMPUTE_INTERVAL > 0:
+            self._timer = asyncio.get_running_loop().create_task(
+                self._every(PRECOMPUTE_INTERVAL), context=contextvars.Context())
+
+    async def stop(self):
+        for task in (self._timer, self._task):
+            if task is not None and not task.done():
+                task.cancel()
+
+    def get_stats(self) -> dict:
+        return {
+            "top_n": PRECOMPUTE_TOP_N,
+            "running": self._task is not None and not self._task.done(),
+            **self._stats,
+            "query_log": query_log_service.get_stats(),
+        }
+
+
+precomputer = Precomputer()
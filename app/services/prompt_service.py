@@ -0,0 +1,198 @@
+# app/services/prompt_service.py
+"""
+Prompt assembly for the LLM stages. Every stage sends a static prefix
+(instructions, schema, rules) that is byte-identical on every call, followed
+by the per-request part (query, data, style). Providers reuse an unchanged
+prefix: implicitly (prefix caching) or explicitly when it is registered as
+cached context (llm_client.cache_prefix).
+
+The schema section of the SQL / plan prompts is reflected from the live DB
+(columns, keys, the actual parameter names and units) the first time it is
+needed and checked again after yearly_data changed; a prefix only changes when
+its rendered text does.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from sqlalchemy import inspect, text
+
+from app.db.session import get_engine
+from app.services import cache_service
+from app.services.llm_client import llm_client
+from app.utils.compact_util import estimate_tokens
+
+# Prefixes shorter than this are left to the provider's implicit prefix caching
+# (explicit context caches have a minimum size, 1024 tokens on Gemini Flash)
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# Seconds before a failed schema reflection is retried
+_RETRY_SECONDS = 60
+
+_TABLES = ("states", "cities", "parameters", "yearly_data")
+_PARAMETERS_SQL = "SELECT parameter_name, unit FROM parameters ORDER BY parameter_id"
+
+# Used until the DB has been reflected (or when it cannot be)
+_FALLBACK_SCHEMA = """TABLE states (
+  state_id INTEGER PRIMARY KEY,
+  state_name VARCHAR(100)
+);
+
+TABLE cities (
+  city_id INTEGER PRIMARY KEY,
+  city_name VARCHAR(100),
+  state_id INTEGER REFERENCES states(state_id)
+);
+
+TABLE parameters (
+  parameter_id INTEGER PRIMARY KEY,
+  parameter_name VARCHAR(100), -- values: 'Groundwater Level', 'Water Recharged', 'Rainfall', 'Exploitation'
+  unit VARCHAR(50)
+);
+
+TABLE yearly_data (
+  data_id INTEGER PRIMARY KEY,
+  city_id INTEGER REFERENCES cities(city_id),
+  parameter_id INTEGER REFERENCES parameters(parameter_id),
+  year INTEGER,
+  value DOUBLE PRECISION
+);
+"""
+_FALLBACK_PARAMETERS = ["Groundwater Level", "Water Recharged", "Rainfall", "Exploitation"]
+
+
+def reflect_schema():
+    """(schema section, parameter names) from the DB (blocking)."""
+    engine = get_engine()
+    inspector = inspect(engine)
+    with engine.connect() as conn:
+        parameters = conn.execute(text(_PARAMETERS_SQL)).fetchall()
+    values = ", ".join(f"'{name}' ({unit})" if unit else f"'{name}'" for name, unit in parameters if name)
+
+    tables = []
+    for table in _TABLES:
+        keys = set(inspector.get_pk_constraint(table).get("constrained_columns") or [])
+        references = {
+            fk["constrained_columns"][0]: f"{fk['referred_table']}({fk['referred_columns'][0]})"
+            for fk in inspector.get_foreign_keys(table) if len(fk["constrained_columns"]) == 1
+        }
+        columns = inspector.get_columns(table)
+        lines = []
+        for i, column in enumerate(columns):
+            line = f"  {column['name']} {column['type']}"
+            if column["name"] in keys:
+                line += " PRIMARY KEY"
+            elif column["name"] in references:
+                line += f" REFERENCES {references[column['name']]}"
+            if i < len(columns) - 1:
+                line += ","
+            if column["name"] == "parameter_name" and values:
+                line += f" -- values: {values}"
+            lines.append(line)
+        body = "\n".join(lines)
+        tables.append(f"TABLE {table} (\n{body}\n);\n")
+    return "\n".join(tables), [name for name, _ in parameters if name]
+
+
+def _digest(prefix: str) -> str:
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:12]
+
+
+class PromptBuilder:
+    """
+    Static prefix per LLM stage: fixed text, or a template rendered with the
+    schema section. Callers send `prefix(stage)` first and the per-request
+    part as the user input.
+    """
+
+    def __init__(self):
+        self._templates = {}   # stage -> fn(schema, parameters) -> prefix
+        self._prefixes = {}    # stage -> rendered prefix
+        self.schema = _FALLBACK_SCHEMA
+        self.parameters = list(_FALLBACK_PARAMETERS)
+        self.reflected = False
+        self._stale = True
+        self._retry_at = 0.0
+        self._lock = None
+        self._stats = {"reflections": 0, "reflection_errors": 0, "prefix_changes": 0}
+
+    def register(self, stage: str, prefix: str = None, template=None):
+        """A fixed `prefix`, or a `template(schema, parameters)` for schema-dependent stages."""
+        if template is not None:
+            self._templates[stage] = template
+            prefix = template(self.schema, self.parameters)
+        self._prefixes[stage] = prefix
+
+    def prefix(self, stage: str) -> str:
+        return self._prefixes[stage]
+
+    def mark_stale(self, previous: str = None, version: str = None):
+        """Data changed: reflect again before the next schema-dependent prompt."""
+        self._stale = True
+        self._retry_at = 0.0
+
+    async def ensure_schema(self):
+        if not self._stale or time.time() < self._retry_at:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._stale:
+                return
+            try:
+                schema, parameters = await asyncio.to_thread(reflect_schema)
+            except Exception as e:
+                self._stats["reflection_errors"] += 1
+                self._retry_at = time.time() + _RETRY_SECONDS
+                logging.error(f"[Prompts ERROR] Schema reflection failed, using the built-in schema: {e}")
+                return
+            self._stats["reflections"] += 1
+            self._stale = False
+            self.reflected = True
+            self.schema, self.parameters = schema, parameters or self.parameters
+            changed = self._render()
+        if changed:
+            await self.cache_prefixes(changed)
+
+    def _render(self) -> list:
+        """Re-render the schema-dependent prefixes; returns the stages whose text changed."""
+        changed = []
+        for stage, template in self._templates.items():
+            prefix = template(self.schema, self.parameters)
+            if prefix != self._prefixes.get(stage):
+                self._prefixes[stage] = prefix
+                changed.append(stage)
+        if changed:
+            self._stats["prefix_changes"] += len(changed)
+            logging.info(f"[Prompts] Schema reflected, prefix changed for: {', '.join(changed)}")
+        return changed
+
+    async def cache_prefixes(self, stages: list = None):
+        """Register the prefixes long enough for an explicit context cache with the provider."""
+        for stage in stages or list(self._prefixes):
+            prefix = self._prefixes[stage]
+            if estimate_tokens(prefix) >= LLM_CONTEXT_CACHE_MIN_TOKENS:
+                await llm_client.cache_prefix(stage, prefix)
+
+    async def warm_up(self):
+        """Startup: reflect the schema, then register context caches."""
+        await self.ensure_schema()
+        await self.cache_prefixes()
+        return {"schema": "reflected" if self.reflected else "built-in", "stages": len(self._prefixes)}
+
+    def get_stats(self) -> dict:
+        return {
+            "schema": "reflected" if self.reflected else "built-in",
+            "parameters": self.parameters,
+            "context_cache_min_tokens": LLM_CONTEXT_CACHE_MIN_TOKENS,
+            "prefixes": {
+                stage: {"chars": len(prefix), "tokens_est": estimate_tokens(prefix), "sha256": _digest(prefix)}
+                for stage, prefix in self._prefixes.items()
+            },
+            **self._stats,
+        }
+
+
+prompts = PromptBuilder()
+cache_service.on_data_change(prompts.mark_stale)
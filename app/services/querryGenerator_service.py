@@ -1,51 +1,12 @@
-from app.utils import config_util
+from app.services.llm_client import llm_client
+from app.services.prompt_service import prompts
 import logging
 
 _MODEL_ = "gemini-flash-latest"
 
-class QueryService:
-    def __init__(self):
-        try:
-            self.model = config_util.get_gemini_model()
-        except Exception as e:
-            logging.error(f"[QueryService INIT ERROR] Failed to get Gemini model: {e}")
-            raise RuntimeError(f"Cannot initialize QueryService: {e}")
-
-    def generate_sql(self, query: str) -> str:
-        """
-        Generates PostgreSQL query using Gemini LLM.
-        Ensures consistent column aliases for normalization.
-        """
-        prompt = f"""
-You are an expert PostgreSQL query generator. 
-The database schema is:
-
-TABLE states (
-  state_id SERIAL PRIMARY KEY,
-  state_name VARCHAR(100)
-);
-
-TABLE cities (
-  city_id SERIAL PRIMARY KEY,
-  city_name VARCHAR(100),
-  state_id INT REFERENCES states(state_id)
-);
-
-TABLE parameters (
-  parameter_id SERIAL PRIMARY KEY,
-  parameter_name VARCHAR(100), -- values: 'Groundwater Level', 'Water Recharged', 'Rainfall', 'Exploitation'
-  unit VARCHAR(50)
-);
-
-TABLE yearly_data (
-  data_id SERIAL PRIMARY KEY,
-  city_id INT REFERENCES cities(city_id),
-  parameter_id INT REFERENCES parameters(parameter_id),
-  year INT,
-  value FLOAT
-);
-
-RULES:
+# Rules shared by the SQL prompt and the fused plan prompt (gemini_service); the schema
+# in front of them is reflected from the DB by prompt_service
+SQL_RULES = """RULES:
 1. Always join all four tables correctly: yearly_data → cities → states → parameters.
 2. Always use fixed column aliases in SELECT:
    - state_name AS state
@@ -56,7 +17,7 @@ RULES:
    - AVG(yd.value) AS value   (for state-level aggregation)
    - yd.value AS value        (for city-level queries)
 3. If the user asks for general "groundwater data" without specifying a parameter, 
-   then return all parameters ("Groundwater Level", "Water Recharged", "Rainfall", "Exploitation").
+   then return all parameters ({parameters}).
 4. If query mentions only a STATE (no specific city), calculate the average of all its cities per year per parameter.
    - GROUP BY state, year, parameter_name, unit
 5. If query mentions a CITY, return that city’s yearly data (no GROUP BY needed, except for year, parameter_name, unit if multiple rows).
@@ -66,21 +27,58 @@ RULES:
 9. If query specifies a year range, return yearly breakdown (GROUP BY year, parameter_name, unit, state[, city]).
 10. If only one year is given then return only that year's data.
 11. Output must be pure SQL string (no markdown, no explanation, no ```sql).
-
-User query: {query}
 """
 
-        try:
-            response = self.model.generate_content(prompt)
-            sql = getattr(response, "text", "").strip()
 
-            # Remove possible markdown or backticks safely
-            if sql.startswith("```"):
-                sql = sql.split("\n", 1)[-1]  # remove first line ```sql or ```
-                sql = sql.rsplit("```", 1)[0].strip()
+def schema_rules(schema: str, parameters: list) -> str:
+    """Schema section + rules; `parameters` are the parameter names in the DB."""
+    names = ", ".join(f'"{name}"' for name in parameters)
+    return f"The database schema is:\n\n{schema}\n" + SQL_RULES.replace("{parameters}", names)
+
 
-            return sql
+_SQL_PROMPT = "You are an expert PostgreSQL query generator. \n{schema_rules}"
+prompts.register("sql", template=lambda schema, parameters: _SQL_PROMPT.format(
+    schema_rules=schema_rules(schema, parameters)))
+
+
+def clean_sql(sql: str) -> str:
+    """Remove possible markdown or backticks safely."""
+    sql = (sql or "").strip()
+    if sql.startswith("```"):
+        sql = sql.split("\n", 1)[-1]  # remove first line ```sql or ```
+        sql = sql.rsplit("```", 1)[0].strip()
+    return sql
+
+
+class QueryService:
+    def __init__(self):
+        # Model client is shared (and bounded) across all requests
+        self.llm = llm_client
+
+    async def generate_sql(self, query: str, entities: str = "") -> str:
+        """
+        Generates PostgreSQL query using Gemini LLM.
+        Ensures consistent column aliases for normalization.
+        `entities` are gazetteer matches ("city 'Ayodhya' (city_id = 3)"); when given,
+        the model filters on those IDs instead of ILIKE on names.
+        """
+        await prompts.ensure_schema()
+        request = f"User query: {query}\n"
+        if entities:
+            request += f"""
+Resolved entities (these override rule 8: filter with yd.city_id / c.state_id / yd.parameter_id
+on these IDs instead of ILIKE on the names; use ILIKE only for names not listed here):
+{entities}
+"""
+
+        try:
+            sql = await self.llm.generate(prompts.prefix("sql"), request, stage="sql", fallback="")
+            return clean_sql(sql)
 
         except Exception as e:
             logging.error(f"[QueryService ERROR] Failed to generate SQL for query '{query}': {e}")
             return ""
+
+
+# Shared instance (one per process, like llm_client)
+query_service = QueryService()
@@ -0,0 +1,129 @@
+# app/services/query_log_service.py
+"""
+Rotating JSONL log of pipeline requests (one compact line each): raw text,
+normalized English, language / style, SQL, stage timings and pipeline events.
+Written from the request trace when the request finishes; mined by the
+precompute job for the most asked questions.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import time
+
+from app.services import tracing_service
+
+# JSONL file; empty disables the log
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", os.path.join(".cache", "query_log.jsonl"))
+QUERY_LOG_MAX_MB = float(os.getenv("QUERY_LOG_MAX_MB", "16"))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+
+# Pipeline events of requests that ended without an answer
+_UNANSWERED = {"sql_blocked", "db_failed", "no_rows"}
+
+_logger = logging.getLogger("query_log")
+_logger.propagate = False
+_stats = {"written": 0}
+
+
+def _record(summary: dict) -> dict:
+    return {
+        "ts": round(time.time(), 1),
+        "text": summary["query"],
+        "normalized": summary.get("normalized"),
+        "lang": summary.get("lang"),
+        "style": summary.get("style"),
+        "type": summary.get("query_type"),
+        "mode": summary.get("mode"),
+        "sql": summary.get("sql"),
+        "status": summary["status"],
+        "ms": summary["duration_ms"],
+        "stages_ms": summary["stages_ms"],
+        "events": summary["events"],
+    }
+
+
+def _write(summary: dict):
+    if "query" not in summary:
+        return  # not a pipeline request (or a batch)
+    _logger.info(json.dumps(_record(summary), ensure_ascii=False, separators=(",", ":"), default=str))
+    _stats["written"] += 1
+
+
+def enable(path: str = QUERY_LOG_PATH):
+    """Attach the rotating file handler and start logging finished pipeline requests."""
+    if not path or _logger.handlers:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    except OSError as e:
+        logging.error(f"[QueryLog ERROR] Cannot create log directory: {e}")
+        return
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=int(QUERY_LOG_MAX_MB * 1024 * 1024), backupCount=QUERY_LOG_BACKUPS,
+        encoding="utf-8", delay=True,
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(handler)
+    _logger.setLevel(logging.INFO)
+    tracing_service.add_listener(_write)
+    logging.info(f"[QueryLog] Logging pipeline requests to {path}")
+
+
+def log_files(path: str = QUERY_LOG_PATH) -> list:
+    """Current file and rotated backups (oldest first)."""
+    files = [f"{path}.{i}" for i in range(QUERY_LOG_BACKUPS, 0, -1)] + [path]
+    return [f for f in files if os.path.exists(f)]
+
+
+def read_records(path: str = QUERY_LOG_PATH, since: float = 0.0):
+    """Yield logged records newer than `since` (epoch seconds); broken lines are skipped."""
+    for name in log_files(path):
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("ts", 0) >= since:
+                    yield record
+
+
+def top_queries(records, top_n: int) -> dict:
+    """
+    Most asked answerable questions per language: {lang: [entry, ...]} where an entry
+    is the normalized query with its style / type, count and the raw texts seen for it.
+    Small talk, failed and SQL-less requests are left out.
+    """
+    groups = {}
+    for record in records:
+        normalized = (record.get("normalized") or "").strip()
+        if not normalized or not record.get("sql") or record.get("status") != 200:
+            continue
+        if _UNANSWERED.intersection(record.get("events") or ()):
+            continue
+        lang = record.get("lang") or "unknown"
+        if lang == "unknown":
+            continue  # normalization fell back to the raw text
+        key = (lang, record.get("style") or "", " ".join(normalized.split()).casefold())
+        entry = groups.get(key)
+        if entry is None:
+            entry = groups[key] = {
+                "normalized": normalized, "lang": lang, "style": record.get("style"),
+                "type": record.get("type"), "count": 0, "texts": {},
+            }
+        entry["count"] += 1
+        text_key = (record.get("mode") or "", record["text"])
+        entry["texts"][text_key] = entry["texts"].get(text_key, 0) + 1
+
+    by_lang = {}
+    for entry in sorted(groups.values(), key=lambda e: -e["count"]):
+        ranked = by_lang.setdefault(entry["lang"], [])
+        if len(ranked) < top_n:
+            entry["texts"] = [list(k) for k, _ in sorted(entry["texts"].items(), key=lambda kv: -kv[1])[:10]]
+            ranked.append(entry)
+    return by_lang
+
+
+def get_stats() -> dict:
+    return {"path": QUERY_LOG_PATH if _logger.handlers else None, **_stats}
@@ -0,0 +1,154 @@
+# app/services/resilience_service.py
+"""
+Request deadlines, latency percentiles and a circuit breaker for the LLM
+stages (used by llm_client) and the DB stage of the pipeline.
+"""
+import collections
+import contextvars
+import logging
+import os
+import time
+
+# End-to-end budget of one pipeline request (seconds); 0 disables the deadline
+PIPELINE_DEADLINE_SECONDS = float(os.getenv("PIPELINE_DEADLINE_SECONDS", "25"))
+# Relative share of the remaining budget each stage gets
+_STAGE_WEIGHTS = {"normalize": 1.0, "plan": 1.5, "sql": 1.0, "db": 0.5, "explain": 2.0, "style": 1.0}
+# Below this many seconds a stage is not started at all
+MIN_STAGE_SECONDS = 0.25
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class Deadline:
+    """
+    Budget of one request, split over its planned stages by weight.
+    Time a stage does not use (cache hit, locally compiled SQL) is left to
+    the stages after it.
+    """
+
+    def __init__(self, seconds: float, stages: list):
+        self.expires = time.perf_counter() + seconds
+        self.stages = list(stages)
+        self._started = set()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.perf_counter())
+
+    def budget(self, stage: str) -> float:
+        """Seconds `stage` may use: its weight's share of what is left for it and the stages not started yet."""
+        if stage in self.stages:
+            # stages before it were skipped (cache hits) and leave their share
+            self._started.update(self.stages[:self.stages.index(stage) + 1])
+        else:
+            self._started.add(stage)
+        later = [s for s in self.stages if s not in self._started]
+        weight = _STAGE_WEIGHTS.get(stage, 1.0)
+        return self.remaining() * weight / (weight + sum(_STAGE_WEIGHTS.get(s, 1.0) for s in later))
+
+
+def start_deadline(stages: list, seconds: float = None):
+    """Set the deadline of the current request (no-op when disabled)."""
+    seconds = PIPELINE_DEADLINE_SECONDS if seconds is None else seconds
+    deadline = Deadline(seconds, stages) if seconds > 0 else None
+    _deadline.set(deadline)
+    return deadline
+
+
+def stage_timeout(stage: str, cap: float) -> float:
+    """
+    Timeout for one stage: its share of the request deadline, at most `cap`.
+    Raises DeadlineExceeded when too little time is left to start it.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return cap
+    budget = min(cap, deadline.budget(stage))
+    if budget < MIN_STAGE_SECONDS:
+        raise DeadlineExceeded(f"Request deadline reached before stage '{stage}'")
+    return budget
+
+
+class LatencyTracker:
+    """Recent successful call latencies per stage, for percentile-based hedging."""
+
+    def __init__(self, size: int = 200):
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=size))
+
+    def observe(self, stage: str, seconds: float):
+        self._samples[stage].append(seconds)
+
+    def percentile(self, stage: str, pct: float, min_samples: int = 1):
+        samples = self._samples.get(stage)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def get_stats(self) -> dict:
+        return {
+            stage: {
+                "samples": len(samples),
+                "p50_ms": round(self.percentile(stage, 50) * 1000, 1),
+                "p95_ms": round(self.percentile(stage, 95) * 1000, 1),
+            }
+            for stage, samples in self._samples.items() if samples
+        }
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; open rejects calls
+    for `cooldown` seconds, then half_open lets one probe call through:
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name: str, failures: int = 5, cooldown: float = 30.0):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.cooldown:
+                self._stats["rejected"] += 1
+                return False
+            self.state = "half_open"
+            logging.info(f"[Breaker] {self.name} half-open, probing")
+        if self.state == "half_open":
+            if self._probing:
+                self._stats["rejected"] += 1
+                return False
+            self._probing = True
+        return True
+
+    def success(self):
+        if self.state != "closed":
+            logging.info(f"[Breaker] {self.name} closed")
+        self.state = "closed"
+        self._consecutive = 0
+        self._probing = False
+
+    def failure(self):
+        self._consecutive += 1
+        self._probing = False
+        if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+            logging.warning(f"[Breaker] {self.name} open for {self.cooldown}s after {self._consecutive} failures")
+
+    def release(self):
+        """A call let through ended without a verdict (cancelled / deadline)."""
+        self._probing = False
+
+    def get_stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._consecutive, **self._stats}
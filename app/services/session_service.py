@@ -0,0 +1,423 @@
+# app/services/session_service.py
+"""
+Conversation sessions (/nlp/sessions). Each session keeps compact state of its
+last turn: resolved slots (the compiled intent: level, states / cities,
+parameters, years), the SQL and the result frame. Follow-ups such as
+"and for Mirzapur?" or "now show rainfall too" patch those slots locally,
+without the LLM, and the previous rows are reused so only what is missing
+has to be fetched.
+"""
+import asyncio
+import collections
+import logging
+import os
+import re
+import time
+import uuid
+
+from app.services.gazetteer_service import fold, gazetteer, tokenize
+from app.services.sql_compiler_service import parse_years
+from app.utils.result_frame import ResultFrame
+
+# Sessions idle longer than this are dropped (seconds)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+# Memory for the result frames kept by all sessions; least recently used frames go first
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "64"))
+# Max live sessions per worker; least recently used sessions go first
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+# Turns listed by GET /nlp/sessions/{id}
+SESSION_HISTORY = int(os.getenv("SESSION_HISTORY", "20"))
+
+# "now show rainfall too" extends the slots, anything else replaces the ones mentioned
+_ADD_PHRASES = ["too", "also", "as well", "add", "include", "including", "plus", "along with", "भी", "साथ में"]
+_REPLACE_PHRASES = ["what about", "how about", "instead", "only", "same for", "just", "सिर्फ", "केवल"]
+# Markers only when the turn starts with them ("and for Mirzapur?", not "rainfall and recharge in ...")
+_LEADING_PHRASES = ["and", "now", "then", "so", "और", "अब", "तो"]
+# Words a patchable follow-up may contain besides names and years; anything else
+# (a new question shape, "highest", "why", ...) goes to the LLM
+_FILLER_WORDS = [
+    "show", "me", "give", "get", "tell", "the", "data", "of", "in", "for", "please", "what", "about",
+    "how", "is", "was", "with", "then", "same", "from", "since", "to", "till", "until", "upto", "between",
+    "before", "after", "year", "years", "value", "values", "it", "that", "those", "them", "a", "vs",
+    "versus", "ok", "okay", "की", "के", "का", "लिए", "में", "से", "तक", "दिखाओ", "दिखाइए", "बताओ",
+    "बताइए", "साल", "वर्ष", "ka", "ki", "ke", "liye", "mein", "se", "tak", "batao", "dikhao", "saal",
+]
+
+
+def _tokens(phrases: list) -> set:
+    return {" ".join(tokenize(p)) for p in phrases}
+
+
+_ADD = _tokens(_ADD_PHRASES)
+_MARKERS = _ADD | _tokens(_REPLACE_PHRASES)
+_LEADING = _tokens(_LEADING_PHRASES)
+_FILLERS = {t for p in _FILLER_WORDS + _ADD_PHRASES + _REPLACE_PHRASES + _LEADING_PHRASES for t in tokenize(p)}
+_YEAR_TOKEN = re.compile(r"^(1[89]\d{2}|20\d{2})$")
+
+
+def _has(padded: str, phrases: set) -> bool:
+    return any(f" {phrase} " in padded for phrase in phrases)
+
+
+def _is_followup(padded: str) -> bool:
+    return _has(padded, _MARKERS) or any(padded.startswith(f" {phrase} ") for phrase in _LEADING)
+
+
+def _names(intent: dict) -> dict:
+    """Intent with the display names recomputed from its IDs."""
+    return {
+        **intent,
+        "states": [gazetteer.states[s] for s in intent["state_ids"] if s in gazetteer.states],
+        "cities": [gazetteer.cities[c][0] for c in intent["city_ids"] if c in gazetteer.cities],
+        "parameters": [gazetteer.parameters[p][0] for p in intent["parameter_ids"] if p in gazetteer.parameters],
+    }
+
+
+def _merge_ids(old: list, new: list) -> list:
+    return old + [i for i in new if i not in old]
+
+
+def looks_followup(text: str) -> bool:
+    """Starts from the previous turn: a follow-up marker, or no location of its own."""
+    tokens = tokenize(text)
+    if not tokens:
+        return False
+    if _is_followup(f" {' '.join(tokens)} "):
+        return True
+    return not any(m["kind"] in ("state", "city") for m in gazetteer.mentions(text))
+
+
+def patch_intent(previous: dict, text: str):
+    """
+    Apply a follow-up to the previous turn's slots without the LLM.
+    Returns (intent, "add" | "replace") or (None, reason) when the text is not a
+    plain slot change (then the turn is normalized by the LLM with the previous
+    question as context).
+    """
+    tokens = tokenize(text)
+    if not tokens or not gazetteer.loaded:
+        return None, "empty"
+    padded = f" {' '.join(tokens)} "
+    mentions = gazetteer.mentions(text)
+    if any(m["ambiguous"] for m in mentions):
+        return None, "ambiguous_location"
+    rest = padded
+    for mention in mentions:
+        rest = rest.replace(f" {mention['text']} ", " ", 1)
+    if any(t not in _FILLERS and not _YEAR_TOKEN.match(t) for t in rest.split()):
+        return None, "not_a_followup"
+
+    years, reason = parse_years(" ".join(fold(text).split()))
+    if years is None:
+        return None, reason
+    has_years = bool(years["years"]) or years["year_from"] is not None or years["year_to"] is not None
+    found = {"state": [], "city": [], "parameter": []}
+    for mention in mentions:
+        if mention["id"] not in found[mention["kind"]]:
+            found[mention["kind"]].append(mention["id"])
+    states, cities, parameters = found["state"], found["city"], found["parameter"]
+    if not (states or cities or parameters or has_years):
+        return None, "no_slots"
+    if (states or cities) and not _is_followup(padded):
+        return None, "new_question"  # a full question of its own, e.g. "rainfall in Mirzapur"
+
+    add = _has(padded, _ADD)
+    intent = dict(previous)
+    if states or cities:
+        if cities:
+            city_states = {gazetteer.cities[c][1] for c in cities}
+            if any(s not in city_states for s in states):
+                return None, "mixed_city_state"
+        level = "city" if cities else "state"
+        if add and level == previous["level"]:
+            intent["state_ids"] = _merge_ids(previous["state_ids"], states)
+            intent["city_ids"] = _merge_ids(previous["city_ids"], cities)
+        else:
+            intent["state_ids"], intent["city_ids"] = list(states), list(cities)
+        intent["level"] = level
+    if parameters:
+        if add:
+            # no parameter filter means every parameter already
+            merged = _merge_ids(previous["parameter_ids"], parameters) if previous["parameter_ids"] else []
+            intent["parameter_ids"] = sorted(merged)
+        else:
+            intent["parameter_ids"] = sorted(parameters)
+    if has_years:
+        intent.update(years)
+    return _names(intent), "add" if add else "replace"
+
+
+def _join(names: list) -> str:
+    return names[0] if len(names) == 1 else ", ".join(names[:-1]) + " and " + names[-1]
+
+
+def describe(intent: dict) -> str:
+    """Standalone English question for patched slots (explanation prompt and answer cache key)."""
+    what = _join(intent["parameters"]) if intent["parameters"] else "all groundwater parameters"
+    if intent["level"] == "city":
+        where = _join(intent["cities"])
+    else:
+        what = f"state average {what}"
+        where = _join(intent["states"])
+    question = f"Show {what} in {where}"
+    if intent["years"]:
+        question += f" in {_join([str(y) for y in intent['years']])}"
+    elif intent["year_from"] is not None and intent["year_to"] is not None:
+        question += f" from {intent['year_from']} to {intent['year_to']}"
+    elif intent["year_from"] is not None:
+        question += f" since {intent['year_from']}"
+    elif intent["year_to"] is not None:
+        question += f" until {intent['year_to']}"
+    return question
+
+
+def with_context(previous_question: str, text: str) -> str:
+    """Follow-up the slots cannot express, sent to normalization with the previous question."""
+    return f"{text} (follow-up to the previous question: {previous_question})"
+
+
+# ----- result reuse -----
+def _year_ok(intent: dict, year: int) -> bool:
+    if intent["years"] and year not in intent["years"]:
+        return False
+    if intent["year_from"] is not None and year < intent["year_from"]:
+        return False
+    return intent["year_to"] is None or year <= intent["year_to"]
+
+
+def _listed_years(intent: dict):
+    """The years `intent` asks for when they are countable (a list or a closed range), else None."""
+    if intent["years"]:
+        return intent["years"]
+    if intent["year_from"] is not None and intent["year_to"] is not None:
+        return range(intent["year_from"], intent["year_to"] + 1)
+    return None
+
+
+def _covers_years(old: dict, new: dict) -> bool:
+    wanted = _listed_years(new)
+    if wanted is not None:
+        return all(_year_ok(old, y) for y in wanted)
+    if old["years"]:
+        return False
+    return (
+        (old["year_from"] is None or (new["year_from"] is not None and new["year_from"] >= old["year_from"]))
+        and (old["year_to"] is None or (new["year_to"] is not None and new["year_to"] <= old["year_to"]))
+    )
+
+
+def plan_fetch(old: dict, new: dict):
+    """
+    How to get the rows of `new` given the result of `old`:
+    ("reuse", None)       every row is in the previous result
+    ("delta", intent)     previous rows + the rows of `intent` (one slot grew)
+    ("full", None)        run the whole query
+    """
+    if old is None or old["level"] != new["level"]:
+        return "full", None
+    field = "city_ids" if new["level"] == "city" else "state_ids"
+    if not set(new[field]) & set(old[field]):
+        return "full", None  # nothing to reuse
+    new_locations = [i for i in new[field] if i not in old[field]]
+    params_covered = not old["parameter_ids"] or (
+        bool(new["parameter_ids"]) and set(new["parameter_ids"]) <= set(old["parameter_ids"])
+    )
+    years_covered = _covers_years(old, new)
+
+    if not new_locations and params_covered and years_covered:
+        return "reuse", None
+    if new_locations and params_covered and years_covered:
+        return "delta", _names({**new, field: new_locations})
+    if not new_locations and years_covered and new["parameter_ids"]:
+        missing = sorted(set(new["parameter_ids"]) - set(old["parameter_ids"]))
+        return "delta", _names({**new, "parameter_ids": missing})
+    if not new_locations and params_covered:
+        wanted = _listed_years(new)
+        if wanted is None:
+            return "full", None  # open-ended range: the missing years are unknown
+        missing = [y for y in wanted if not _year_ok(old, y)]
+        if not missing:
+            return "reuse", None  # never fetch with an empty year list: that means every year
+        return "delta", {**new, "years": missing, "year_from": None, "year_to": None}
+    return "full", None
+
+
+def select_rows(frame: ResultFrame, intent: dict) -> ResultFrame:
+    """Rows of a previous result that belong to `intent`."""
+    if intent["level"] == "city":
+        wanted = {(gazetteer.states.get(gazetteer.cities[c][1]), gazetteer.cities[c][0])
+                  for c in intent["city_ids"] if c in gazetteer.cities}
+        locations = list(zip(frame.column("state"), frame.column("city")))
+    else:
+        wanted = set(intent["states"])
+        locations = frame.column("state")
+    parameters = set(intent["parameters"])
+    names = frame.column("parameter_name")
+    years = frame.column("year")
+    keep = [
+        i for i in range(len(frame))
+        if locations[i] in wanted
+        and (not parameters or names[i] in parameters)
+        and _year_ok(intent, int(years[i]))
+    ]
+    return frame.take(keep)
+
+
+def merge(reused: ResultFrame, delta: ResultFrame, level: str) -> ResultFrame:
+    """Previous rows + fetched rows, in the order of the SQL templates."""
+    if not len(delta):
+        return reused
+    order = ["city"] if level == "city" else ["state"]
+    return ResultFrame.concat([reused, delta]).sort_by(order + ["parameter_name", "year"])
+
+
+def slots(intent: dict):
+    if intent is None:
+        return None
+    return {key: intent[key] for key in ("level", "states", "cities", "parameters", "year_from", "year_to", "years")}
+
+
+# ----- store -----
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.created = time.time()
+        self.last_used = self.created
+        self.lock = asyncio.Lock()   # turns of one conversation run in order
+        self.turns = 0
+        self.history = collections.deque(maxlen=SESSION_HISTORY)
+        self.question = None          # last normalized English question
+        self.normalized_result = None # language / style of the conversation
+        self.intent = None            # slots of the last turn (compiled queries only)
+        self.sql = None
+        self.params = None
+        self.frame = None
+        self.data_version = None
+        self.frame_bytes = 0
+
+    def describe(self) -> dict:
+        return {
+            "session_id": self.id,
+            "turns": self.turns,
+            "created_at": round(self.created),
+            "idle_seconds": round(time.time() - self.last_used, 1),
+            "question": self.question,
+            "slots": slots(self.intent),
+            "sql": self.sql,
+            "result_rows": len(self.frame) if self.frame is not None else None,
+            "history": list(self.history),
+        }
+
+
+class SessionStore:
+    """
+    In-memory sessions of this worker, least recently used first.
+    Idle sessions expire after SESSION_TTL_SECONDS; above SESSION_MAX_MB the
+    oldest result frames are dropped (their slots stay, so follow-ups still
+    skip the LLM but fetch in full).
+    """
+
+    def __init__(self):
+        self._sessions = collections.OrderedDict()
+        self._bytes = 0
+        self._stats = {
+            "created": 0, "expired": 0, "evicted": 0, "deleted": 0, "frames_dropped": 0, "turns": 0,
+            "followup_local": 0, "followup_context": 0, "fetch_reuse": 0, "fetch_delta": 0, "fetch_full": 0,
+        }
+
+    def _drop(self, session_id: str, reason: str):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.frame_bytes
+        self._stats[reason] += 1
+
+    def _expire(self):
+        cutoff = time.time() - SESSION_TTL_SECONDS
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= cutoff:
+                break
+            self._drop(session.id, "expired")
+
+    def create(self) -> Session:
+        self._expire()
+        while len(self._sessions) >= SESSION_MAX_COUNT:
+            self._drop(next(iter(self._sessions)), "evicted")
+        session = Session(uuid.uuid4().hex)
+        self._sessions[session.id] = session
+        self._stats["created"] += 1
+        return session
+
+    def get(self, session_id: str):
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        if session_id not in self._sessions:
+            return False
+        self._drop(session_id, "deleted")
+        return True
+
+    def record_turn(self, session: Session, text: str, followup: str = None, fetch: str = None,
+                    question: str = None, normalized_result: dict = None, intent: dict = None,
+                    sql: str = None, params: dict = None, frame: ResultFrame = None, data_version: str = None):
+        """
+        Store the outcome of a turn. Turns without SQL (small talk, failures) only
+        go to the history; a turn with SQL replaces the slots, SQL and frame.
+        """
+        session.turns += 1
+        self._stats["turns"] += 1
+        if followup:
+            self._stats[f"followup_{followup}"] += 1
+        if fetch:
+            self._stats[f"fetch_{fetch}"] += 1
+        session.history.append({
+            "turn": session.turns,
+            "text": text,
+            "question": question,
+            "followup": followup,
+            "fetch": fetch,
+            "slots": slots(intent),
+            "rows": len(frame) if frame is not None else None,
+        })
+        if sql is None or session.id not in self._sessions:
+            return
+        session.question = question
+        session.normalized_result = normalized_result
+        session.intent, session.sql, session.params = intent, sql, params
+        self._bytes -= session.frame_bytes
+        session.frame, session.data_version = frame, data_version
+        session.frame_bytes = frame.approx_bytes() if frame is not None else 0
+        self._bytes += session.frame_bytes
+        self._shrink(session)
+
+    def _shrink(self, current: Session):
+        limit = SESSION_MAX_MB * 1024 * 1024
+        for session in self._sessions.values():
+            if self._bytes <= limit:
+                return
+            if session is current or session.frame is None:
+                continue
+            self._bytes -= session.frame_bytes
+            session.frame, session.frame_bytes = None, 0
+            self._stats["frames_dropped"] += 1
+        if self._bytes > limit:
+            logging.warning(f"[Session] One result ({current.frame_bytes} bytes) exceeds SESSION_MAX_MB, not kept")
+            self._bytes -= current.frame_bytes
+            current.frame, current.frame_bytes = None, 0
+            self._stats["frames_dropped"] += 1
+
+    def get_stats(self) -> dict:
+        self._expire()
+        return {
+            "active": len(self._sessions),
+            "memory_mb": round(self._bytes / 2**20, 2),
+            "ttl_seconds": SESSION_TTL_SECONDS,
+            **self._stats,
+        }
+
+
+sessions = SessionStore()
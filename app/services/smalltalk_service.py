@@ -0,0 +1,140 @@
+# app/services/smalltalk_service.py
+import re
+
+# Romanized Hindi words that mark a Latin-script message as Hinglish
+_HINGLISH_MARKERS = {
+    "kya", "hai", "hain", "ho", "kaise", "kaisa", "kaisi", "aap", "tum", "mujhe", "mera", "meri",
+    "batao", "bataiye", "bata", "karo", "kar", "sakte", "sakta", "sakti", "kaun", "namaste", "namaskar",
+    "dhanyavad", "dhanyawad", "shukriya", "madad", "bhai", "ji", "haan", "nahi", "accha", "acha",
+    "theek", "thik", "alvida", "phir", "milenge", "kal", "ka", "ki", "ke", "se", "mein", "ko",
+}
+
+# Every word of a small-talk message must come from here (so data questions never match)
+_GREETING = {
+    "hi", "hii", "hiii", "hello", "helo", "hey", "heya", "hola", "namaste", "namaskar", "namaskaar",
+    "pranam", "salaam", "good", "morning", "afternoon", "evening", "gm", "yo", "haal", "hal", "sup",
+    "नमस्ते", "नमस्कार", "प्रणाम", "हेलो", "हैलो", "हाय", "सुप्रभात",
+}
+_THANKS = {
+    "thanks", "thank", "thx", "ty", "dhanyavad", "dhanyawad", "shukriya", "great", "nice", "awesome",
+    "धन्यवाद", "शुक्रिया",
+}
+_BYE = {"bye", "goodbye", "alvida", "tata", "cya", "see", "later", "फिर", "मिलेंगे", "अलविदा"}
+_CAPABILITY = {
+    "help", "madad", "what", "can", "could", "you", "u", "do", "who", "are", "your", "features",
+    "how", "use", "kya", "kar", "sakte", "sakta", "sakti", "kaun", "kaise", "karte", "meri", "mera",
+    "मदद", "क्या", "कर", "सकते", "सकता", "सकती", "आप", "तुम", "कौन", "कैसे", "मेरी",
+}
+_FILLER = {
+    "there", "bot", "buddy", "friend", "dear", "sir", "madam", "ji", "bhai", "please", "pls", "plz",
+    "me", "i", "a", "an", "the", "to", "for", "with", "this", "it", "is", "so", "much", "very", "and",
+    "again", "ok", "okay", "hai", "hain", "ho", "aap", "tum", "mujhe", "ki", "ka", "ke", "se", "karo",
+    "batao", "bataiye", "bata", "phir", "milenge", "all", "अब", "है", "हैं", "हो", "जी", "भाई",
+    "मुझे", "की", "का", "के", "से", "बताइए", "बताओ", "करो",
+}
+_VOCAB = _GREETING | _THANKS | _BYE | _CAPABILITY | _FILLER
+
+# Words / word pairs that decide between the intents
+_CAPABILITY_WORDS = {"help", "madad", "मदद", "features", "sakte", "sakta", "sakti", "सकते", "सकता", "सकती", "who", "kaun", "कौन"}
+_CAPABILITY_PAIRS = [{"what", "can"}, {"how", "use"}, {"kya", "kar"}, {"क्या", "कर"}]
+_GREETING_PAIRS = [{"how", "are"}, {"kaise", "ho"}, {"कैसे", "हो"}]
+
+_TOKEN = re.compile(r"[a-z]+|[ऀ-ॿ]+")
+_DEVANAGARI = re.compile(r"[ऀ-ॿ]")
+
+_RESPONSES = {
+    "greeting": {
+        "english": "Hello! I am the INGRES groundwater assistant. Ask me about groundwater level, rainfall, recharge or exploitation for any state or city.",
+        "hindi": "नमस्ते! मैं INGRES भूजल सहायक हूँ। आप किसी भी राज्य या शहर के भूजल स्तर, वर्षा, पुनर्भरण या दोहन के बारे में पूछ सकते हैं।",
+        "hinglish": "Namaste! Main INGRES groundwater assistant hoon. Aap kisi bhi state ya city ka groundwater level, rainfall, recharge ya exploitation pooch sakte hain.",
+    },
+    "capability": {
+        "english": "I can answer questions about groundwater level, rainfall, water recharged and exploitation: yearly values for a city, state averages, comparisons between states or cities, and trends over a range of years. For example: \"rainfall in Ayodhya from 2010 to 2020\".",
+        "hindi": "मैं भूजल स्तर, वर्षा, जल पुनर्भरण और दोहन से जुड़े सवालों के जवाब दे सकता हूँ: किसी शहर के वार्षिक आँकड़े, राज्य का औसत, राज्यों या शहरों की तुलना और वर्षों के दौरान रुझान। उदाहरण: \"2010 से 2020 तक अयोध्या में वर्षा\"।",
+        "hinglish": "Main groundwater level, rainfall, water recharge aur exploitation ke sawalon ka jawab de sakta hoon: city ka yearly data, state ka average, states ya cities ka comparison aur saalon ka trend. Jaise: \"Ayodhya mein 2010 se 2020 tak rainfall\".",
+    },
+    "thanks": {
+        "english": "You're welcome! Ask me anything else about groundwater or rainfall data.",
+        "hindi": "आपका स्वागत है! भूजल या वर्षा के बारे में कुछ और पूछना हो तो पूछिए।",
+        "hinglish": "Aapka swagat hai! Groundwater ya rainfall ke baare mein kuch aur poochna ho to poochiye.",
+    },
+    "bye": {
+        "english": "Goodbye! Come back any time for groundwater insights.",
+        "hindi": "अलविदा! भूजल जानकारी के लिए कभी भी वापस आइए।",
+        "hinglish": "Alvida! Groundwater ki jaankari ke liye kabhi bhi wapas aaiye.",
+    },
+}
+
+_LANG_CODES = {"english": "en", "hindi": "hi", "hinglish": "hi"}
+
+
+def detect_language(text: str):
+    """
+    Lexicon / script based detection: returns (style, language_code)
+    with style one of english, hindi, hinglish.
+    """
+    if _DEVANAGARI.search(text):
+        return "hindi", "hi"
+    tokens = _TOKEN.findall(text.lower())
+    if tokens and sum(t in _HINGLISH_MARKERS for t in tokens) / len(tokens) >= 0.2:
+        return "hinglish", "hi"
+    return "english", "en"
+
+
+def classify(text: str):
+    """
+    Return the small-talk intent (greeting, capability, thanks, bye) of a
+    message, or None if it may be a data question.
+    """
+    tokens = _TOKEN.findall(text.lower())
+    if not tokens or len(tokens) > 12 or any(t not in _VOCAB for t in tokens):
+        return None
+    words = set(tokens)
+    if words & _CAPABILITY_WORDS or any(pair <= words for pair in _CAPABILITY_PAIRS):
+        return "capability"
+    if words & _THANKS:
+        return "thanks"
+    if words & _BYE:
+        return "bye"
+    if words & _GREETING or any(pair <= words for pair in _GREETING_PAIRS):
+        return "greeting"
+    return None
+
+
+def canned_response(intent: str, style: str) -> str:
+    responses = _RESPONSES.get(intent, _RESPONSES["capability"])
+    return responses.get(style, responses["english"])
+
+
+def answer(text: str):
+    """
+    Local zero-LLM answer for small talk: dict with intent, style, language code
+    and the localized reply, or None when the message needs the pipeline.
+    """
+    intent = classify(text)
+    if intent is None:
+        return None
+    style, lang_code = detect_language(text)
+    return {
+        "intent": intent,
+        "style": style,
+        "original_language_code": lang_code,
+        "final_answer": canned_response(intent, style),
+    }
+
+
+def is_personal(normalized_result: dict) -> bool:
+    """LLM fallback signal: normalization classified the query as personal."""
+    return str(normalized_result.get("type", "")).strip().lower().startswith("personal")
+
+
+def personal_answer(normalized_result: dict) -> dict:
+    """Canned reply for a query the LLM classified as personal."""
+    style = str(normalized_result.get("style", "english")).strip().lower()
+    style = style if style in _LANG_CODES else "english"
+    return {
+        "intent": "capability",
+        "style": style,
+        "original_language_code": normalized_result.get("original_language_code", _LANG_CODES[style]),
+        "final_answer": canned_response("capability", style),
+    }
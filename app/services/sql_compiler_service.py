@@ -0,0 +1,208 @@
+# app/services/sql_compiler_service.py
+import re
+
+from app.services.gazetteer_service import gazetteer
+from app.services.aggregate_service import aggregate_cube, MATVIEW_NAME
+
+# Anything asking for more than "series / average per year / comparison" goes to the LLM
+_UNSUPPORTED = re.compile(
+    r"\b(highest|lowest|maximum|minimum|max|min|top|bottom|rank\w*|most|least|total|sum|count|"
+    r"number of|difference|change|growth|increase\w*|decrease\w*|decline\w*|percent\w*|ratio|"
+    r"which|why|last|past|recent|next|predict\w*|forecast\w*|except|excluding|other than|not|"
+    r"all states|all cities|india|national|district\w*|per capita|median|variance)\b"
+)
+_AVERAGE = re.compile(r"\b(average|avg|mean)\b")
+_YEAR = re.compile(r"\b(1[89]\d{2}|20\d{2})\b")
+_RANGE = re.compile(r"\b(1[89]\d{2}|20\d{2})\s*(?:-|–|to|through|till|until|up to|upto)\s*(1[89]\d{2}|20\d{2})\b")
+# Fiscal years ("2015-16") span two calendar years: left to the LLM
+_FISCAL_YEAR = re.compile(r"\b(?:1[89]\d{2}|20\d{2})\s*[-–/]\s*\d{2}\b")
+_BETWEEN = re.compile(r"\bbetween\s+(1[89]\d{2}|20\d{2})\s+and\s+(1[89]\d{2}|20\d{2})\b")
+# since / from / until / till / up to include the year, after / before do not
+_SINCE = re.compile(r"\b(since|from|after)\s+(1[89]\d{2}|20\d{2})\b")
+_UNTIL = re.compile(r"\b(before|until|till|up to|upto)\s+(1[89]\d{2}|20\d{2})\b")
+
+_SELECT_JOIN = """
+FROM yearly_data yd
+JOIN cities c ON yd.city_id = c.city_id
+JOIN states s ON c.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id"""
+
+_CITY_TEMPLATE = """SELECT s.state_name AS state, c.city_name AS city, p.parameter_name AS parameter_name,
+       p.unit AS unit, yd.year AS year, yd.value AS value""" + _SELECT_JOIN + """
+WHERE yd.city_id = ANY(:city_ids){filters}
+ORDER BY c.city_name, p.parameter_name, yd.year"""
+
+_STATE_TEMPLATE = """SELECT s.state_name AS state, p.parameter_name AS parameter_name,
+       p.unit AS unit, yd.year AS year, AVG(yd.value) AS value""" + _SELECT_JOIN + """
+WHERE c.state_id = ANY(:state_ids){filters}
+GROUP BY s.state_name, p.parameter_name, p.unit, yd.year
+ORDER BY s.state_name, p.parameter_name, yd.year"""
+
+# Same result read from the precomputed state rollups (AGGREGATE_MATVIEW=true)
+_STATE_VIEW_TEMPLATE = """SELECT s.state_name AS state, p.parameter_name AS parameter_name,
+       p.unit AS unit, yd.year AS year, yd.value AS value
+FROM """ + MATVIEW_NAME + """ yd
+JOIN states s ON yd.state_id = s.state_id
+JOIN parameters p ON yd.parameter_id = p.parameter_id
+WHERE yd.state_id = ANY(:state_ids){filters}
+ORDER BY s.state_name, p.parameter_name, yd.year"""
+
+
+def parse_years(q: str):
+    """
+    Year slots of a lower-cased query: ({"year_from", "year_to", "years"}, None),
+    or (None, reason) when the years are too complex for the templates.
+
+    >>> for q in ("after 2010 and before 2015", "from 2010 up to 2015", "in 2010 and 2012"):
+    ...     print(parse_years(q)[0])
+    {'year_from': 2011, 'year_to': 2014, 'years': []}
+    {'year_from': 2010, 'year_to': 2015, 'years': []}
+    {'year_from': None, 'year_to': None, 'years': [2010, 2012]}
+    >>> [parse_years(q)[1] for q in ("after 2014 and before 2015", "in 2015-16", "since 2010, 2012 and 2014")]
+    ['complex_years', 'fiscal_year', 'complex_years']
+    """
+    slots = {"year_from": None, "year_to": None, "years": []}
+    if _FISCAL_YEAR.search(q):
+        return None, "fiscal_year"
+    years = [int(y) for y in _YEAR.findall(q)]
+    range_match = _BETWEEN.search(q) or _RANGE.search(q)
+    since, until = _SINCE.search(q), _UNTIL.search(q)
+    if range_match:
+        a, b = int(range_match.group(1)), int(range_match.group(2))
+        slots["year_from"], slots["year_to"] = min(a, b), max(a, b)
+        if len(years) > 2:
+            return None, "complex_years"
+    elif since or until:
+        # one bound per year mentioned: "after 2010 and before 2015", "since 2005"
+        if len(years) != bool(since) + bool(until):
+            return None, "complex_years"
+        if since:
+            slots["year_from"] = int(since.group(2)) + (1 if since.group(1) == "after" else 0)
+        if until:
+            slots["year_to"] = int(until.group(2)) - (1 if until.group(1) == "before" else 0)
+        if since and until and slots["year_from"] > slots["year_to"]:
+            return None, "complex_years"
+    else:
+        slots["years"] = sorted(set(years))
+    return slots, None
+
+
+class SQLCompiler:
+    """
+    Deterministic compiler for the query shapes listed in QueryService's prompt:
+    city series, state average per year/parameter, multi-state / multi-city
+    comparisons, single year and year ranges.
+    Returns bound-parameter SQL, or None when the query needs the LLM.
+    """
+
+    def __init__(self):
+        self._stats = {"compiled": 0, "fallback": 0, "fallback_reasons": {}}
+
+    async def ensure_loaded(self):
+        await gazetteer.ensure_loaded()
+
+    # ----- intent extraction -----
+    def extract_intent(self, query: str):
+        """
+        Extract slots from a normalized English query; locations and parameters
+        are resolved to IDs by the gazetteer.
+        Returns (intent, None) or (None, reason) when the query is out of scope.
+        """
+        q = " ".join(query.lower().split())
+        if _UNSUPPORTED.search(q):
+            return None, "unsupported_keyword"
+        if not gazetteer.loaded:
+            return None, "dimensions_not_loaded"
+
+        resolved = gazetteer.resolve(query)  # as typed: "UP" is a state, "up to" is not
+        if resolved["ambiguous"]:
+            return None, "ambiguous_location"
+        state_ids, city_ids = resolved["states"], resolved["cities"]
+        if not state_ids and not city_ids:
+            return None, "no_location"
+
+        if city_ids:
+            city_states = {gazetteer.cities[c][1] for c in city_ids}
+            # "Ayodhya in Uttar Pradesh" is fine, "Ayodhya vs Bihar" mixes shapes
+            if any(s not in city_states for s in state_ids):
+                return None, "mixed_city_state"
+            if _AVERAGE.search(q):
+                return None, "city_average"
+
+        # Rule 3: no specific parameter ("groundwater data") means every parameter
+        parameter_ids = sorted(resolved["parameters"])
+        intent = {
+            "level": "city" if city_ids else "state",
+            "states": [gazetteer.states[s] for s in state_ids],
+            "cities": [gazetteer.cities[c][0] for c in city_ids],
+            "parameters": [gazetteer.parameters[p][0] for p in parameter_ids],
+            "state_ids": state_ids,
+            "city_ids": city_ids,
+            "parameter_ids": parameter_ids,
+            "year_from": None,
+            "year_to": None,
+            "years": [],
+        }
+
+        years, reason = parse_years(q)
+        if years is None:
+            return None, reason
+        intent.update(years)
+        return intent, None
+
+    # ----- SQL rendering -----
+    def render(self, intent: dict) -> dict:
+        """Turn an intent into {"sql", "params"} using the fixed templates."""
+        filters = []
+        params = {}
+        if intent["level"] == "city":
+            params["city_ids"] = list(intent["city_ids"])
+            template = _CITY_TEMPLATE
+        else:
+            params["state_ids"] = list(intent["state_ids"])
+            template = _STATE_VIEW_TEMPLATE if aggregate_cube.view_ready else _STATE_TEMPLATE
+        if intent["parameter_ids"]:
+            filters.append("yd.parameter_id = ANY(:parameter_ids)")
+            params["parameter_ids"] = list(intent["parameter_ids"])
+        if len(intent["years"]) == 1:
+            filters.append("yd.year = :year")
+            params["year"] = intent["years"][0]
+        elif intent["years"]:
+            filters.append("yd.year = ANY(:years)")
+            params["years"] = list(intent["years"])
+        if intent["year_from"] is not None:
+            filters.append("yd.year >= :year_from")
+            params["year_from"] = intent["year_from"]
+        if intent["year_to"] is not None:
+            filters.append("yd.year <= :year_to")
+            params["year_to"] = intent["year_to"]
+
+        sql = template.format(filters="".join(f"\n  AND {f}" for f in filters))
+        return {"sql": sql, "params": params}
+
+    def compile(self, query: str):
+        """
+        Compile a normalized query to {"sql", "params", "intent"}; None means LLM fallback.
+        """
+        intent, reason = self.extract_intent(query)
+        if intent is None:
+            self._stats["fallback"] += 1
+            reasons = self._stats["fallback_reasons"]
+            reasons[reason] = reasons.get(reason, 0) + 1
+            return None
+        self._stats["compiled"] += 1
+        compiled = self.render(intent)
+        compiled["intent"] = intent
+        return compiled
+
+    def get_report(self) -> dict:
+        total = self._stats["compiled"] + self._stats["fallback"]
+        return {
+            "compiled": self._stats["compiled"],
+            "llm_fallback": self._stats["fallback"],
+            "llm_avoided_share": round(self._stats["compiled"] / total, 3) if total else 0.0,
+            "fallback_reasons": dict(self._stats["fallback_reasons"]),
+        }
+
+
+sql_compiler = SQLCompiler()
@@ -0,0 +1,289 @@
+# app/services/sql_guard_service.py
+import json
+import logging
+import os
+import re
+from collections import deque
+
+from app.db.utils import run_sql_query_async
+from app.services import cache_service
+
+SQL_ROW_CAP = int(os.getenv("SQL_ROW_CAP", "5000"))
+SQL_MAX_COST = float(os.getenv("SQL_MAX_COST", "250000"))
+
+ALLOWED_TABLES = {"states", "cities", "parameters", "yearly_data"}
+
+_FORBIDDEN_KEYWORDS = {
+    "insert", "update", "delete", "merge", "drop", "alter", "create", "truncate", "grant", "revoke",
+    "copy", "into", "lock", "vacuum", "analyze", "call", "do", "execute", "prepare", "deallocate",
+    "set", "reset", "listen", "notify", "comment", "refresh", "cluster", "reindex", "import",
+}
+_FORBIDDEN_FUNCTIONS = re.compile(
+    r"^(pg_\w+|lo_\w+|dblink\w*|set_config|current_setting|query_to_xml\w*|txid_\w+|"
+    r"version|inet_\w+|file_\w+)$"
+)
+_DRIVER_MESSAGE = re.compile(r"^.*<class '[^']+'>:\s*")
+_TRAILING_SEMICOLONS = re.compile(r"(;\s*(--[^\n]*)?\s*)+$")
+# Errors that come from the statement itself (cacheable), not from the connection
+_SQL_ERRORS = re.compile(r"syntax error|does not exist|ambiguous|invalid input|must appear in the GROUP BY|operator does not", re.I)
+
+_TOKEN = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<dollar>\$\w*\$)
+  | (?P<quoted>"(?:[^"]|"")+")
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<param>:[A-Za-z_]\w*)
+  | (?P<op>::|<>|!=|<=|>=|\|\||[(),;.*=<>+\-/%\[\]~!@#^&|?])
+    """,
+    re.S | re.X,
+)
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def tokenize(sql: str):
+    """
+    [(kind, value, depth)] for `sql`; comments / whitespace dropped, depth is
+    the parenthesis nesting level. Raises Rejected on unknown characters.
+    """
+    tokens = []
+    depth = 0
+    pos = 0
+    while pos < len(sql):
+        match = _TOKEN.match(sql, pos)
+        if match is None:
+            raise Rejected(f"unexpected_character:{sql[pos]!r}")
+        kind, value = match.lastgroup, match.group()
+        pos = match.end()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "dollar":
+            raise Rejected("dollar_quoting")
+        if value == ")":
+            depth -= 1
+            if depth < 0:
+                raise Rejected("unbalanced_parentheses")
+        tokens.append((kind, value.lower() if kind == "word" else value, depth))
+        if value == "(":
+            depth += 1
+    if depth:
+        raise Rejected("unbalanced_parentheses")
+    return tokens
+
+
+def _identifier(token) -> str:
+    kind, value, _ = token
+    return value[1:-1].replace('""', '"').lower() if kind == "quoted" else value
+
+
+_CLAUSE_WORDS = {
+    "where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using", "group", "order",
+    "having", "limit", "offset", "union", "intersect", "except", "window", "fetch", "for",
+}
+# "(" after these opens a subquery / list, after any other word a function call
+_NOT_FUNCTIONS = {"in", "exists", "from", "join", "as", "any", "all", "some", "lateral", "on", "and", "or", "not", "select", "where"}
+# "(" followed by these opens a subquery, whatever word comes before it (ARRAY(SELECT ...))
+_SUBQUERY_STARTS = {"select", "with", "values", "table"}
+
+
+def _relation_positions(tokens):
+    """
+    Indexes of FROM / JOIN / TABLE keywords that introduce relations (not EXTRACT(... FROM x) etc.).
+    "TABLE x" is short for SELECT * FROM x (UNION TABLE x, (TABLE x)).
+    """
+    positions = []
+    openers = []   # per open parenthesis: is it a function call?
+    for i, (kind, value, _) in enumerate(tokens):
+        if value == "(":
+            prev = tokens[i - 1] if i else None
+            subquery = i + 1 < len(tokens) and tokens[i + 1][1] in _SUBQUERY_STARTS
+            openers.append(bool(prev and prev[0] == "word" and prev[1] not in _NOT_FUNCTIONS and not subquery))
+        elif value == ")":
+            openers.pop()
+        elif kind == "word" and value in ("from", "join", "table"):
+            in_function = bool(openers and openers[-1])
+            distinct_from = i and tokens[i - 1][1] == "distinct"
+            if not in_function and not distinct_from:
+                positions.append(i)
+    return positions
+
+
+def _check_tables(tokens):
+    """Every relation after FROM / JOIN (and in comma lists) must be a known table or CTE."""
+    ctes = set()
+    for i, (kind, value, _) in enumerate(tokens):
+        # "<name> AS (" declares a CTE
+        if kind in ("word", "quoted") and i + 2 < len(tokens) and tokens[i + 1][1] == "as" and tokens[i + 2][1] == "(":
+            ctes.add(_identifier(tokens[i]))
+
+    for i in _relation_positions(tokens):
+        keyword, depth = tokens[i][1], tokens[i][2]
+        j = i + 1
+        while j < len(tokens):
+            if tokens[j][1] in ("lateral", "only"):
+                j += 1
+                continue
+            if tokens[j][1] == "(":
+                break  # subquery, checked through its own FROM
+            name = _identifier(tokens[j])
+            if j + 2 < len(tokens) and tokens[j + 1][1] == ".":
+                if name != "public":
+                    raise Rejected(f"schema_not_allowed:{name}")
+                j += 2
+                name = _identifier(tokens[j])
+            if name not in ALLOWED_TABLES and name not in ctes:
+                raise Rejected(f"table_not_allowed:{name}")
+            # skip the alias, continue after a comma (FROM a, b)
+            j += 1
+            if j < len(tokens) and tokens[j][1] == "as":
+                j += 1
+            if j < len(tokens) and tokens[j][0] in ("word", "quoted") and tokens[j][1] not in _CLAUSE_WORDS:
+                j += 1
+            if keyword == "from" and j < len(tokens) and tokens[j][1] == "," and tokens[j][2] == depth:
+                j += 1
+                continue
+            break
+
+
+def validate(sql: str) -> str:
+    """
+    Static checks; returns the SQL with the row cap applied.
+    Raises Rejected(reason) for anything but one read-only SELECT over the known tables.
+
+    >>> def reason(sql):
+    ...     try:
+    ...         validate(sql)
+    ...     except Rejected as e:
+    ...         return e.reason
+    >>> reason("SELECT * FROM yearly_data y WHERE y.year = ANY(ARRAY(SELECT usesysid FROM pg_user))")
+    'table_not_allowed:pg_user'
+    >>> reason("SELECT year FROM yearly_data UNION (TABLE pg_roles)")
+    'table_not_allowed:pg_roles'
+    >>> reason("SELECT * FROM yearly_data WHERE year = ANY(ARRAY(SELECT year FROM yearly_data))")
+    >>> reason("SELECT EXTRACT(YEAR FROM DATE '2020-01-01'), SUBSTRING(city_name FROM 1 FOR 3) FROM cities")
+    """
+    sql = (sql or "").strip()
+    if not sql:
+        raise Rejected("empty")
+    sql = _TRAILING_SEMICOLONS.sub("", sql)
+    tokens = tokenize(sql)
+    if not tokens:
+        raise Rejected("empty")
+    if any(value == ";" for _, value, _ in tokens):
+        raise Rejected("multiple_statements")
+    if tokens[0][1] not in ("select", "with"):
+        raise Rejected(f"not_select:{tokens[0][1]}")
+
+    for i, (kind, value, _) in enumerate(tokens):
+        if kind != "word":
+            continue
+        if value in _FORBIDDEN_KEYWORDS:
+            raise Rejected(f"forbidden_keyword:{value}")
+        if value == "for" and i + 1 < len(tokens) and tokens[i + 1][1] in ("update", "share", "no", "key"):
+            raise Rejected("row_locking")
+        if value == "cross" and i + 1 < len(tokens) and tokens[i + 1][1] == "join":
+            raise Rejected("cross_join")
+        if i + 1 < len(tokens) and tokens[i + 1][1] == "(" and _FORBIDDEN_FUNCTIONS.match(value):
+            raise Rejected(f"forbidden_function:{value}")
+    _check_tables(tokens)
+    return _apply_row_cap(sql, tokens)
+
+
+def _apply_row_cap(sql: str, tokens) -> str:
+    """Append / tighten the top-level LIMIT so at most SQL_ROW_CAP rows come back."""
+    top = [(i, t) for i, t in enumerate(tokens) if t[2] == 0]
+    if any(value in ("fetch", "offset") for _, (_, value, _) in top):
+        return f"SELECT * FROM (\n{sql}\n) AS capped LIMIT {SQL_ROW_CAP}"
+    limits = [i for i, (_, value, _) in top if value == "limit"]
+    if not limits:
+        return f"{sql}\nLIMIT {SQL_ROW_CAP}"
+    following = tokens[limits[-1] + 1] if limits[-1] + 1 < len(tokens) else None
+    if following and following[0] == "number" and float(following[1]) <= SQL_ROW_CAP:
+        return sql
+    # LIMIT ALL / a bigger or computed limit: cap the outer result instead
+    return f"SELECT * FROM (\n{sql}\n) AS capped LIMIT {SQL_ROW_CAP}"
+
+
+class SQLGuard:
+    """
+    Gate for LLM-written SQL: static validation (single read-only SELECT over
+    the four tables, no side-effect functions), row cap injection, then the
+    planner's cost estimate against SQL_MAX_COST. Verdicts are cached per
+    SQL text; blocked queries are counted by reason.
+    """
+
+    def __init__(self, max_cost: float = SQL_MAX_COST, row_cap: int = SQL_ROW_CAP):
+        self.max_cost = max_cost
+        self.row_cap = row_cap
+        self._stats = {"checked": 0, "passed": 0, "blocked": 0, "cache_hits": 0, "reasons": {}}
+        self._recent = deque(maxlen=20)
+
+    def _block(self, sql: str, reason: str):
+        self._stats["blocked"] += 1
+        kind = reason.split(":", 1)[0]
+        self._stats["reasons"][kind] = self._stats["reasons"].get(kind, 0) + 1
+        self._recent.append({"reason": reason, "sql": sql[:300]})
+        logging.warning(f"[SQLGuard] Blocked ({reason}): {sql[:200]}")
+
+    async def _cost(self, sql: str) -> float:
+        result = await run_sql_query_async("EXPLAIN (FORMAT JSON) " + sql)
+        plan = result["rows"][0][0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return float(plan[0]["Plan"]["Total Cost"])
+
+    async def check(self, sql: str) -> dict:
+        """
+        {"ok": True, "sql": <capped sql>, "cost": float} or {"ok": False, "reason": str}.
+        """
+        self._stats["checked"] += 1
+        key = cache_service.make_key(sql, self.max_cost, self.row_cap)
+        verdict = await cache_service.guard_cache.get_async(key)
+        if verdict is not None:
+            self._stats["cache_hits"] += 1
+        else:
+            verdict = await self._verdict(sql)
+            if verdict.pop("cacheable", True):
+                await cache_service.guard_cache.set_async(key, verdict)
+        if verdict["ok"]:
+            self._stats["passed"] += 1
+        else:
+            self._block(sql, verdict["reason"])
+        return verdict
+
+    async def _verdict(self, sql: str) -> dict:
+        try:
+            capped = validate(sql)
+        except Rejected as e:
+            return {"ok": False, "reason": e.reason}
+        try:
+            cost = await self._cost(capped)
+        except Exception as e:
+            message = str(e)
+            if _SQL_ERRORS.search(message):
+                # keep the driver's message, not the wrapper text around it
+                message = _DRIVER_MESSAGE.sub("", message.splitlines()[0])
+                return {"ok": False, "reason": f"invalid_sql:{message[:200]}"}
+            return {"ok": False, "reason": "explain_failed", "cacheable": False}
+        if cost > self.max_cost:
+            return {"ok": False, "reason": f"cost_budget:{cost:.0f}>{self.max_cost:.0f}"}
+        return {"ok": True, "sql": capped, "cost": cost}
+
+    def get_report(self) -> dict:
+        return {
+            "max_cost": self.max_cost,
+            "row_cap": self.row_cap,
+            **{k: v for k, v in self._stats.items() if k != "reasons"},
+            "blocked_reasons": dict(self._stats["reasons"]),
+            "recent_blocked": list(self._recent),
+        }
+
+
+sql_guard = SQLGuard()
@@ -0,0 +1,145 @@
+# app/services/startup_service.py
+import asyncio
+import logging
+import os
+import time
+
+from app.db.session import DB_POOL_SIZE, dispose_engines, open_pool_connections, ping_async
+from app.db.utils import get_data_version_async
+from app.services import cache_service
+from app.services.aggregate_service import aggregate_cube
+from app.services.gazetteer_service import gazetteer
+from app.services.llm_client import llm_client
+from app.services.prompt_service import prompts
+
+# blocking (default): serve only after warm-up; background: serve /health at once,
+# readiness flips when warm-up is done; off: everything is built on first use
+WARMUP = os.getenv("WARMUP", "blocking").lower()
+# Pool connections opened before the first request (capped by DB_POOL_SIZE)
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", str(min(4, DB_POOL_SIZE))))
+# client (default): build the model client; ping: also make one tiny call; off
+WARMUP_LLM = os.getenv("WARMUP_LLM", "client").lower()
+# Max seconds per warm-up step
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+# Max seconds for the DB check of /health/ready
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT", "2"))
+
+
+class Startup:
+    """
+    Warm-up and health state of this process.
+    Steps: open pool connections, load the gazetteer and aggregate cube,
+    build (or ping) the LLM client, reflect the schema into the prompts. Failures are recorded, never raised:
+    everything still initializes lazily on first use, and /health/ready
+    reports 503 until the required parts work.
+    """
+
+    def __init__(self):
+        self.phase = "starting"    # starting -> warming -> ready / degraded -> stopping
+        self.steps = {}            # name -> {"status", "ms", "error"}
+        self._started = time.time()
+        self._warmup_ms = None
+        self._task = None
+
+    async def _step(self, name: str, fn):
+        started = time.perf_counter()
+        self.steps[name] = {"status": "running"}
+        try:
+            detail = await asyncio.wait_for(fn(), WARMUP_TIMEOUT)
+            self.steps[name] = {"status": "ok" if detail is not False else "failed"}
+            if detail not in (None, True, False):
+                self.steps[name]["detail"] = detail
+        except Exception as e:
+            logging.error(f"[Startup ERROR] Warm-up step '{name}' failed: {e!r}")
+            self.steps[name] = {"status": "failed", "error": str(e) or type(e).__name__}
+        self.steps[name]["ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def _db(self):
+        return {"connections": await open_pool_connections(WARMUP_DB_CONNECTIONS)}
+
+    async def _gazetteer(self):
+        await gazetteer.ensure_loaded()
+        return gazetteer.loaded
+
+    async def _cube(self):
+        if not aggregate_cube.enabled:
+            return "disabled"
+        await aggregate_cube.ensure_fresh(await cache_service.get_data_version_async(get_data_version_async))
+        return aggregate_cube.loaded
+
+    async def _llm(self):
+        await llm_client.warm_up(ping=WARMUP_LLM == "ping")
+
+    async def _prompts(self):
+        return await prompts.warm_up()
+
+    async def warm_up(self):
+        self.phase = "warming"
+        started = time.perf_counter()
+        # DB first: the loaders below reuse the connections it opens
+        await self._step("db", self._db)
+        steps = [self._step("gazetteer", self._gazetteer), self._step("aggregate_cube", self._cube),
+                 self._step("prompts", self._prompts)]
+        if WARMUP_LLM != "off":
+            steps.append(self._step("llm", self._llm))
+        await asyncio.gather(*steps)
+        self._warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+        failed = [name for name, step in self.steps.items() if step["status"] != "ok"]
+        self.phase = "degraded" if failed else "ready"
+        logging.info(
+            f"[Startup] Warm-up {self.phase} in {self._warmup_ms}ms"
+            + (f" (failed: {', '.join(failed)})" if failed else "")
+        )
+
+    async def start(self):
+        """Called from the app lifespan."""
+        if WARMUP == "off":
+            self.phase = "ready"
+        elif WARMUP == "background":
+            self._task = asyncio.create_task(self.warm_up())
+        else:
+            await self.warm_up()
+
+    async def stop(self):
+        self.phase = "stopping"
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        aggregate_cube.stop()
+        await llm_client.drop_context_caches()
+        await dispose_engines()
+
+    # ----- health -----
+    def liveness(self) -> dict:
+        """The event loop answered: the process is alive (restart only if this fails)."""
+        return {"status": "alive", "phase": self.phase, "uptime_seconds": round(time.time() - self._started, 1)}
+
+    async def readiness(self):
+        """(ready, details): warm-up finished, the DB answers, entity index and LLM client exist."""
+        checks = {}
+        if self.phase in ("starting", "warming", "stopping"):
+            checks["warmup"] = self.phase
+        try:
+            await ping_async(READY_DB_TIMEOUT)
+            checks["db"] = "ok"
+        except Exception as e:
+            checks["db"] = f"failed: {str(e) or type(e).__name__}"
+        if checks["db"] == "ok" and not gazetteer.loaded:
+            # retried here, so a replica that started before the DB recovers on its own
+            await gazetteer.ensure_loaded()
+        checks["gazetteer"] = "ok" if gazetteer.loaded else "not loaded"
+        if WARMUP_LLM != "off" and WARMUP != "off":
+            checks["llm"] = "ok" if llm_client.model_ready else self.steps.get("llm", {}).get("error", "not built")
+        ready = "warmup" not in checks and all(v == "ok" for k, v in checks.items() if k != "warmup")
+        return ready, {"status": "ready" if ready else "not ready", "phase": self.phase, "checks": checks}
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": WARMUP,
+            "phase": self.phase,
+            "warmup_ms": self._warmup_ms,
+            "uptime_seconds": round(time.time() - self._started, 1),
+            "steps": self.steps,
+        }
+
+
+startup = Startup()
@@ -0,0 +1,197 @@
+# app/services/tracing_service.py
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+
+from app.services import metrics_service as metrics
+
+# Requests slower than this (ms) are written to the slow-request log; 0 disables it
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+# JSONL file for slow requests; empty logs them as warnings instead
+SLOW_REQUEST_LOG = os.getenv("SLOW_REQUEST_LOG", "")
+
+_current = contextvars.ContextVar("trace", default=None)
+_listeners = []
+
+
+class Trace:
+    """Everything recorded while serving one request."""
+
+    def __init__(self, request_id: str, method: str = "", path: str = ""):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans = []      # [(stage, ms)]
+        self.events = []
+        self.attrs = {}
+
+    def add(self, key: str, amount: float = 1):
+        self.attrs[key] = round(self.attrs.get(key, 0) + amount, 1)
+
+    def summary(self, status: int = None) -> dict:
+        stages = {}
+        for stage, ms in self.spans:
+            stages[stage] = round(stages.get(stage, 0.0) + ms, 1)
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": stages,
+            "events": self.events,
+            **self.attrs,
+        }
+
+
+def current():
+    return _current.get()
+
+
+def start(request_id: str = None, method: str = "", path: str = "") -> Trace:
+    trace = Trace(request_id or uuid.uuid4().hex[:16], method, path)
+    _current.set(trace)
+    return trace
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Time a pipeline stage into the current trace and the stage histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.stage_duration.observe(elapsed, stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans.append((stage, elapsed * 1000))
+
+
+def traced(stage: str):
+    """Decorator: run an async function inside span(stage)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def run(*args, **kwargs):
+            with span(stage):
+                return await fn(*args, **kwargs)
+        return run
+    return wrap
+
+
+def event(name: str):
+    """Count an outcome / fallback / error path (and note it on the trace)."""
+    metrics.pipeline_events.inc(event=name)
+    trace = _current.get()
+    if trace is not None:
+        trace.events.append(name)
+
+
+def annotate(**attrs):
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def record_llm(kind: str, status: str, seconds: float, prompt_chars: int, response_chars: int,
+               prompt_tokens: int, response_tokens: int, stage: str = "generate", cached_tokens: int = 0):
+    metrics.llm_calls.inc(kind=kind, status=status)
+    metrics.llm_duration.observe(seconds, kind=kind)
+    metrics.llm_chars.inc(prompt_chars, direction="prompt")
+    metrics.llm_chars.inc(response_chars, direction="response")
+    metrics.llm_tokens.inc(prompt_tokens, direction="prompt")
+    metrics.llm_tokens.inc(response_tokens, direction="response")
+    metrics.llm_stage_tokens.inc(prompt_tokens, stage=stage, direction="prompt")
+    metrics.llm_stage_tokens.inc(cached_tokens, stage=stage, direction="cached")
+    metrics.llm_stage_tokens.inc(response_tokens, stage=stage, direction="response")
+    trace = _current.get()
+    if trace is not None:
+        trace.add("llm_calls")
+        trace.add("llm_ms", round(seconds * 1000, 1))
+        trace.add("llm_prompt_tokens", prompt_tokens)
+        trace.add("llm_response_tokens", response_tokens)
+        if cached_tokens:
+            trace.add("llm_cached_tokens", cached_tokens)
+
+
+def record_result(source: str, rows: int, seconds: float):
+    """Query result produced by `source` (cube / cache / db)."""
+    metrics.db_duration.observe(seconds, source=source)
+    metrics.db_rows.observe(rows, source=source)
+    trace = _current.get()
+    if trace is not None:
+        trace.add("result_rows", rows)
+        trace.add(f"{source}_ms", round(seconds * 1000, 1))
+
+
+def _log_slow(summary: dict):
+    if SLOW_REQUEST_LOG:
+        try:
+            with open(SLOW_REQUEST_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(summary, ensure_ascii=False, default=str) + "\n")
+            return
+        except OSError as e:
+            logging.error(f"[Trace ERROR] Cannot write slow-request log: {e}")
+    logging.warning(f"[Trace SLOW] {json.dumps(summary, ensure_ascii=False, default=str)}")
+
+
+def add_listener(fn):
+    """`fn(summary)` is called for every finished request (load tests, exporters)."""
+    _listeners.append(fn)
+
+
+def finish(trace: Trace, status: int, route: str):
+    summary = trace.summary(status)
+    seconds = summary["duration_ms"] / 1000
+    metrics.http_requests.inc(method=trace.method, route=route, status=status)
+    metrics.http_duration.observe(seconds, method=trace.method, route=route)
+    if summary["stages_ms"] or summary["events"]:
+        stages = " ".join(f"{stage}={ms}ms" for stage, ms in summary["stages_ms"].items())
+        logging.info(
+            f"[Trace] id={trace.request_id} {trace.method} {trace.path} {status} "
+            f"{summary['duration_ms']}ms {stages} events={','.join(trace.events) or '-'}"
+        )
+    if SLOW_REQUEST_MS and summary["duration_ms"] >= SLOW_REQUEST_MS:
+        _log_slow(summary)
+    for listener in _listeners:
+        listener(summary)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware: one Trace per HTTP request (X-Request-ID is reused or
+    generated and echoed back), finished once the last body byte is sent,
+    so streaming responses are timed completely.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or None
+        trace = start(request_id, scope.get("method", ""), scope.get("path", ""))
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", trace.request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            route = scope.get("route")
+            finish(trace, status, getattr(route, "path", "unmatched"))
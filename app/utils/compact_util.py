@@ -0,0 +1,219 @@
+# app/utils/compact_util.py
+import json
+import logging
+import numbers
+import os
+
+import numpy as np
+
+from app.utils.result_frame import ResultFrame
+
+EXPLAIN_TOKEN_BUDGET = int(os.getenv("EXPLAIN_TOKEN_BUDGET", "1500"))
+_CHARS_PER_TOKEN = 4          # rough size of a token in JSON-ish text
+_POINT_STEPS = (12, 8, 5, 3, 0)
+_CHANGE_STEPS = (3, 1, 0)
+
+_stats = {"prompts": 0, "compacted": 0, "chars_in": 0, "chars_out": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _num(value):
+    value = float(value)
+    return None if np.isnan(value) else round(value, 2)
+
+
+def _series_columns(columns):
+    """(key column indexes, year index, value index) or None if the result is not year series."""
+    if "year" not in columns or "value" not in columns:
+        return None
+    year, value = columns.index("year"), columns.index("value")
+    return [i for i in range(len(columns)) if i not in (year, value)], year, value
+
+
+def summarize_series(columns, rows) -> list:
+    """
+    One summary per series (rows sharing every column but year / value),
+    computed with segment reductions over the year-sorted values:
+    first / last, min / max (with year), mean, least-squares trend per year,
+    biggest year-over-year changes and the full (year, value) points.
+    """
+    keys, year_i, value_i = _series_columns(columns)
+    labels, series_ids = {}, []
+    for row in rows:
+        series_ids.append(labels.setdefault(tuple(row[i] for i in keys), len(labels)))
+    sid = np.array(series_ids)
+    years = np.array([row[year_i] for row in rows], dtype=float)
+    values = np.array([np.nan if row[value_i] is None else row[value_i] for row in rows], dtype=float)
+
+    order = np.lexsort((years, sid))
+    sid, years, values = sid[order], years[order], values[order]
+    starts = np.flatnonzero(np.r_[True, sid[1:] != sid[:-1]])
+    ends = np.r_[starts[1:], len(sid)]
+
+    valid = ~np.isnan(values)
+    v0 = np.where(valid, values, 0.0)
+    x0 = np.where(valid, years, 0.0)
+    n = np.add.reduceat(valid.astype(float), starts)
+    sx, sy = np.add.reduceat(x0, starts), np.add.reduceat(v0, starts)
+    sxx, sxy = np.add.reduceat(x0 * x0, starts), np.add.reduceat(x0 * v0, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sy / n
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    low = np.where(valid, values, np.inf)
+    high = np.where(valid, values, -np.inf)
+    seg = np.repeat(np.arange(len(starts)), ends - starts)
+    # position of min / max inside each segment: sort by (segment, value) and take the ends
+    by_low = np.lexsort((low, seg))
+    by_high = np.lexsort((-high, seg))
+
+    # year-over-year change between consecutive points of the same series
+    change = np.r_[np.nan, np.diff(values)]
+    change[starts] = np.nan
+    previous = np.r_[np.nan, values[:-1]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        change_pct = change / np.abs(previous) * 100
+
+    names = list(labels)
+    summaries = []
+    for s, (start, end) in enumerate(zip(starts, ends)):
+        count = int(n[s])
+        label = " / ".join(str(v) for v in names[sid[start]] if v not in (None, ""))
+        summary = {"series": label, "years": f"{int(years[start])}-{int(years[end - 1])}", "n": int(end - start)}
+        if count:
+            i_min, i_max = by_low[start], by_high[start]
+            valid_idx = start + np.flatnonzero(valid[start:end])
+            seg_change = change[start:end]
+            ranked = start + np.argsort(-np.nan_to_num(np.abs(seg_change), nan=-1))
+            summary.update({
+                "first": [int(years[valid_idx[0]]), _num(values[valid_idx[0]])],
+                "last": [int(years[valid_idx[-1]]), _num(values[valid_idx[-1]])],
+                "min": [int(years[i_min]), _num(values[i_min])],
+                "max": [int(years[i_max]), _num(values[i_max])],
+                "mean": _num(mean[s]),
+                "trend_per_year": _num(slope[s]) if count > 1 else None,
+                "changes": [
+                    [int(years[i]), _num(change[i]), _num(change_pct[i])]
+                    for i in ranked if not np.isnan(change[i])
+                ],
+                "points": [[int(years[i]), _num(values[i])] for i in valid_idx],
+            })
+        summaries.append(summary)
+    return summaries
+
+
+def _downsample(points: list, limit: int) -> list:
+    """Evenly spaced points, always keeping the first and last."""
+    if len(points) <= limit:
+        return points
+    if limit <= 0:
+        return []
+    index = np.unique(np.linspace(0, len(points) - 1, limit).round().astype(int))
+    return [points[i] for i in index]
+
+
+def _fit_series(summaries: list, total_rows: int, budget_chars: int) -> str:
+    """Shrink points / changes, then drop trailing series until the JSON fits the budget."""
+
+    def shape(points: int, changes: int) -> list:
+        shaped = []
+        for summary in summaries:
+            summary = dict(summary)
+            if "points" in summary:
+                summary["points"] = _downsample(summary["points"], points)
+                summary["changes"] = summary["changes"][:changes]
+                for key in ("points", "changes"):
+                    if not summary[key]:
+                        del summary[key]
+            shaped.append(summary)
+        return shaped
+
+    def render(shaped: list, keep: int) -> str:
+        note = f"summary of {total_rows} rows in {len(shaped)} series"
+        if any(len(s.get("points", ())) < s["n"] for s in shaped[:keep]):
+            note += "; points are downsampled"
+        if keep < len(shaped):
+            note += f"; {len(shaped) - keep} series omitted"
+        return _dumps({"note": note, "series": shaped[:keep]})
+
+    for points in _POINT_STEPS:
+        for changes in _CHANGE_STEPS:
+            text = render(shape(points, changes), len(summaries))
+            if len(text) <= budget_chars:
+                return text
+    shaped = shape(0, 0)
+    for keep in range(len(shaped) - 1, 0, -1):
+        text = render(shaped, keep)
+        if len(text) <= budget_chars:
+            break
+    return text
+
+
+def _fit_rows(data: dict, budget_chars: int) -> str:
+    """Non-series results: column stats plus as many leading rows as fit."""
+    columns, rows = data["columns"], data["rows"]
+    stats = {}
+    for i, column in enumerate(columns):
+        values = [r[i] for r in rows if isinstance(r[i], numbers.Number) and not isinstance(r[i], bool)]
+        if values:
+            array = np.array(values, dtype=float)
+            stats[column] = {"min": _num(array.min()), "max": _num(array.max()), "mean": _num(array.mean())}
+    low, high = 0, len(rows)
+    while low < high:
+        mid = (low + high + 1) // 2
+        text = _dumps({"columns": columns, "rows": rows[:mid], "stats": stats, "omitted_rows": len(rows) - mid})
+        if len(text) <= budget_chars:
+            low = mid
+        else:
+            high = mid - 1
+    return _dumps({"columns": columns, "rows": rows[:low], "stats": stats, "omitted_rows": len(rows) - low})
+
+
+def compact_result(data: dict, budget_tokens: int = None) -> str:
+    """
+    Serialize a ResultFrame / {"columns", "rows"} result for a prompt within `budget_tokens`.
+    Results that fit are sent unchanged; larger ones become per-series summaries
+    (or leading rows + column stats when there is no year / value series).
+    """
+    budget_tokens = EXPLAIN_TOKEN_BUDGET if budget_tokens is None else budget_tokens
+    if isinstance(data, ResultFrame):
+        data = data.to_dict()
+    full = json.dumps(data, default=str)
+    _stats["prompts"] += 1
+    if not isinstance(data, dict) or "rows" not in data or estimate_tokens(full) <= budget_tokens:
+        _stats["chars_in"] += len(full)
+        _stats["chars_out"] += len(full)
+        return full
+
+    budget_chars = budget_tokens * _CHARS_PER_TOKEN
+    try:
+        if _series_columns(data["columns"]) is not None:
+            text = _fit_series(summarize_series(data["columns"], data["rows"]), len(data["rows"]), budget_chars)
+        else:
+            text = _fit_rows(data, budget_chars)
+    except Exception as e:
+        logging.error(f"[Compaction ERROR] Falling back to rows: {e}")
+        text = _fit_rows(data, budget_chars)
+    _stats["compacted"] += 1
+    _stats["chars_in"] += len(full)
+    _stats["chars_out"] += len(text)
+    logging.info(
+        f"[Compaction] {len(data['rows'])} rows: {len(full)} -> {len(text)} chars "
+        f"(~{estimate_tokens(full)} -> ~{estimate_tokens(text)} tokens, {100 - len(text) * 100 // len(full)}% smaller)"
+    )
+    return text
+
+
+def get_stats() -> dict:
+    saved = _stats["chars_in"] - _stats["chars_out"]
+    return {
+        "token_budget": EXPLAIN_TOKEN_BUDGET,
+        **_stats,
+        "tokens_saved_est": saved // _CHARS_PER_TOKEN,
+    }
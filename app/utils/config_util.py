@@ -1,15 +1,47 @@
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise RuntimeError("Please set GOOGLE_API_KEY in .env")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+
+_configured = False
+
+
+def configure_gemini():
+    """
+    Import and configure the Gemini SDK on first use (importing it is slow and
+    nothing else needs it), so the app can start and serve non-LLM routes
+    without a key.
+    """
+    global _configured
+    import google.generativeai as genai
+
+    if not _configured:
+        if not GOOGLE_API_KEY:
+            raise RuntimeError("Please set GOOGLE_API_KEY in .env")
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _configured = True
+    return genai
 
-# Gemini config
-genai.configure(api_key=GOOGLE_API_KEY)
 
 def get_gemini_model():
-    return genai.GenerativeModel("gemini-flash-latest")
+    return configure_gemini().GenerativeModel(GEMINI_MODEL)
+
+
+def get_cached_gemini_model(prefix: str, ttl_seconds: float, display_name: str):
+    """
+    (model, cache): `prefix` stored as Gemini cached content for `ttl_seconds`, and a
+    model that answers with it in front of every request (billed at the cached rate).
+    """
+    import datetime
+
+    genai = configure_gemini()
+    cache = genai.caching.CachedContent.create(
+        model=f"models/{GEMINI_MODEL}",
+        display_name=display_name,
+        contents=[prefix],
+        ttl=datetime.timedelta(seconds=ttl_seconds),
+    )
+    return genai.GenerativeModel.from_cached_content(cached_content=cache), cache
@@ -2,12 +2,42 @@
 import re
 import json
 
-def extract_json(raw: str) -> dict:
-    """Ensure we extract valid JSON object even if model adds noise."""
+# strict=False accepts raw newlines / tabs inside strings (multi-line SQL values)
+_DECODER = json.JSONDecoder(strict=False)
+_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+
+
+def _first_object(text: str):
+    """Return the first complete JSON object found in `text`, else None."""
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = _DECODER.raw_decode(text, start)
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+def extract_json(raw: str, required: tuple = ()) -> dict:
+    """
+    Ensure we extract valid JSON object even if model adds noise
+    (markdown fences, prose before/after, trailing text, raw newlines in values).
+    Raises ValueError if no object is found or a `required` key is missing.
+    """
+    text = _FENCE.sub("", (raw or "").strip())
     try:
-        return json.loads(raw)
-    except:
-        match = re.search(r"\{.*\}", raw, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
-        raise ValueError(f"Could not parse JSON from: {raw}")
\ No newline at end of file
+        data = _DECODER.decode(text)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data = _first_object(text)
+    if data is None:
+        raise ValueError(f"Could not parse JSON from: {raw}")
+
+    missing = [key for key in required if key not in data]
+    if missing:
+        raise ValueError(f"JSON is missing keys {missing}: {raw}")
+    return data
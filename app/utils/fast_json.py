@@ -0,0 +1,53 @@
+# app/utils/fast_json.py
+import datetime
+import decimal
+import json
+
+import numpy as np
+from fastapi.responses import Response
+
+from app.utils.result_frame import ResultFrame, ORIENTS
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+
+def _default(orient: str):
+    def encode(obj):
+        if isinstance(obj, ResultFrame):
+            return obj.to_dict(orient)
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+    return encode
+
+
+def dumps(obj, orient: str = "rows") -> bytes:
+    """
+    JSON bytes for pipeline responses. ResultFrames are written in `orient`
+    ("rows" or "columns"); orjson is used when installed.
+    """
+    if orient not in ORIENTS:
+        raise ValueError(f"orient must be one of {ORIENTS}")
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default(orient), option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default(orient), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSONResponse that skips jsonable_encoder and understands ResultFrame."""
+
+    media_type = "application/json"
+
+    def __init__(self, content, orient: str = "rows", **kwargs):
+        self.orient = orient
+        super().__init__(content, **kwargs)
+
+    def render(self, content) -> bytes:
+        return dumps(content, self.orient)
@@ -0,0 +1,323 @@
+# app/utils/ingest.py
+"""
+Bulk loader for yearly_data.
+
+    python -m app.utils.ingest data/ingres_2023.csv [more files ...] [--chunk-size 50000] [--skip-existing]
+
+Source files (CSV or .xlsx) are streamed row by row, in either layout:
+  long:  state, city, parameter, unit, year, value
+  wide:  state, city, year, <one column per parameter, e.g. "Rainfall (mm)">
+Dimensions are resolved through an in-memory cache (missing ones are created),
+facts are COPYed into a staging table in chunks and upserted into yearly_data
+(ON CONFLICT on the unique key from migration 0003) in one transaction.
+Re-running a file is safe: existing (city, parameter, year) rows are updated
+(or kept with --skip-existing), never duplicated.
+"""
+import argparse
+import csv
+import io
+import os
+import re
+import time
+
+from app.db.session import get_engine
+
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "50000"))
+
+# Accepted header names -> field
+_HEADER_ALIASES = {
+    "state": "state", "state_name": "state", "state name": "state",
+    "city": "city", "city_name": "city", "city name": "city", "district": "city", "district name": "city",
+    "parameter": "parameter", "parameter_name": "parameter", "parameter name": "parameter",
+    "unit": "unit", "year": "year", "assessment year": "year", "value": "value",
+}
+_KEY_FIELDS = ("state", "city", "year")
+_WIDE_HEADER = re.compile(r"^\s*(.+?)\s*(?:\(([^)]*)\))?\s*$")   # "Rainfall (mm)" -> Rainfall, mm
+_YEAR = re.compile(r"(1[89]\d{2}|20\d{2})")                    # "2022-23" -> 2022
+_MISSING = {"", "na", "n/a", "nan", "null", "none", "-", "--"}
+_COPY_NULL = "\\N"
+
+_STAGE_DDL = """
+CREATE TEMP TABLE ingest_stage (
+  seq BIGSERIAL,
+  city_id INT,
+  parameter_id INT,
+  year INT,
+  value FLOAT
+) ON COMMIT DROP"""
+
+# last occurrence of a (city, parameter, year) in the input wins
+_LATEST_DDL = """
+CREATE TEMP TABLE ingest_latest ON COMMIT DROP AS
+SELECT DISTINCT ON (city_id, parameter_id, year) city_id, parameter_id, year, value
+FROM ingest_stage
+ORDER BY city_id, parameter_id, year, seq DESC"""
+
+# With the unique key from migration 0003: one upsert that reports inserted / updated
+_UPSERT_SQL = """
+WITH written AS (
+  INSERT INTO yearly_data (city_id, parameter_id, year, value)
+  SELECT city_id, parameter_id, year, value FROM ingest_latest
+  ON CONFLICT (city_id, parameter_id, year) DO {action}
+  RETURNING (xmax = 0) AS inserted
+)
+SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM written"""
+_UPSERT_UPDATE = "UPDATE SET value = EXCLUDED.value WHERE yearly_data.value IS DISTINCT FROM EXCLUDED.value"
+
+_HAS_UNIQUE_KEY_SQL = """
+SELECT 1 FROM pg_constraint
+WHERE conrelid = 'yearly_data'::regclass AND contype IN ('u', 'p')
+  AND conkey @> ARRAY(
+    SELECT attnum FROM pg_attribute
+    WHERE attrelid = 'yearly_data'::regclass AND attname IN ('city_id', 'parameter_id', 'year')
+  )::smallint[]
+  AND array_length(conkey, 1) = 3"""
+
+# Fallback for databases without the unique key (migrations not applied yet)
+_UPDATE_SQL = """
+UPDATE yearly_data yd
+SET value = l.value
+FROM ingest_latest l
+WHERE yd.city_id = l.city_id AND yd.parameter_id = l.parameter_id AND yd.year = l.year
+  AND yd.value IS DISTINCT FROM l.value"""
+
+_INSERT_SQL = """
+INSERT INTO yearly_data (city_id, parameter_id, year, value)
+SELECT l.city_id, l.parameter_id, l.year, l.value
+FROM ingest_latest l
+WHERE NOT EXISTS (
+  SELECT 1 FROM yearly_data yd
+  WHERE yd.city_id = l.city_id AND yd.parameter_id = l.parameter_id AND yd.year = l.year
+)"""
+
+
+# ----- SOURCE READERS -----
+def _read_csv(path: str):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.reader(f)
+
+
+def _read_xlsx(path: str):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Reading .xlsx files needs openpyxl (pip install openpyxl)")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if cell is None else str(cell) for cell in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(path: str):
+    """Stream the raw rows (header first) of a CSV or Excel file."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        return _read_xlsx(path)
+    return _read_csv(path)
+
+
+def _parse_year(raw):
+    match = _YEAR.search(str(raw))
+    return int(match.group(1)) if match else None
+
+
+def _parse_value(raw):
+    raw = str(raw).strip().replace(",", "")
+    if raw.lower() in _MISSING:
+        return None
+    return float(raw)
+
+
+def iter_records(rows, stats: dict):
+    """
+    Turn raw rows into (state, city, parameter, unit, year, value) tuples.
+    Rows with a missing key or an unparseable year / value are counted as rejected.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = [_HEADER_ALIASES.get(h.strip().lower()) for h in header]
+    missing = [f for f in _KEY_FIELDS if f not in fields]
+    if missing:
+        raise ValueError(f"Missing columns {missing} in header {header}")
+    index = {f: i for i, f in enumerate(fields) if f}
+
+    if "parameter" in index:
+        if "value" not in index:
+            raise ValueError(f"Missing column 'value' in header {header}")
+        columns = None
+    else:
+        # wide layout: every other column is a parameter
+        columns = [(i, *_WIDE_HEADER.match(h).groups()) for i, h in enumerate(header) if not fields[i] and h.strip()]
+
+    for row in rows:
+        stats["rows_read"] += 1
+        try:
+            state = row[index["state"]].strip()
+            city = row[index["city"]].strip()
+            year = _parse_year(row[index["year"]])
+            if not state or not city or year is None:
+                raise ValueError("missing key")
+            if columns is None:
+                parameter = row[index["parameter"]].strip()
+                unit = row[index["unit"]].strip() if "unit" in index else None
+                if not parameter:
+                    raise ValueError("missing parameter")
+                yield state, city, parameter, unit or None, year, _parse_value(row[index["value"]])
+            else:
+                values = [_parse_value(row[i] if i < len(row) else "") for i, _, _ in columns]
+                for (_, parameter, unit), value in zip(columns, values):
+                    yield state, city, parameter, unit or None, year, value
+        except (ValueError, IndexError):
+            stats["rows_rejected"] += 1
+
+
+# ----- DIMENSIONS -----
+class DimensionCache:
+    """
+    All states / cities / parameters in memory; missing ones are inserted on
+    first sight (inside the load transaction) and cached.
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+        cur.execute("SELECT state_name, state_id FROM states")
+        self.states = {name.strip().lower(): sid for name, sid in cur.fetchall() if name}
+        cur.execute("SELECT city_name, state_id, city_id FROM cities")
+        self.cities = {(name.strip().lower(), sid): cid for name, sid, cid in cur.fetchall() if name}
+        cur.execute("SELECT parameter_name, parameter_id FROM parameters")
+        self.parameters = {name.strip().lower(): pid for name, pid in cur.fetchall() if name}
+        self.created = {"states": 0, "cities": 0, "parameters": 0}
+
+    def _insert(self, sql: str, values: tuple, kind: str) -> int:
+        self.cur.execute(sql, values)
+        self.created[kind] += 1
+        return self.cur.fetchone()[0]
+
+    def state_id(self, name: str) -> int:
+        key = name.lower()
+        if key not in self.states:
+            self.states[key] = self._insert(
+                "INSERT INTO states (state_name) VALUES (%s) RETURNING state_id", (name,), "states"
+            )
+        return self.states[key]
+
+    def city_id(self, name: str, state_id: int) -> int:
+        key = (name.lower(), state_id)
+        if key not in self.cities:
+            self.cities[key] = self._insert(
+                "INSERT INTO cities (city_name, state_id) VALUES (%s, %s) RETURNING city_id", (name, state_id), "cities"
+            )
+        return self.cities[key]
+
+    def parameter_id(self, name: str, unit: str = None) -> int:
+        key = name.lower()
+        if key not in self.parameters:
+            self.parameters[key] = self._insert(
+                "INSERT INTO parameters (parameter_name, unit) VALUES (%s, %s) RETURNING parameter_id",
+                (name, unit), "parameters",
+            )
+        return self.parameters[key]
+
+
+# ----- LOADING -----
+def _copy_chunk(cur, buffer: io.StringIO):
+    buffer.seek(0)
+    cur.copy_expert("COPY ingest_stage (city_id, parameter_id, year, value) FROM STDIN", buffer)
+
+
+def ingest_records(records, chunk_size: int = CHUNK_SIZE, skip_existing: bool = False, stats: dict = None) -> dict:
+    """
+    Load (state, city, parameter, unit, year, value) tuples in one transaction.
+    Returns the throughput report.
+    """
+    stats = stats if stats is not None else {"rows_read": 0, "rows_rejected": 0}
+    started = time.perf_counter()
+    conn = get_engine().raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(_STAGE_DDL)
+        dims = DimensionCache(cur)
+        buffer, buffered, staged = io.StringIO(), 0, 0
+        for state, city, parameter, unit, year, value in records:
+            city_id = dims.city_id(city, dims.state_id(state))
+            parameter_id = dims.parameter_id(parameter, unit)
+            buffer.write(f"{city_id}\t{parameter_id}\t{year}\t{_COPY_NULL if value is None else repr(value)}\n")
+            buffered += 1
+            if buffered >= chunk_size:
+                _copy_chunk(cur, buffer)
+                staged += buffered
+                buffer, buffered = io.StringIO(), 0
+        if buffered:
+            _copy_chunk(cur, buffer)
+            staged += buffered
+
+        cur.execute(_LATEST_DDL)
+        distinct = cur.rowcount
+        cur.execute("ANALYZE ingest_latest")
+        cur.execute(_HAS_UNIQUE_KEY_SQL)
+        if cur.fetchone():
+            cur.execute(_UPSERT_SQL.format(action="NOTHING" if skip_existing else _UPSERT_UPDATE))
+            inserted, updated = cur.fetchone()
+        else:
+            updated = 0
+            if not skip_existing:
+                cur.execute(_UPDATE_SQL)
+                updated = cur.rowcount
+            cur.execute(_INSERT_SQL)
+            inserted = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        **stats,
+        "rows_staged": staged,
+        "inserted": inserted,
+        "updated": updated,
+        "duplicates_in_input": staged - distinct,
+        "unchanged": distinct - inserted - updated,
+        "dimensions_created": dims.created,
+        "seconds": round(elapsed, 2),
+        "rows_per_minute": int(staged / elapsed * 60) if elapsed else 0,
+    }
+
+
+def ingest_files(paths, chunk_size: int = CHUNK_SIZE, skip_existing: bool = False) -> dict:
+    """Stream every file into one load (all or nothing)."""
+    stats = {"rows_read": 0, "rows_rejected": 0}
+
+    def records():
+        for path in paths:
+            yield from iter_records(read_rows(path), stats)
+
+    return ingest_records(records(), chunk_size, skip_existing, stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load CSV / Excel files into yearly_data.")
+    parser.add_argument("files", nargs="+", help="CSV or .xlsx files (long or wide layout)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per COPY chunk")
+    parser.add_argument("--skip-existing", action="store_true", help="keep values already in the DB instead of updating them")
+    args = parser.parse_args(argv)
+
+    report = ingest_files(args.files, args.chunk_size, args.skip_existing)
+    print(
+        f"✅ Ingested {report['rows_staged']} values from {report['rows_read']} rows "
+        f"({report['rows_rejected']} rejected) in {report['seconds']}s, {report['rows_per_minute']:,} rows/min"
+    )
+    print(
+        f"   inserted {report['inserted']}, updated {report['updated']}, unchanged {report['unchanged']}, "
+        f"new dimensions {report['dimensions_created']}"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+# app/utils/loadtest.py
+"""
+Offline load test of /nlp/pipeline with the fake LLM (app/services/fake_llm.py).
+
+    python -m app.utils.loadtest --seed --requests 500 --concurrency 32 --out before.json
+    python -m app.utils.loadtest --requests 500 --concurrency 32 --out after.json
+    python -m app.utils.loadtest --compare before.json after.json
+
+By default the app runs in-process (no server, no network) with LLM_PROVIDER=fake;
+--url drives a running server instead (stage timings then come from /metrics).
+--seed applies the migrations and loads the dummy dataset of app/utils/data.py
+(plus --seed-cities synthetic cities) into DATABASE_URL first.
+
+Reported: throughput, end-to-end and per-stage p50 / p95 / p99, error and
+event counts, LLM calls, and async DB pool saturation (sampled).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+import numpy as np
+
+_SAMPLE_SECONDS = 0.02
+_HISTOGRAM_LINE = re.compile(r'^pipeline_stage_duration_seconds_bucket\{stage="(\w+)",le="([^"]+)"\} (\S+)$')
+_GAUGE_LINE = re.compile(r"^(db_pool_checked_out|db_pool_capacity|llm_in_flight|llm_queued) (\S+)$")
+
+_TEMPLATES = [
+    "{parameter} in {city} in {year}",
+    "{parameter} trend in {city} from {year} to {year2}",
+    "average {parameter} in {state} in {year}",
+    "compare {parameter} of {city} and {city2} between {year} and {year2}",
+    "{city} ka {parameter} {year} mein kitna tha",
+    "which city had the highest {parameter} in {year}",
+    "show all groundwater data for {city}",
+]
+_SMALLTALK = ["hello", "hi there", "what can you do?", "thank you"]
+
+
+def build_corpus(distinct: int, seed: int = 0, smalltalk: float = 0.05) -> list:
+    """`distinct` deterministic queries over the dummy dataset's names."""
+    from app.utils import data
+
+    rng = random.Random(seed)
+    parameters = [name.lower() for name, _ in data.parameters]
+    corpus = []
+    while len(corpus) < distinct:
+        if rng.random() < smalltalk:
+            corpus.append(rng.choice(_SMALLTALK))
+            continue
+        year = rng.choice(list(data.years)[:-3])
+        city, city2 = rng.sample(data.cities, 2)
+        query = rng.choice(_TEMPLATES).format(
+            parameter=rng.choice(parameters), city=city, city2=city2, state=data.state_name,
+            year=year, year2=year + rng.randint(1, 3),
+        )
+        if query not in corpus:
+            corpus.append(query)
+    return corpus
+
+
+def seed_database(cities: int = 0):
+    from app.db.benchmark import seed
+    from app.db.migrate import migrate
+    from app.utils.data import dummy_records
+    from app.utils.ingest import ingest_records
+
+    migrate()
+    report = ingest_records(dummy_records(), skip_existing=True)
+    print(f"✅ Dummy dataset: {report['inserted']} new rows")
+    if cities:
+        seed(cities)
+
+
+def percentiles(values) -> dict:
+    if not len(values):
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1), "max": round(float(np.max(values)), 1)}
+
+
+def _histogram_quantiles(before: dict, after: dict, quantiles=(0.5, 0.95, 0.99)) -> dict:
+    """Per-stage quantiles (ms) from the growth of cumulative /metrics buckets."""
+    stages = {}
+    for stage, buckets in after.items():
+        bounds = sorted(buckets, key=lambda le: float("inf") if le == "+Inf" else float(le))
+        counts = [buckets[le] - before.get(stage, {}).get(le, 0) for le in bounds]
+        total = counts[-1] if counts else 0
+        if not total:
+            continue
+        result = {}
+        for q in quantiles:
+            rank = q * total
+            previous_bound, previous_count = 0.0, 0
+            for le, count in zip(bounds, counts):
+                bound = float("inf") if le == "+Inf" else float(le)
+                if count >= rank:
+                    if bound == float("inf"):
+                        value = previous_bound
+                    else:
+                        share = (rank - previous_count) / max(count - previous_count, 1)
+                        value = previous_bound + (bound - previous_bound) * share
+                    result[f"p{int(q * 100)}"] = round(value * 1000, 1)
+                    break
+                previous_bound, previous_count = bound, count
+        stages[stage] = result
+    return stages
+
+
+def _parse_metrics(text: str):
+    buckets, gauges = {}, {}
+    for line in text.splitlines():
+        match = _HISTOGRAM_LINE.match(line)
+        if match:
+            buckets.setdefault(match.group(1), {})[match.group(2)] = float(match.group(3))
+            continue
+        match = _GAUGE_LINE.match(line)
+        if match:
+            gauges[match.group(1)] = float(match.group(2))
+    return buckets, gauges
+
+
+class _Sampler:
+    """Samples pool / LLM concurrency while the load runs."""
+
+    def __init__(self, read):
+        self._read = read
+        self.samples = []
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                sample = await self._read()
+            except Exception:
+                sample = None
+            if sample:
+                self.samples.append(sample)
+            try:
+                await asyncio.wait_for(stop.wait(), _SAMPLE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def report(self) -> dict:
+        if not self.samples:
+            return {}
+        used = np.array([s["checked_out"] for s in self.samples])
+        capacity = self.samples[-1]["capacity"]
+        size = self.samples[-1].get("size", capacity)
+        return {
+            "capacity": capacity,
+            "samples": len(used),
+            "checked_out_mean": round(float(used.mean()), 2),
+            "checked_out_peak": int(used.max()),
+            "over_pool_size_pct": round(float((used > size).mean() * 100), 1),
+            "saturated_pct": round(float((used >= capacity).mean() * 100), 1),
+            "llm_in_flight_peak": int(max(s.get("llm_in_flight", 0) for s in self.samples)),
+            "llm_queued_peak": int(max(s.get("llm_queued", 0) for s in self.samples)),
+        }
+
+
+async def _drive(client, queries: list, concurrency: int, mode: str, results: list):
+    queue = asyncio.Queue()
+    for query in queries:
+        queue.put_nowait(query)
+
+    async def worker():
+        while True:
+            try:
+                query = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            body = {"text": query}
+            if mode:
+                body["mode"] = mode
+            started = time.perf_counter()
+            try:
+                response = await client.post("/nlp/pipeline", json=body)
+                status = response.status_code
+                request_id = response.headers.get("x-request-id")
+            except Exception:
+                status, request_id = 0, None
+            results.append({"ms": (time.perf_counter() - started) * 1000, "status": status, "request_id": request_id})
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_load(requests: int, concurrency: int, distinct: int = 200, mode: str = None, url: str = None,
+                   warmup: int = 0, seed: int = 0) -> dict:
+    import httpx
+
+    rng = random.Random(seed)
+    corpus = build_corpus(distinct, seed)
+    queries = [rng.choice(corpus) for _ in range(requests)]
+    results, traces = [], {}
+
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=120)
+        lifespan = None
+
+        async def read():
+            buckets, gauges = _parse_metrics((await client.get("/metrics")).text)
+            if "db_pool_checked_out" not in gauges:
+                return None
+            return {
+                "checked_out": int(gauges["db_pool_checked_out"]), "capacity": int(gauges["db_pool_capacity"]),
+                "llm_in_flight": int(gauges.get("llm_in_flight", 0)), "llm_queued": int(gauges.get("llm_queued", 0)),
+            }
+    else:
+        from app.db.session import pool_status
+        from app.main import app
+        from app.services import tracing_service
+        from app.services.llm_client import llm_client
+
+        tracing_service.add_listener(lambda summary: traces.__setitem__(summary["request_id"], summary))
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=120)
+        lifespan = app.router.lifespan_context(app)
+
+        async def read():
+            status = pool_status()
+            if not status:
+                return None
+            return {
+                "checked_out": status["checked_out"], "capacity": status["size"] + status["max_overflow"],
+                "size": status["size"], "llm_in_flight": llm_client._in_flight, "llm_queued": llm_client._queued,
+            }
+
+    try:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        if warmup:
+            await _drive(client, corpus[:warmup], concurrency, mode, [])
+            traces.clear()
+        metrics_before = _parse_metrics((await client.get("/metrics")).text)[0]
+
+        sampler = _Sampler(read)
+        stop = asyncio.Event()
+        sampling = asyncio.create_task(sampler.run(stop))
+        started = time.perf_counter()
+        await _drive(client, queries, concurrency, mode, results)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampling
+        metrics_after = _parse_metrics((await client.get("/metrics")).text)[0]
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    ok = [r for r in results if r["status"] == 200]
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {"requests": requests, "concurrency": concurrency, "distinct": distinct, "mode": mode,
+                   "target": url or "in-process",
+                   "llm_provider": "server's" if url else os.getenv("LLM_PROVIDER", "gemini")},
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "errors": len(results) - len(ok),
+        "latency_ms": percentiles([r["ms"] for r in ok]),
+        "db_pool": sampler.report(),
+    }
+    request_traces = [traces[r["request_id"]] for r in results if r["request_id"] in traces]
+    if request_traces:
+        stages, events = {}, {}
+        for trace in request_traces:
+            for stage, ms in trace["stages_ms"].items():
+                stages.setdefault(stage, []).append(ms)
+            for name in trace["events"]:
+                events[name] = events.get(name, 0) + 1
+        report["stages_ms"] = {stage: {**percentiles(values), "n": len(values)} for stage, values in stages.items()}
+        report["events"] = events
+        report["llm_calls"] = sum(t.get("llm_calls", 0) for t in request_traces)
+        report["llm_tokens"] = sum(t.get("llm_prompt_tokens", 0) + t.get("llm_response_tokens", 0) for t in request_traces)
+    else:
+        report["stages_ms"] = _histogram_quantiles(metrics_before, metrics_after)
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['config']['requests']} requests @ {report['config']['concurrency']} concurrent "
+          f"({report['config']['target']}, llm={report['config']['llm_provider']})")
+    print(f"  throughput {report['throughput_rps']} req/s, errors {report['errors']}, elapsed {report['elapsed_s']}s")
+    latency = report["latency_ms"]
+    print(f"  {'end-to-end':<12} p50 {latency['p50']:>8} p95 {latency['p95']:>8} p99 {latency['p99']:>8} ms")
+    for stage, q in report["stages_ms"].items():
+        print(f"  {stage:<12} p50 {q.get('p50'):>8} p95 {q.get('p95'):>8} p99 {q.get('p99'):>8} ms")
+    if report.get("events"):
+        print("  events " + ", ".join(f"{k}={v}" for k, v in sorted(report["events"].items())))
+    if report["db_pool"]:
+        pool = report["db_pool"]
+        print(f"  db pool peak {pool['checked_out_peak']}/{pool['capacity']}, mean {pool['checked_out_mean']}, "
+              f"saturated {pool['saturated_pct']}% of samples; llm in-flight peak {pool['llm_in_flight_peak']}, "
+              f"queued peak {pool['llm_queued_peak']}")
+
+
+def compare(before: dict, after: dict):
+    rows = [("throughput_rps", before["throughput_rps"], after["throughput_rps"])]
+    for q in ("p50", "p95", "p99"):
+        rows.append((f"end-to-end {q}", before["latency_ms"][q], after["latency_ms"][q]))
+    for stage, values in after["stages_ms"].items():
+        for q in ("p50", "p99"):
+            rows.append((f"{stage} {q}", before["stages_ms"].get(stage, {}).get(q), values.get(q)))
+    print(f"{'metric':<24}{'before':>12}{'after':>12}{'change':>10}")
+    for name, b, a in rows:
+        change = f"{(a - b) / b * 100:+.1f}%" if a is not None and b else ""
+        print(f"{name:<24}{str(b):>12}{str(a):>12}{change:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of /nlp/pipeline.")
+    parser.add_argument("--requests", type=int, default=200, help="total requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--distinct", type=int, default=200, help="distinct queries in the corpus (cache hit ratio)")
+    parser.add_argument("--mode", default=None, help="pipeline mode (two_call | plan)")
+    parser.add_argument("--warmup", type=int, default=0, help="corpus queries sent before measuring")
+    parser.add_argument("--url", default=None, help="running server to drive instead of the in-process app")
+    parser.add_argument("--seed", action="store_true", help="migrate and load the dummy dataset first")
+    parser.add_argument("--seed-cities", type=int, default=0, help="also load this many synthetic cities")
+    parser.add_argument("--random-seed", type=int, default=0, help="seed of the query mix")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two saved reports")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return
+    if not args.url:
+        os.environ.setdefault("LLM_PROVIDER", "fake")
+    if args.seed or args.seed_cities:
+        seed_database(args.seed_cities)
+    report = asyncio.run(run_load(
+        args.requests, args.concurrency, args.distinct, args.mode, args.url, args.warmup, args.random_seed
+    ))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
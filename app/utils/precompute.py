@@ -0,0 +1,44 @@
+# app/utils/precompute.py
+"""
+Precompute answers for the most asked questions in the query log.
+
+    python -m app.utils.precompute [--top 50] [--log .cache/query_log.jsonl] [--list]
+
+The server already does this at startup and whenever yearly_data changes;
+run it by hand after a bulk load to warm a shared (CACHE_BACKEND=disk) cache
+before traffic arrives. With the in-memory cache the answers only live in this
+process, so it is useful for --list only.
+"""
+import argparse
+import asyncio
+import os
+
+from app.services import query_log_service
+from app.services.precompute_service import PRECOMPUTE_TOP_N, precomputer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute answers for the most asked questions.")
+    parser.add_argument("--top", type=int, default=PRECOMPUTE_TOP_N, help="questions per language")
+    parser.add_argument("--log", default=query_log_service.QUERY_LOG_PATH, help="query log (JSONL) to mine")
+    parser.add_argument("--list", action="store_true", help="only print the selected questions")
+    args = parser.parse_args(argv)
+
+    if not args.log or not os.path.exists(args.log):
+        print(f"❌ No query log at '{args.log}'")
+        return None
+    if args.list:
+        questions = precomputer.select(args.top, args.log)
+        for entry in questions:
+            print(f"{entry['count']:>6}  [{entry['lang']}/{entry['style']}]  {entry['normalized']}")
+        return questions
+    if os.getenv("CACHE_BACKEND", "memory").lower() != "disk":
+        print("⚠️ CACHE_BACKEND is not disk: answers are cached in this process only and lost on exit")
+
+    outcome = asyncio.run(precomputer.run("cli", args.top, args.log))
+    print(f"✅ Precomputed {outcome['answered']}/{outcome['questions']} questions ({outcome['failed']} failed)")
+    return outcome
+
+
+if __name__ == "__main__":
+    main()
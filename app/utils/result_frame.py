@@ -0,0 +1,227 @@
+# app/utils/result_frame.py
+import datetime
+import decimal
+import hashlib
+import json
+
+import numpy as np
+
+ORIENTS = ("rows", "columns")
+
+# Column types: "int" / "float" are numpy arrays, everything else a list.
+# NULL is NaN, so an "int" column with NULLs is held as float64.
+_NUMERIC = ("int", "float")
+
+
+def _column_type(values: list) -> str:
+    """Type of a column from its first non-NULL value."""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return "bool"
+        if isinstance(value, int):
+            return "int"
+        if isinstance(value, (float, decimal.Decimal)):
+            return "float"
+        if isinstance(value, (datetime.date, datetime.time)):
+            return "datetime"
+        if isinstance(value, str):
+            return "text"
+        return "other"
+    return "text"
+
+
+def _floats(values: list):
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _convert(values: list, kind: str):
+    """One pass from driver values to the column representation."""
+    if kind == "int":
+        if all(type(v) is int for v in values):
+            return np.array(values, dtype=np.int64), kind
+        if all(v is None or type(v) is int for v in values):
+            return _floats(values), kind
+        return _floats(values), "float"  # mixed int / numeric values
+    if kind == "float":
+        return _floats(values), kind
+    if kind == "datetime":
+        return [None if v is None else v.isoformat() for v in values], kind
+    if kind == "other":
+        return [None if v is None else str(v) for v in values], kind
+    return values, kind
+
+
+def _plain(column, kind: str) -> list:
+    """Column as JSON-ready Python values (NaN -> None)."""
+    if kind in _NUMERIC and column.dtype.kind == "f":
+        nulls = np.isnan(column)
+        with np.errstate(invalid="ignore"):
+            values = column.astype(np.int64).tolist() if kind == "int" else column.tolist()
+        for i in np.flatnonzero(nulls):
+            values[i] = None
+        return values
+    if kind == "int":
+        return column.tolist()
+    return column
+
+
+class ResultFrame:
+    """
+    Query result held by column: numeric columns are numpy arrays, the rest
+    plain lists, all converted once when the rows are fetched.
+
+    Reads like the old {"columns", "rows"} dict (`frame["rows"]`,
+    `frame.get("rows")`), row lists being built lazily on first access.
+    """
+
+    __slots__ = ("columns", "types", "data", "_rows", "_digest")
+
+    def __init__(self, columns: list, types: list, data: list):
+        self.columns = list(columns)
+        self.types = list(types)
+        self.data = data
+        self._rows = None
+        self._digest = None
+
+    # ----- construction -----
+    @classmethod
+    def from_columns(cls, columns: list, values: list) -> "ResultFrame":
+        """`values` is one Python list per column."""
+        types, data = [], []
+        for column in values:
+            converted, kind = _convert(column, _column_type(column))
+            types.append(kind)
+            data.append(converted)
+        return cls(columns, types, data)
+
+    @classmethod
+    def from_rows(cls, columns: list, rows) -> "ResultFrame":
+        rows = list(rows)
+        values = [list(col) for col in zip(*rows)] if rows else [[] for _ in columns]
+        return cls.from_columns(columns, values)
+
+    @classmethod
+    def from_dict(cls, payload: dict) -> "ResultFrame":
+        """Accepts both orients produced by to_dict()."""
+        if isinstance(payload, cls):
+            return payload
+        if "data" not in payload:
+            return cls.from_rows(payload["columns"], payload["rows"])
+        data = []
+        for column, kind in zip(payload["data"], payload["types"]):
+            if kind in _NUMERIC:
+                column = _convert(column, kind)[0]
+            data.append(column)
+        return cls(payload["columns"], payload["types"], data)
+
+    @classmethod
+    def concat(cls, frames: list) -> "ResultFrame":
+        """Rows of several frames with the same columns, in order."""
+        columns = frames[0].columns
+        values = [[] for _ in columns]
+        for frame in frames:
+            for out, column, kind in zip(values, frame.data, frame.types):
+                out.extend(_plain(column, kind))
+        return cls.from_columns(columns, values)
+
+    # ----- access -----
+    def __len__(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    def __getitem__(self, key):
+        if key == "columns":
+            return self.columns
+        if key == "rows":
+            return self.rows
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def rows(self) -> list:
+        if self._rows is None:
+            plain = [_plain(column, kind) for column, kind in zip(self.data, self.types)]
+            self._rows = [list(row) for row in zip(*plain)]
+        return self._rows
+
+    def column(self, name: str):
+        return self.data[self.columns.index(name)]
+
+    def take(self, indexes) -> "ResultFrame":
+        """New frame with the rows at `indexes` (array of positions)."""
+        indexes = np.asarray(indexes, dtype=np.intp)
+        data = [
+            column[indexes] if kind in _NUMERIC else [column[i] for i in indexes]
+            for column, kind in zip(self.data, self.types)
+        ]
+        return ResultFrame(self.columns, self.types, data)
+
+    def where_in(self, name: str, values) -> "ResultFrame":
+        wanted = set(values)
+        column = self.column(name)
+        return self.take([i for i, value in enumerate(column) if value in wanted])
+
+    def sort_by(self, names: list) -> "ResultFrame":
+        """New frame ordered by the columns `names` (NULLs last)."""
+        keys = [_plain(self.column(name), self.types[self.columns.index(name)]) for name in names]
+        order = sorted(range(len(self)), key=lambda i: [(key[i] is None, 0 if key[i] is None else key[i]) for key in keys])
+        return self.take(order)
+
+    def approx_bytes(self) -> int:
+        """Rough memory held by the frame (numeric buffers + text values)."""
+        total = 0
+        for column, kind in zip(self.data, self.types):
+            if kind in _NUMERIC:
+                total += column.nbytes
+            else:
+                total += sum(56 + len(value) if isinstance(value, str) else 16 for value in column)
+        return total
+
+    # ----- output -----
+    def to_dict(self, orient: str = "rows") -> dict:
+        """
+        "rows":    {"columns", "rows"} (the original response shape)
+        "columns": {"columns", "types", "data"} with one value list per column
+        """
+        if orient == "columns":
+            return {
+                "columns": self.columns,
+                "types": self.types,
+                "data": [_plain(column, kind) for column, kind in zip(self.data, self.types)],
+            }
+        return {"columns": self.columns, "rows": self.rows}
+
+    def digest(self) -> str:
+        """Content hash (for cache keys) without serializing the rows."""
+        if self._digest is None:
+            h = hashlib.sha256(json.dumps([self.columns, self.types]).encode("utf-8"))
+            for column, kind in zip(self.data, self.types):
+                if kind in _NUMERIC:
+                    h.update(np.ascontiguousarray(column).tobytes())
+                else:
+                    h.update(json.dumps(column, default=str, ensure_ascii=False).encode("utf-8"))
+            self._digest = h.hexdigest()
+        return self._digest
+
+
+class FrameBuilder:
+    """Collects fetched row chunks column by column (no per-row lists are kept)."""
+
+    def __init__(self, columns: list):
+        self.columns = list(columns)
+        self._values = [[] for _ in self.columns]
+
+    def extend(self, rows):
+        if not rows:
+            return
+        for values, column in zip(self._values, zip(*rows)):
+            values.extend(column)
+
+    def build(self) -> ResultFrame:
+        return ResultFrame.from_columns(self.columns, self._values)